@@ -0,0 +1,282 @@
+""" benchmarks for the notebook setup and I/O paths
+
+notes:
+- the bucket is a gatk.storage.LocalStore, made the default store, so
+gatk_init, check_files and sync_sandbox run unmodified without network.
+- the synthetic dataset mirrors the germline tutorial layout: many small
+files under ref/ and resources/ (log-normal sizes around --small-size) and a
+few large BAMs under bams/. It is kept in --workdir and only rebuilt when its
+parameters change.
+- every scenario reports wall time, throughput, per-file latency percentiles
+and the tracemalloc peak of Python allocations. tracemalloc slows a run
+several fold, so each scenario runs twice from the same starting state: once
+timed with tracemalloc off, once for the memory peak. The process ru_maxrss is
+not reported; it is a high-water mark for the whole run, so every scenario
+after the largest would show that one's peak. Results are written as JSON;
+--compare prints the ratio against an earlier results file.
+
+usage:
+    python benchmarks/bench_setup.py --small-files 500 --bams 2 --bam-size 2G -o before.json
+    python benchmarks/bench_setup.py ... -o after.json --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('WORKSPACE_BUCKET', 'gs://bench-workspace')
+
+from gatk import gatk_setup_fns  # noqa: E402
+from gatk.manifest import ManifestEntry  # noqa: E402
+from gatk.storage import LocalStore, session_listings, set_default_store  # noqa: E402
+from gatk.sync import MANIFEST_NAME  # noqa: E402
+
+
+BUCKET = 'gs://bench-data/tutorial'
+BLOCK = 1 << 20
+TUTORIAL = 'bench'
+
+
+def parse_size(text):
+    ''' '512', '64K', '2M', '3G' -> bytes
+    '''
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = str(text).upper().rstrip('B')
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _chunks(size, seed, block):
+    ''' size bytes of a repeated random block, varied per file by the seed
+    '''
+    header = seed.to_bytes(8, 'little')
+    yield header[:size]
+    remaining = size - len(header[:size])
+    while remaining > 0:
+        n = min(remaining, len(block))
+        yield block[:n]
+        remaining -= n
+
+
+def dataset_layout(args):
+    ''' [(relative object name, size)] for the synthetic tutorial folder
+    '''
+    rng = random.Random(args.seed)
+    files = []
+    for i in range(args.small_files):
+        folder = 'ref' if i % 4 == 0 else 'resources'
+        size = max(1, int(rng.lognormvariate(0, 1) * args.small_size))
+        files.append(('{}/file{:05d}.dat'.format(folder, i), size))
+    for i in range(args.bams):
+        files.append(('bams/sample{}.bam'.format(i), args.bam_size))
+    return files
+
+
+def build_dataset(args, store_root):
+    ''' write the dataset unless the same one is already there
+    '''
+    layout = dataset_layout(args)
+    stamp_path = os.path.join(store_root, 'dataset.json')
+    try:
+        with open(stamp_path) as f:
+            if json.load(f) == layout:
+                return layout
+    except (IOError, ValueError):
+        pass
+    shutil.rmtree(store_root, ignore_errors=True)
+    store = LocalStore(store_root)
+    block = random.Random(args.seed).randbytes(BLOCK)
+    for i, (name, size) in enumerate(layout):
+        store.write(BUCKET + '/' + name, _chunks(size, i, block))
+    with open(stamp_path, 'w') as f:
+        json.dump(layout, f)
+    return layout
+
+
+def configure_tutorial(notebook_dir, cache_dir):
+    ''' point gatk_setup_fns at the benchmark bucket and directories
+    '''
+    gatk_setup_fns.file_directories[TUTORIAL] = [os.path.join(notebook_dir, d)
+                                                 for d in ('sandbox', 'ref', 'resources')]
+    gatk_setup_fns.sandbox_directories[TUTORIAL] = os.path.join(notebook_dir, 'sandbox')
+    gatk_setup_fns.check_data_urls[TUTORIAL] = BUCKET + '/**'
+    gatk_setup_fns.data_manifests[TUTORIAL] = [
+        ManifestEntry(BUCKET + '/ref/*', notebook_dir + '/ref/', group='ref'),
+        ManifestEntry(BUCKET + '/resources/*', notebook_dir + '/resources/', group='resources'),
+        ManifestEntry(BUCKET + '/bams/**', notebook_dir + '/bams/', group='bams')]
+    gatk_setup_fns.CACHE_DIR = cache_dir
+
+
+def measure(name, fn, prepare=None):
+    ''' run fn() from the state prepare() sets up, once timed and once under
+    tracemalloc for its memory peak, and describe the timed run; fn returns a
+    list of TransferResults or objects
+    '''
+    if prepare:
+        prepare()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = fn()
+    seconds = time.perf_counter() - start
+    if prepare:
+        prepare()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = [r.seconds for r in results if hasattr(r, 'seconds')]
+    moved = sum(r.bytes for r in results
+                if getattr(r, 'status', None) in ('copied', 'cached', 'uploaded'))
+    return {'name': name,
+            'seconds': seconds,
+            'files': len(results),
+            'bytes': moved,
+            'mb_per_second': moved / 1e6 / seconds if seconds else None,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p90': percentile(latencies, 90),
+            'latency_p99': percentile(latencies, 99),
+            'tracemalloc_peak_bytes': peak}
+
+
+def run_scenarios(args):
+    store_root = os.path.join(args.workdir, 'bucket')
+    notebook_dir = os.path.join(args.workdir, 'notebook')
+    cache_dir = os.path.join(args.workdir, 'cache')
+    build_dataset(args, store_root)
+    set_default_store(LocalStore(store_root))
+    configure_tutorial(notebook_dir, cache_dir)
+
+    def fresh(cache=True):
+        session_listings.clear()
+        shutil.rmtree(notebook_dir, ignore_errors=True)
+        if cache:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        for path in gatk_setup_fns.file_directories[TUTORIAL]:
+            os.makedirs(path, exist_ok=True)
+
+    def sandbox_files():
+        sandbox = gatk_setup_fns.sandbox_directories[TUTORIAL]
+        rng = random.Random(args.seed)
+        for i in range(args.sandbox_files):
+            with open(os.path.join(sandbox, 'out{:04d}.vcf'.format(i)), 'wb') as f:
+                f.write(rng.randbytes(args.small_size))
+        # forget earlier uploads, so every file is sent again
+        manifest = os.path.join(sandbox, MANIFEST_NAME)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+
+    # scenarios without prepare start from the state the one before leaves,
+    # which running them does not change
+    results = []
+    for repeat in range(args.repeat):
+        results.append(measure('check_files cold', lambda: gatk_setup_fns.check_files(BUCKET + '/**'),
+                               prepare=fresh))
+        results.append(measure('check_files warm', lambda: gatk_setup_fns.check_files(BUCKET + '/**')))
+        results.append(measure('gatk_init, no cache',
+                               lambda: gatk_setup_fns.gatk_init(TUTORIAL, max_workers=args.workers,
+                                                                use_cache=False),
+                               prepare=fresh))
+        results.append(measure('gatk_init cold',
+                               lambda: gatk_setup_fns.gatk_init(TUTORIAL, max_workers=args.workers),
+                               prepare=fresh))
+        results.append(measure('gatk_init unchanged',
+                               lambda: gatk_setup_fns.gatk_init(TUTORIAL, max_workers=args.workers)))
+        results.append(measure('gatk_init from cache',
+                               lambda: gatk_setup_fns.gatk_init(TUTORIAL, max_workers=args.workers),
+                               prepare=lambda: fresh(cache=False)))
+        results.append(measure('sync_sandbox first',
+                               lambda: gatk_setup_fns.sync_sandbox(TUTORIAL, max_workers=args.workers),
+                               prepare=sandbox_files))
+        results.append(measure('sync_sandbox unchanged',
+                               lambda: gatk_setup_fns.sync_sandbox(TUTORIAL, max_workers=args.workers)))
+        for r in results[-8:]:
+            r['repeat'] = repeat
+    return results
+
+
+def summarize_runs(results):
+    ''' median seconds and throughput per scenario across repeats
+    '''
+    names = []
+    for r in results:
+        if r['name'] not in names:
+            names.append(r['name'])
+    summary = {}
+    for name in names:
+        runs = [r for r in results if r['name'] == name]
+        rates = [r['mb_per_second'] for r in runs if r['mb_per_second']]
+        summary[name] = {'seconds': percentile([r['seconds'] for r in runs], 50),
+                         'mb_per_second': percentile(rates, 50),
+                         'tracemalloc_peak_bytes': max(r['tracemalloc_peak_bytes'] for r in runs)}
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    print('{:26} {:>10} {:>10} {:>12}{}'.format('scenario', 'seconds', 'MB/s', 'peak MB',
+                                                '  vs baseline' if baseline else ''))
+    for name, s in summary.items():
+        line = '{:26} {:10.3f} {:>10} {:12.1f}'.format(
+            name, s['seconds'], '{:.1f}'.format(s['mb_per_second']) if s['mb_per_second'] else '-',
+            s['tracemalloc_peak_bytes'] / 2**20)
+        if baseline and name in baseline:
+            line += '  {:.2f}x time'.format(s['seconds'] / baseline[name]['seconds'])
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workdir', default='/tmp/terranblib-bench')
+    parser.add_argument('--small-files', type=int, default=200)
+    parser.add_argument('--small-size', type=parse_size, default='64K',
+                        help='typical size of the small files')
+    parser.add_argument('--bams', type=int, default=2)
+    parser.add_argument('--bam-size', type=parse_size, default='256M')
+    parser.add_argument('--sandbox-files', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=gatk_setup_fns.DEFAULT_MAX_WORKERS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default='bench_setup.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    results = run_scenarios(args)
+    summary = summarize_runs(results)
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'machine': platform.platform(),
+              'parameters': dict((k, v) for k, v in vars(args).items() if k not in ('output', 'compare')),
+              'summary': summary,
+              'runs': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['summary']
+    print_summary(summary, baseline)
+    print('results written to ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
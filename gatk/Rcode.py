@@ -1,5 +1,7 @@
 %%R
 
+# Rcode.py holds this same code behind a %%R line, to paste into a notebook cell;
+# tests/test_plotting.py checks that the two files match
 # plotting.R script loads ggplot and gridExtra libraries and defines functions to plot variant annotations 
 library(ggplot2)
 install.packages("gridExtra")
@@ -15,6 +17,58 @@ get_legend<-function(myggplot){
   return(legend)
 }
 
+# Bin two annotations into a bins x bins grid (per split group) so that plots scale with
+# the grid size instead of the number of variants. Returns the non-empty cells with their
+# counts plus marginal densities of each annotation computed from the same bins.
+binAnnotations <- function(dataframe, xvar, yvar, split=NULL, xmin, xmax, ymin, ymax, bins=100) {
+  x <- dataframe[[xvar]]
+  y <- dataframe[[yvar]]
+  # a constant annotation gives equal limits; widen them by half a unit, as ggplot does
+  if(xmax == xmin) { xmin <- xmin - 0.5; xmax <- xmax + 0.5 }
+  if(ymax == ymin) { ymin <- ymin - 0.5; ymax <- ymax + 0.5 }
+  keep <- is.finite(x) & is.finite(y) & x >= xmin & x <= xmax & y >= ymin & y <= ymax
+  xw <- (xmax - xmin) / bins
+  yw <- (ymax - ymin) / bins
+  xi <- pmin(floor((x[keep] - xmin) / xw), bins - 1)
+  yi <- pmin(floor((y[keep] - ymin) / yw), bins - 1)
+  if(is.null(split)) {
+    group <- factor(rep("all", sum(keep)))
+  }
+  else {
+    group <- factor(dataframe[[split]][keep])
+  }
+  g <- as.integer(group) - 1
+  ngroups <- nlevels(group)
+  n <- tabulate(g + 1, nbins=ngroups)
+
+  counts <- tabulate(xi + bins * yi + bins * bins * g + 1, nbins=bins * bins * ngroups)
+  cells <- which(counts > 0) - 1
+  xy <- data.frame(x = xmin + (cells %% bins + 0.5) * xw,
+                   y = ymin + ((cells %/% bins) %% bins + 0.5) * yw,
+                   group = factor(levels(group)[cells %/% (bins * bins) + 1], levels=levels(group)),
+                   count = counts[cells + 1])
+
+  xcounts <- tabulate(xi + bins * g + 1, nbins=bins * ngroups)
+  ycounts <- tabulate(yi + bins * g + 1, nbins=bins * ngroups)
+  groups <- factor(rep(levels(group), each=bins), levels=levels(group))
+  xmarginal <- data.frame(x = rep(xmin + (0:(bins - 1) + 0.5) * xw, ngroups), group = groups,
+                          density = xcounts / (rep(n, each=bins) * xw))
+  ymarginal <- data.frame(y = rep(ymin + (0:(bins - 1) + 0.5) * yw, ngroups), group = groups,
+                          density = ycounts / (rep(n, each=bins) * yw))
+  return(list(xy=xy, x=xmarginal, y=ymarginal, xw=xw, yw=yw, xlim=c(xmin,xmax), ylim=c(ymin,ymax)))
+}
+
+# Density-shaded grid cells in place of one point per variant
+makeBinnedScatter <- function(binned, xvar, yvar, split=NULL) {
+  if(is.null(split)) {
+    plot <- ggplot(data=binned$xy, aes(x=x, y=y, fill=count)) + geom_tile(width=binned$xw, height=binned$yw) + scale_fill_gradient(low="grey85", high="black", trans="log10")
+  }
+  else {
+    plot <- ggplot(data=binned$xy, aes(x=x, y=y, fill=group, alpha=count)) + geom_tile(width=binned$xw, height=binned$yw) + scale_alpha(trans="log10", range=c(0.2, 1)) + labs(fill=split)
+  }
+  return(plot + xlab(xvar) + ylab(yvar) + coord_cartesian(xlim=binned$xlim, ylim=binned$ylim, expand=FALSE))
+}
+
 
 # Function for making density plots of a single annotation
 makeDensityPlot <- function(dataframe, xvar, split, xmin=min(dataframe[xvar], na.rm=TRUE), xmax=max(dataframe[xvar], na.rm=TRUE), alpha=0.5) {
@@ -28,7 +82,13 @@ makeDensityPlot <- function(dataframe, xvar, split, xmin=min(dataframe[xvar], na
 }
 
 # Function for making scatter plots of two annotations
-makeScatterPlot <- function(dataframe, xvar, yvar, split, xmin=min(dataframe[xvar], na.rm=TRUE), xmax=max(dataframe[xvar], na.rm=TRUE), ymin=min(dataframe[yvar], na.rm=TRUE), ymax=max(dataframe[yvar], na.rm=TRUE), ptSize=1, alpha=0.6) {
+# Set bins (e.g. bins=100) to aggregate large callsets into a bins x bins grid
+makeScatterPlot <- function(dataframe, xvar, yvar, split, xmin=min(dataframe[xvar], na.rm=TRUE), xmax=max(dataframe[xvar], na.rm=TRUE), ymin=min(dataframe[yvar], na.rm=TRUE), ymax=max(dataframe[yvar], na.rm=TRUE), ptSize=1, alpha=0.6, bins=NULL) {
+  if(!is.null(bins)) {
+    if(missing(split)) split <- NULL
+    binned <- binAnnotations(dataframe, xvar, yvar, split, xmin, xmax, ymin, ymax, bins)
+    return(makeBinnedScatter(binned, xvar, yvar, split))
+  }
   if(missing(split)) {
     return(ggplot(data=dataframe) + aes_string(x=xvar, y=yvar) + xlim(xmin,xmax) + ylim(ymin,ymax) + geom_point(size=ptSize, alpha=alpha) )
   }
@@ -38,7 +98,8 @@ makeScatterPlot <- function(dataframe, xvar, yvar, split, xmin=min(dataframe[xva
 }
 
 # Function for making scatter plots of two annotations with marginal density plots of each
-makeScatterPlotWithMarginalDensity <- function(dataframe, xvar, yvar, split, xmin=min(dataframe[xvar], na.rm=TRUE), xmax=max(dataframe[xvar], na.rm=TRUE), ymin=min(dataframe[yvar], na.rm=TRUE), ymax=max(dataframe[yvar], na.rm=TRUE), ptSize=1, ptAlpha=0.6, fillAlpha=0.5) {
+# Set bins to draw the scatter as a grid of counts and the marginal densities from the same bins
+makeScatterPlotWithMarginalDensity <- function(dataframe, xvar, yvar, split, xmin=min(dataframe[xvar], na.rm=TRUE), xmax=max(dataframe[xvar], na.rm=TRUE), ymin=min(dataframe[yvar], na.rm=TRUE), ymax=max(dataframe[yvar], na.rm=TRUE), ptSize=1, ptAlpha=0.6, fillAlpha=0.5, bins=NULL) {
   empty <- ggplot()+geom_point(aes(1,1), colour="white") +
     theme(
       plot.background = element_blank(), 
@@ -53,7 +114,20 @@ makeScatterPlotWithMarginalDensity <- function(dataframe, xvar, yvar, split, xmi
       axis.ticks = element_blank()
     )
   
-  if(missing(split)){
+  if(!is.null(bins)){
+    splitvar <- if(missing(split)) NULL else split
+    binned <- binAnnotations(dataframe, xvar, yvar, splitvar, xmin, xmax, ymin, ymax, bins)
+    scatter <- makeBinnedScatter(binned, xvar, yvar, splitvar)
+    if(is.null(splitvar)) {
+      plot_top <- ggplot(data=binned$x, aes(x=x, y=density)) + geom_line() + theme(legend.position="none") + coord_cartesian(xlim=binned$xlim, expand=FALSE)
+      plot_right <- ggplot(data=binned$y, aes(x=y, y=density)) + geom_line() + coord_flip(xlim=binned$ylim, expand=FALSE) + theme(legend.position="none")
+    }
+    else {
+      plot_top <- ggplot(data=binned$x, aes(x=x, y=density, fill=group)) + geom_area(position="identity", alpha=fillAlpha, colour="black") + theme(legend.position="none") + coord_cartesian(xlim=binned$xlim, expand=FALSE)
+      plot_right <- ggplot(data=binned$y, aes(x=y, y=density, fill=group)) + geom_area(position="identity", alpha=fillAlpha, colour="black") + coord_flip(xlim=binned$ylim, expand=FALSE) + theme(legend.position="none")
+    }
+  }
+  else if(missing(split)){
     scatter <- ggplot(data=dataframe) + aes_string(x=xvar, y=yvar) + geom_point(size=ptSize, alpha=ptAlpha) + xlim(xmin,xmax) + ylim(ymin,ymax) 
     plot_top <- ggplot(data=dataframe, aes_string(x=xvar)) + geom_density(alpha=fillAlpha) + theme(legend.position="none") + xlim(xmin,xmax) 
     plot_right <- ggplot(data=dataframe, aes_string(x=yvar)) + geom_density(alpha=fillAlpha) + coord_flip() + theme(legend.position="none") + xlim(ymin,ymax) 
@@ -0,0 +1,161 @@
+""" INFO annotations of a callset as NumPy columns, ready for plotting
+
+notes:
+- the VCF is read once and handled in batches of raw lines: each batch is
+split into columns and all requested INFO keys are pulled out of the whole
+batch with a single regular expression pass, so no per-record dict is built.
+- annotations are float32 with NaN where a site does not carry them; only the
+first value of multi-valued keys (Number=A) is kept.
+- CHROM, FILTER and TYPE are categorical: small integer codes plus a list of
+categories, which keeps tens of millions of sites in memory.
+
+usage, feeding the Rcode.py plotting functions:
+    table = extract_annotations('trioGGVCF.vcf')
+    df = table.to_frame()
+"""
+import re
+
+import numpy as np
+
+from gatk.vcf import VCFReader
+from gatk.vcf_columns import batches
+
+
+DEFAULT_ANNOTATIONS = ('QD', 'FS', 'MQ', 'SOR', 'MQRankSum', 'ReadPosRankSum')
+DEFAULT_BATCH_SIZE = 100000
+CATEGORICAL = ('CHROM', 'FILTER', 'TYPE')
+
+
+def _float_column(values):
+    arr = np.asarray(values, dtype=str)
+    return np.where((arr == '.') | (arr == ''), 'nan', arr).astype(np.float32)
+
+
+def _info_columns(info, keys):
+    ''' {key: float32 column} for a batch of INFO strings
+
+    One findall over the joined batch returns (key, value) pairs, with empty
+    pairs marking line breaks; a cumulative sum over those gives the row of
+    every value.
+    '''
+    n = len(info)
+    columns = dict((key, np.full(n, np.nan, dtype=np.float32)) for key in keys)
+    pattern = r'\n|(?:^|;)(' + '|'.join(re.escape(k) for k in keys) + r')=([^;,\n]*)'
+    found = re.findall(pattern, '\n'.join(info), re.M)
+    if not found:
+        return columns
+    found = np.array(found, dtype=str).reshape(-1, 2)
+    newline = found[:, 0] == ''
+    rows = np.cumsum(newline)[~newline]
+    found = found[~newline]
+    for key in keys:
+        mask = found[:, 0] == key
+        if mask.any():
+            columns[key][rows[mask]] = _float_column(found[mask, 1])
+    return columns
+
+
+def variant_types(ref, alt):
+    ''' SNP, MNP, INDEL, MIXED, SYMBOLIC or NO_VARIATION for arrays of REF/ALT strings
+    '''
+    ref = np.asarray(ref, dtype=str)
+    # GVCF sites list <NON_REF> after the real alleles
+    alt = np.char.replace(np.asarray(alt, dtype=str), ',<NON_REF>', '')
+    ref_len = np.char.str_len(ref)
+    alt_len = np.char.str_len(alt)
+    n_alts = np.char.count(alt, ',') + 1
+    types = np.full(len(ref), 'MIXED', dtype='<U12')
+    single = n_alts == 1
+    types[single & (ref_len == alt_len) & (ref_len == 1)] = 'SNP'
+    types[single & (ref_len == alt_len) & (ref_len > 1)] = 'MNP'
+    types[single & (ref_len != alt_len)] = 'INDEL'
+    # multi-allelic sites where every allele is a single base
+    types[~single & (ref_len == 1) & (alt_len == 2 * n_alts - 1)] = 'SNP'
+    types[np.char.startswith(alt, '<')] = 'SYMBOLIC'
+    types[alt == '.'] = 'NO_VARIATION'
+    return types
+
+
+class _Categories(object):
+    ''' grows one category list across batches and hands out stable codes
+    '''
+
+    def __init__(self):
+        self.categories = []
+        self._codes = {}
+
+    def encode(self, values):
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        lookup = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            if value not in self._codes:
+                self._codes[value] = len(self.categories)
+                self.categories.append(str(value))
+            lookup[i] = self._codes[value]
+        return lookup[inverse.ravel()]
+
+
+class AnnotationTable(object):
+    ''' columns: {name: array}; categorical columns hold codes into categories[name]
+    '''
+
+    def __init__(self, columns, categories):
+        self.columns = columns
+        self.categories = categories
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.columns['POS'])
+
+    def labels(self, name):
+        ''' a categorical column decoded back to strings
+        '''
+        return np.asarray(self.categories[name])[self.columns[name]]
+
+    def to_frame(self):
+        ''' pandas DataFrame with pandas categoricals for CHROM, FILTER and TYPE
+        '''
+        import pandas as pd
+        data = {}
+        for name, values in self.columns.items():
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(values, self.categories[name])
+            else:
+                data[name] = values
+        return pd.DataFrame(data)
+
+
+def extract_annotations(path, annotations=DEFAULT_ANNOTATIONS, batch_size=DEFAULT_BATCH_SIZE):
+    ''' read a VCF once into an AnnotationTable of CHROM, POS, QUAL, FILTER,
+    TYPE and one float32 column per INFO annotation
+    '''
+    names = ('CHROM', 'POS', 'QUAL', 'FILTER', 'TYPE') + tuple(annotations)
+    parts = dict((name, []) for name in names)
+    categories = dict((name, _Categories()) for name in CATEGORICAL)
+    with VCFReader(path) as reader:
+        for batch in batches(reader.lines(), batch_size):
+            # only the first eight columns are split; samples stay in the remainder
+            chrom, pos, _, ref, alt, qual, filters, info = zip(*[line.rstrip('\n').split('\t', 8)[:8]
+                                                                 for line in batch])
+            parts['CHROM'].append(categories['CHROM'].encode(chrom))
+            parts['POS'].append(np.asarray(pos, dtype=str).astype(np.int64))
+            parts['QUAL'].append(_float_column(qual))
+            parts['FILTER'].append(categories['FILTER'].encode(filters))
+            parts['TYPE'].append(categories['TYPE'].encode(variant_types(ref, alt)))
+            for key, column in _info_columns(info, annotations).items():
+                parts[key].append(column)
+
+    columns = {}
+    for name in names:
+        if parts[name]:
+            columns[name] = np.concatenate(parts[name])
+        elif name == 'POS':
+            columns[name] = np.array([], dtype=np.int64)
+        else:
+            columns[name] = np.array([], dtype=np.int32 if name in CATEGORICAL else np.float32)
+    for name in CATEGORICAL:
+        columns[name] = columns[name].astype(np.int8 if len(categories[name].categories) < 128
+                                             else np.int32)
+    return AnnotationTable(columns, dict((n, c.categories) for n, c in categories.items()))
@@ -0,0 +1,337 @@
+""" region-restricted BAM localization through the .bai index
+
+notes:
+- slice_bam reads a BAM's .bai, works out the BGZF chunks that can hold
+reads overlapping the regions (binning plus linear index, as samtools view
+does) and fetches only those byte ranges and the header, through the
+store's read_range (gatk.storage) or from a local path. For an interval
+such as 20:10,000,000-10,200,000 that is megabytes, not the whole BAM.
+- the chunks are coarser than the regions, so every record is checked for
+overlap by its alignment end (from the CIGAR). Records reached from two
+overlapping regions are written once.
+- the output is a coordinate-sorted BAM with the original header plus its
+own .bai (output + '.bai'), so GATK, samtools and IGV open it like any
+other indexed BAM.
+
+usage:
+    slice_bam('gs://gatk-tutorials/workshop_1910/2-germline/bams/mother.bam',
+              ['20:10,000,000-10,200,000'], 'sandbox/mother_20.bam')
+"""
+import collections
+import concurrent.futures
+import os
+import struct
+import zlib
+
+from gatk.bgzf import BgzfReader, BgzfWriter, MAX_BLOCK_SIZE, split_virtual_offset
+from gatk.intervals import parse_region
+from gatk.storage import default_store
+from gatk.tabix import overlapping_chunks
+
+
+BAM_MAGIC = b'BAM\x01'
+BAI_MAGIC = b'BAI\x01'
+# the bin holding a reference's mapped/unmapped counts instead of reads
+BAI_PSEUDO_BIN = 37450
+BAI_MIN_SHIFT = 14
+BAI_DEPTH = 5
+FLAG_UNMAPPED = 0x4
+# CIGAR operations that consume the reference: M, D, N, =, X
+_REFERENCE_OPS = frozenset((0, 2, 3, 7, 8))
+
+SliceResult = collections.namedtuple('SliceResult', ['path', 'reads', 'bytes_fetched', 'bytes_total'])
+
+
+def reg2bin(beg, end):
+    ''' the smallest BAI bin holding [beg, end) (0-based, half-open)
+    '''
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+
+def parse_bai(data):
+    ''' [(bins, linear)] per reference, bins being {bin: (0, [(start, end) voffsets])}
+    as gatk.tabix.overlapping_chunks expects
+    '''
+    if data[:4] != BAI_MAGIC:
+        raise ValueError('not a BAI index')
+    unpack = struct.unpack_from
+    n_ref = unpack('<i', data, 4)[0]
+    offset = 8
+    references = []
+    for _ in range(n_ref):
+        n_bin = unpack('<i', data, offset)[0]
+        offset += 4
+        bins = {}
+        for _ in range(n_bin):
+            bin_id, n_chunk = unpack('<Ii', data, offset)
+            offset += 8
+            chunks = unpack('<{}Q'.format(2 * n_chunk), data, offset)
+            offset += 16 * n_chunk
+            if bin_id != BAI_PSEUDO_BIN:
+                bins[bin_id] = (0, list(zip(chunks[::2], chunks[1::2])))
+        n_intv = unpack('<i', data, offset)[0]
+        offset += 4
+        linear = unpack('<{}Q'.format(n_intv), data, offset)
+        offset += 8 * n_intv
+        references.append((bins, linear))
+    return references
+
+
+class _LocalRanges(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def read(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+
+class _StoreRanges(object):
+
+    def __init__(self, url, store):
+        objects = store.list(url)
+        if not objects:
+            raise IOError('no such object: ' + url)
+        self.info = objects[0]
+        self.url = url
+        self.store = store
+        self.size = self.info.size
+
+    def read(self, start, end):
+        end = min(end, self.size)
+        if end <= start:
+            return b''
+        return b''.join(self.store.read_range(self.url, start, end, self.info.generation))
+
+
+def _ranges(path, store):
+    if '://' in path:
+        return _StoreRanges(path, store or default_store())
+    return _LocalRanges(path)
+
+
+class _SparseFile(object):
+    ''' a seekable file over the byte ranges fetched so far, for BgzfReader
+    '''
+
+    def __init__(self, pieces):
+        self.pieces = sorted(pieces.items())
+        self.pos = 0
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def read(self, size):
+        for start, data in self.pieces:
+            if start <= self.pos < start + len(data):
+                chunk = data[self.pos - start:self.pos - start + size]
+                self.pos += len(chunk)
+                return chunk
+        return b''
+
+    def close(self):
+        pass
+
+
+def _read_header(ranges):
+    ''' (raw header bytes, reference names) from the start of a BAM
+    '''
+    fetched = 1 << 16
+    while True:
+        reader = BgzfReader(_SparseFile({0: ranges.read(0, fetched)}))
+        try:
+            return _parse_header(reader)
+        except (struct.error, ValueError, zlib.error):
+            if fetched >= ranges.size:
+                raise
+            # the header spans more blocks than fetched so far
+            fetched *= 4
+
+
+def _parse_header(reader):
+    magic = reader.read(4)
+    if magic != BAM_MAGIC:
+        raise ValueError('not a BAM file')
+    raw = [magic]
+
+    def take(size):
+        data = reader.read(size)
+        if len(data) < size:
+            raise ValueError('header truncated')
+        raw.append(data)
+        return data
+
+    l_text = struct.unpack('<i', take(4))[0]
+    take(l_text)
+    n_ref = struct.unpack('<i', take(4))[0]
+    names = []
+    for _ in range(n_ref):
+        l_name = struct.unpack('<i', take(4))[0]
+        names.append(take(l_name).rstrip(b'\x00').decode())
+        take(4)
+    return b''.join(raw), names
+
+
+def _alignment_end(record, pos):
+    ''' 0-based exclusive reference end of a BAM record (without its block_size)
+    '''
+    l_read_name, _, _, n_cigar_op, flag = struct.unpack_from('<BBHHH', record, 8)
+    if flag & FLAG_UNMAPPED or n_cigar_op == 0:
+        return pos + 1
+    cigar = struct.unpack_from('<{}I'.format(n_cigar_op), record, 32 + l_read_name)
+    length = sum(c >> 4 for c in cigar if c & 0xf in _REFERENCE_OPS)
+    return pos + max(length, 1)
+
+
+def _fetch(ranges, chunks, max_workers):
+    ''' {offset: bytes} covering every BGZF block the chunks touch
+    '''
+    spans = []
+    for start, end in chunks:
+        # the last block starts at end's compressed offset; fetch a whole block past it
+        spans.append((split_virtual_offset(start)[0], split_virtual_offset(end)[0] + MAX_BLOCK_SIZE))
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pieces = pool.map(lambda span: (span[0], ranges.read(*span)), merged)
+        return dict(pieces)
+
+
+def _records(reader, chunks, targets):
+    ''' (ref_id, pos, end, record) of every record in the chunks overlapping a
+    target; targets maps ref_id -> [(beg, end)]
+    '''
+    seen = set()
+    for chunk_start, chunk_end in sorted(chunks):
+        reader.seek(chunk_start)
+        while reader.tell() < chunk_end:
+            offset = reader.tell()
+            size = reader.read(4)
+            if len(size) < 4:
+                break
+            record = reader.read(struct.unpack('<i', size)[0])
+            if offset in seen:
+                continue
+            seen.add(offset)
+            ref_id, pos = struct.unpack_from('<ii', record, 0)
+            end = _alignment_end(record, pos)
+            if any(pos < stop and end > beg for beg, stop in targets.get(ref_id, ())):
+                yield ref_id, pos, end, size + record
+
+
+class _IndexBuilder(object):
+    ''' BAI bins, linear index and counts, fed one written record at a time
+    '''
+
+    def __init__(self, n_ref):
+        self.bins = [collections.OrderedDict() for _ in range(n_ref)]
+        self.linear = [[] for _ in range(n_ref)]
+        self.spans = [None] * n_ref
+        self.counts = [[0, 0] for _ in range(n_ref)]
+
+    def add(self, ref_id, pos, end, unmapped, start_offset, end_offset):
+        chunks = self.bins[ref_id].setdefault(reg2bin(pos, end), [])
+        if chunks and chunks[-1][1] == start_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+        linear = self.linear[ref_id]
+        last_window = (end - 1) >> BAI_MIN_SHIFT
+        if len(linear) <= last_window:
+            linear.extend([0] * (last_window + 1 - len(linear)))
+        for window in range(pos >> BAI_MIN_SHIFT, last_window + 1):
+            if linear[window] == 0:
+                linear[window] = start_offset
+        span = self.spans[ref_id]
+        self.spans[ref_id] = [start_offset if span is None else span[0], end_offset]
+        self.counts[ref_id][1 if unmapped else 0] += 1
+
+    def write(self, path):
+        out = [BAI_MAGIC, struct.pack('<i', len(self.bins))]
+        for ref_id, bins in enumerate(self.bins):
+            n_bin = len(bins) + (1 if self.spans[ref_id] else 0)
+            out.append(struct.pack('<i', n_bin))
+            for bin_id, chunks in bins.items():
+                out.append(struct.pack('<Ii', bin_id, len(chunks)))
+                out.extend(struct.pack('<QQ', start, end) for start, end in chunks)
+            if self.spans[ref_id]:
+                out.append(struct.pack('<IiQQQQ', BAI_PSEUDO_BIN, 2, self.spans[ref_id][0],
+                                       self.spans[ref_id][1], *self.counts[ref_id]))
+            # windows no read overlaps take the offset of the next window that
+            # has one (htslib copies the previous window's instead); either is a
+            # safe lower bound, as no read overlapping a later window comes before it
+            linear = self.linear[ref_id]
+            for window in range(len(linear) - 2, -1, -1):
+                if linear[window] == 0:
+                    linear[window] = linear[window + 1]
+            out.append(struct.pack('<i{}Q'.format(len(linear)), len(linear), *linear))
+        out.append(struct.pack('<Q', 0))
+        with open(path, 'wb') as f:
+            f.write(b''.join(out))
+
+
+def index_url_for(url, store=None):
+    ''' the .bai next to a BAM: x.bam.bai, else x.bai
+    '''
+    candidates = [url + '.bai']
+    if url.endswith('.bam'):
+        candidates.append(url[:-4] + '.bai')
+    for candidate in candidates:
+        if '://' in candidate:
+            if (store or default_store()).list(candidate):
+                return candidate
+        elif os.path.exists(candidate):
+            return candidate
+    raise IOError('no .bai index next to ' + url)
+
+
+def slice_bam(url, regions, output, store=None, index_url=None, max_workers=8):
+    ''' write output, a BAM holding the reads of url (a gs:// URL or local
+    path) that overlap regions (strings such as '20:10,000,000-10,200,000'),
+    and output + '.bai'. Only the header and the indexed chunks are read.
+    Returns a SliceResult (path, reads, bytes fetched, size of the source BAM).
+    '''
+    ranges = _ranges(url, store)
+    index_ranges = _ranges(index_url or index_url_for(url, store), store)
+    references = parse_bai(index_ranges.read(0, index_ranges.size))
+    header, names = _read_header(ranges)
+
+    targets = collections.defaultdict(list)
+    chunks = []
+    for region in regions:
+        contig, start, end = parse_region(region)
+        if contig not in names:
+            raise ValueError('{} is not a reference of {}'.format(contig, url))
+        ref_id = names.index(contig)
+        beg, end = start - 1, (1 << 29) if end is None else end
+        targets[ref_id].append((beg, end))
+        bins, linear = references[ref_id]
+        chunks.extend(overlapping_chunks(bins, linear, beg, end, BAI_MIN_SHIFT, BAI_DEPTH))
+
+    pieces = _fetch(ranges, chunks, max_workers) if chunks else {}
+    reader = BgzfReader(_SparseFile(pieces or {0: b''}))
+    index = _IndexBuilder(len(names))
+    reads = 0
+    with BgzfWriter(output) as writer:
+        writer.write(header)
+        writer.flush()
+        for ref_id, pos, end, record in _records(reader, chunks, targets):
+            start_offset = writer.tell()
+            writer.write(record)
+            unmapped = struct.unpack_from('<H', record, 18)[0] & FLAG_UNMAPPED
+            index.add(ref_id, pos, end, unmapped, start_offset, writer.tell())
+            reads += 1
+    index.write(output + '.bai')
+    fetched = sum(len(p) for p in pieces.values()) + index_ranges.size
+    return SliceResult(output, reads, fetched, ranges.size)
@@ -0,0 +1,193 @@
+""" random access to BGZF (blocked gzip) files
+
+notes:
+- a BGZF file is a series of gzip members of at most 64 KB each. A virtual
+offset is (compressed offset of a block << 16) | offset inside the
+uncompressed block; .tbi/.csi/.bai indexes point into files with them.
+- only the blocks that are actually read get decompressed.
+- BgzfWriter produces files that bgzip/tabix/htslib read, ending with the
+standard empty EOF block.
+"""
+import struct
+import zlib
+
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+# uncompressed bytes per block, as in htslib
+BLOCK_DATA_SIZE = 0xff00
+MAX_BLOCK_SIZE = 1 << 16
+
+
+def split_virtual_offset(voffset):
+    return voffset >> 16, voffset & 0xffff
+
+
+def make_virtual_offset(coffset, uoffset):
+    return (coffset << 16) | uoffset
+
+
+def parse_block_header(header):
+    ''' total block size from the fixed 18-byte BGZF header (+ extra field)
+    '''
+    if header[:4] != BGZF_MAGIC:
+        raise ValueError('not a BGZF block')
+    xlen = struct.unpack_from('<H', header, 10)[0]
+    extra = header[12:12 + xlen]
+    i = 0
+    while i + 4 <= len(extra):
+        si1, si2, slen = struct.unpack_from('<BBH', extra, i)
+        if (si1, si2) == (66, 67):
+            return struct.unpack_from('<H', extra, i + 4)[0] + 1
+        i += 4 + slen
+    raise ValueError('BGZF block without a BC extra field')
+
+
+def decompress_block(block):
+    ''' uncompressed payload of one complete BGZF block
+    '''
+    xlen = struct.unpack_from('<H', block, 10)[0]
+    return zlib.decompress(block[12 + xlen:-8], -15)
+
+
+def compress_block(data, level=6):
+    ''' one complete BGZF block holding data (at most BLOCK_DATA_SIZE bytes)
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    if len(cdata) + 26 > MAX_BLOCK_SIZE:
+        # incompressible data: store it instead
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter(object):
+    ''' write a BGZF file, tracking virtual offsets for indexing
+    '''
+
+    def __init__(self, path_or_file, level=6):
+        if hasattr(path_or_file, 'write'):
+            self._file = path_or_file
+        else:
+            self._file = open(path_or_file, 'wb')
+        self.level = level
+        self._buffer = bytearray()
+        self._coffset = 0
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= BLOCK_DATA_SIZE:
+            self._write_block(bytes(self._buffer[:BLOCK_DATA_SIZE]))
+            del self._buffer[:BLOCK_DATA_SIZE]
+
+    def _write_block(self, data):
+        block = compress_block(data, self.level)
+        self._file.write(block)
+        self._coffset += len(block)
+
+    def flush(self):
+        ''' end the current block, e.g. so the next record starts a new one
+        '''
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def tell(self):
+        ''' virtual offset of the next byte written
+        '''
+        return make_virtual_offset(self._coffset, len(self._buffer))
+
+    def close(self):
+        self.flush()
+        self._file.write(BGZF_EOF)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BgzfReader(object):
+    ''' seekable reader over a BGZF file, addressed by virtual offsets
+    '''
+
+    def __init__(self, path_or_file):
+        if hasattr(path_or_file, 'read'):
+            self._file = path_or_file
+        else:
+            self._file = open(path_or_file, 'rb')
+        self._block_start = None
+        self._next_block = 0
+        self._data = b''
+        self._pos = 0
+        self._load(0)
+
+    def _load(self, coffset):
+        ''' decompress the block at coffset; False past the end of the file
+        '''
+        self._file.seek(coffset)
+        header = self._file.read(18)
+        self._block_start = coffset
+        self._pos = 0
+        if len(header) < 18:
+            self._data = b''
+            self._next_block = coffset
+            return False
+        size = parse_block_header(header)
+        block = header + self._file.read(size - 18)
+        self._data = decompress_block(block)
+        self._next_block = coffset + size
+        return True
+
+    def _advance(self):
+        ''' move past exhausted (or empty) blocks; False at end of file
+        '''
+        while self._pos >= len(self._data):
+            if not self._load(self._next_block):
+                return False
+        return True
+
+    def seek(self, voffset):
+        coffset, uoffset = split_virtual_offset(voffset)
+        if coffset != self._block_start:
+            self._load(coffset)
+        self._pos = uoffset
+
+    def tell(self):
+        if self._pos >= len(self._data):
+            self._advance()
+        return make_virtual_offset(self._block_start, self._pos)
+
+    def read(self, size):
+        chunks = []
+        while size > 0 and self._advance():
+            chunk = self._data[self._pos:self._pos + size]
+            self._pos += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def readline(self):
+        chunks = []
+        while self._advance():
+            end = self._data.find(b'\n', self._pos)
+            if end >= 0:
+                chunks.append(self._data[self._pos:end + 1])
+                self._pos = end + 1
+                break
+            chunks.append(self._data[self._pos:])
+            self._pos = len(self._data)
+        return b''.join(chunks)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
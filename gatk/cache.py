@@ -0,0 +1,290 @@
+""" content-addressed local cache for localized bucket objects
+
+notes:
+- entries are keyed by object URL plus its generation (or hash when there is
+no generation), so a changed object in the bucket is a different entry.
+- cached files are hard-linked into the notebook directories (symlinked when
+the cache is on another filesystem), so a second gatk_init does not copy
+anything.
+- bucket listings are remembered too; while they are younger than
+listing_max_age a repeat localization needs no network at all.
+- when the cache grows past max_bytes the least recently used entries are
+evicted. Hard-linked destinations keep their data; symlinked ones will not.
+- entries are also indexed by content (md5 or crc32c plus size): an object
+whose bytes are already cached under another URL, such as the same FASTA in
+two workshops, is reflinked or hard-linked from that entry, not downloaded.
+- several notebooks may share the cache: each object is fetched under a
+per-entry lock (gatk.locking) by whoever gets there first, and index saves
+merge this process's changes into the index as it is on disk.
+- lookups, adds and remembered listings only mark the index as changed;
+flush() merges them under the index lock once per operation (a transfer
+plan, a batch of fetches), not once per file.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+from gatk.locking import FileLock, atomic_path, lock_for
+from gatk.storage import ObjectInfo
+
+
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.cache/terranblib')
+# linux/fs.h _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+DEFAULT_MAX_BYTES = 50 * 2**30
+LISTING_MAX_AGE = 24 * 3600
+
+
+def cache_key(info):
+    version = info.generation or info.md5 or info.crc32c or '{}@{}'.format(info.size, info.updated)
+    return hashlib.sha1('{}#{}'.format(info.url, version).encode()).hexdigest()
+
+
+def content_id(info):
+    ''' identity of an object's bytes, equal for identical files under any URL, or None
+    '''
+    if info.md5:
+        return 'md5:{}:{}'.format(info.md5, info.size)
+    if info.crc32c:
+        return 'crc32c:{}:{}'.format(info.crc32c, info.size)
+    return None
+
+
+def reflink(source, destination):
+    ''' copy-on-write clone of source (btrfs, xfs); raises OSError where unsupported
+    '''
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def share_file(source, destination):
+    ''' make destination a copy of source that takes no extra space: a reflink
+    where the filesystem supports it (later edits stay private), else a hard
+    link. Returns 'reflink' or 'hardlink'; raises OSError across filesystems.
+    '''
+    with atomic_path(destination) as tmp:
+        try:
+            reflink(source, tmp)
+            return 'reflink'
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        os.link(source, tmp)
+        return 'hardlink'
+
+
+def link_file(source, destination):
+    ''' hard-link source to destination, falling back to a symlink across filesystems
+    '''
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    # link under a temporary name and rename over destination, so it is never missing
+    with atomic_path(destination) as tmp:
+        try:
+            os.link(source, tmp)
+        except OSError:
+            os.symlink(os.path.abspath(source), tmp)
+
+
+class LocalCache(object):
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, 'index.json')
+        self._lock = threading.RLock()
+        # entries changed or dropped here since the last save, merged into
+        # whatever other processes saved meanwhile
+        self._touched = set()
+        self._touched_listings = set()
+        self._removed = set()
+        self._reset = False
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.index = self._load()
+        self._reindex()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {'objects': {}, 'listings': {}}
+
+    def flush(self):
+        ''' save the entries changed since the last flush, if any
+        '''
+        with self._lock:
+            if self._touched or self._touched_listings or self._removed or self._reset:
+                self._save()
+
+    def _save(self):
+        with self._lock, FileLock(self.index_path + '.lock'):
+            index = {'objects': {}, 'listings': {}} if self._reset else self._load()
+            for key in self._removed:
+                index['objects'].pop(key, None)
+            for key in self._touched:
+                if key in self.index['objects']:
+                    index['objects'][key] = self.index['objects'][key]
+            for pattern in self._touched_listings:
+                index['listings'][pattern] = self.index['listings'][pattern]
+            self._touched.clear()
+            self._touched_listings.clear()
+            self._removed.clear()
+            self._reset = False
+            self.index = index
+            self._reindex()
+            with atomic_path(self.index_path) as tmp:
+                with open(tmp, 'w') as f:
+                    # one C-encoded string; json.dump encodes piece by piece in Python
+                    f.write(json.dumps(index))
+
+    def _reindex(self):
+        ''' rebuild the content -> keys map and the byte total from self.index
+        '''
+        self._by_content = {}
+        self._bytes = 0
+        for key, entry in self.index['objects'].items():
+            self._indexed(key, entry)
+
+    def _indexed(self, key, entry):
+        # entries without a content id only share bytes with themselves
+        keys = self._by_content.setdefault(entry.get('content') or key, set())
+        if not keys:
+            self._bytes += entry['size']
+        keys.add(key)
+
+    def _unindexed(self, key, entry):
+        content = entry.get('content') or key
+        keys = self._by_content.get(content, set())
+        keys.discard(key)
+        if not keys:
+            self._by_content.pop(content, None)
+            self._bytes -= entry['size']
+
+    def object_path(self, key):
+        return os.path.join(self.root, 'objects', key[:2], key)
+
+    def total_bytes(self):
+        ''' bytes on disk; entries sharing content are counted once
+        '''
+        return self._bytes
+
+    def _twin(self, info, key):
+        ''' path of another entry holding the same bytes as info, or None
+        '''
+        content = content_id(info)
+        if content is None:
+            return None
+        for other in self._by_content.get(content, ()):
+            if other != key and os.path.exists(self.object_path(other)):
+                return self.object_path(other)
+        return None
+
+    def contains(self, info):
+        ''' True when lookup(info) would hit, or add(info) would share another
+        entry's bytes, without marking anything as used
+        '''
+        key = cache_key(info)
+        with self._lock:
+            if key in self.index['objects'] and os.path.exists(self.object_path(key)):
+                return True
+            return self._twin(info, key) is not None
+
+    def lookup(self, info):
+        ''' path of the cached copy of an object, or None on a miss
+        '''
+        key = cache_key(info)
+        with self._lock:
+            entry = self.index['objects'].get(key)
+            path = self.object_path(key)
+            if entry is None or not os.path.exists(path):
+                return None
+            entry['last_used'] = time.time()
+            self._touched.add(key)
+            return path
+
+    def add(self, info, fetch):
+        ''' fill the cache entry for an object by calling fetch(temp_path)
+        one process fetches a given object; others wait for it and reuse its copy.
+        An object with the same md5/crc32c as an entry already cached (the same
+        file under another tutorial's URL) shares that entry's bytes instead.
+        '''
+        key = cache_key(info)
+        path = self.object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with lock_for(path, 'caching ' + info.url):
+            if not os.path.exists(path):
+                with self._lock:
+                    twin = self._twin(info, key)
+                try:
+                    shared = twin is not None and share_file(twin, path)
+                except OSError:
+                    shared = False
+                if not shared:
+                    with atomic_path(path) as tmp:
+                        fetch(tmp)
+        with self._lock:
+            entry = {'url': info.url, 'size': os.path.getsize(path),
+                     'content': content_id(info), 'last_used': time.time()}
+            if key in self.index['objects']:
+                self._unindexed(key, self.index['objects'][key])
+            self.index['objects'][key] = entry
+            self._indexed(key, entry)
+            self._touched.add(key)
+            self._removed.discard(key)
+            self.evict(keep=key)
+        return path
+
+    def evict(self, keep=None):
+        ''' drop least recently used entries until the cache fits in max_bytes
+        '''
+        with self._lock:
+            if self._bytes <= self.max_bytes:
+                return
+            objects = self.index['objects']
+            for key, entry in sorted(objects.items(), key=lambda kv: kv[1]['last_used']):
+                if self._bytes <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(self.object_path(key))
+                except OSError:
+                    pass
+                del objects[key]
+                # shared bytes are only freed with the last entry holding them
+                self._unindexed(key, entry)
+                self._removed.add(key)
+                self._touched.discard(key)
+
+    def remember_listing(self, pattern, objects):
+        with self._lock:
+            self.index['listings'][pattern] = {'time': time.time(),
+                                               'objects': [list(o) for o in objects]}
+            self._touched_listings.add(pattern)
+
+    def recall_listing(self, pattern, max_age=LISTING_MAX_AGE):
+        ''' a remembered listing younger than max_age seconds, or None
+        '''
+        with self._lock:
+            listing = self.index['listings'].get(pattern)
+        if listing is None or time.time() - listing['time'] > max_age:
+            return None
+        return [ObjectInfo(*o) for o in listing['objects']]
+
+    def clear(self):
+        with self._lock:
+            for key in list(self.index['objects']):
+                try:
+                    os.remove(self.object_path(key))
+                except OSError:
+                    pass
+            self.index = {'objects': {}, 'listings': {}}
+            self._reindex()
+            self._touched.clear()
+            self._touched_listings.clear()
+            self._reset = True
+            self._save()
@@ -0,0 +1,180 @@
+""" checksums computed while a download is written
+
+notes:
+- GCS reports md5Hash and crc32c as base64 strings; digests here use the same
+encoding so they compare directly with ObjectInfo.md5 / ObjectInfo.crc32c.
+- HashingWriter wraps the open destination file and updates the hashes on
+every write, so checking a download needs no second read of the file.
+- crc32c values of consecutive pieces combine into the crc32c of the whole
+(crc32c_combine, as zlib's crc32_combine), so slices written concurrently
+can each be hashed on the way and still be checked as one object; md5 cannot.
+- crc32c comes from google_crc32c (installed with google-cloud-storage) or
+the crc32c package. Composite objects only carry a crc32c; when neither C
+implementation is importable, md5 is preferred wherever the object has one.
+"""
+import base64
+import hashlib
+
+
+HASH_CHUNK = 1 << 20
+# reflected Castagnoli polynomial
+CRC32C_POLY = 0x82f63b78
+
+try:
+    import google_crc32c
+    CRC32C_FAST = google_crc32c.implementation == 'c'
+
+    def _crc32c_update(value, data):
+        return google_crc32c.extend(value, data)
+except ImportError:
+    try:
+        import crc32c as _crc32c
+        CRC32C_FAST = True
+
+        def _crc32c_update(value, data):
+            return _crc32c.crc32c(data, value)
+    except ImportError:
+        _crc32c_update = None
+        CRC32C_FAST = False
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class _Crc32c(object):
+
+    def __init__(self):
+        if _crc32c_update is None:
+            raise ChecksumError('crc32c needs google-crc32c or crc32c installed')
+        self.value = 0
+
+    def update(self, data):
+        self.value = _crc32c_update(self.value, data)
+
+    def digest(self):
+        return self.value.to_bytes(4, 'big')
+
+
+def _gf2_times(matrix, vector):
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def crc32c_combine(crc1, crc2, length2):
+    ''' crc32c of A + B from crc1 = crc32c(A), crc2 = crc32c(B) and len(B)
+    '''
+    if length2 <= 0:
+        return crc1
+    # operators appending one zero bit to a crc, then two, then four
+    odd = [CRC32C_POLY] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    # apply len(B) zero bytes, one squaring of the operator per bit of length2
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+def combined_crc32c(pieces):
+    ''' base64 crc32c of consecutive pieces, given (crc32c value, length) in order
+    '''
+    value = 0
+    for crc, length in pieces:
+        value = crc32c_combine(value, crc, length)
+    return encode_digest(value.to_bytes(4, 'big'))
+
+
+def new_hash(algorithm):
+    return _Crc32c() if algorithm == 'crc32c' else hashlib.new(algorithm)
+
+
+def encode_digest(digest):
+    return base64.b64encode(digest).decode()
+
+
+class HashingWriter(object):
+    ''' file-like wrapper hashing everything written through it
+    '''
+
+    def __init__(self, fileobj, algorithms=('md5',)):
+        self.fileobj = fileobj
+        self.hashes = dict((a, new_hash(a)) for a in algorithms)
+        self.bytes_written = 0
+
+    def write(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+        self.bytes_written += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def digests(self):
+        ''' {algorithm: base64 digest} of the bytes written so far
+        '''
+        return dict((a, encode_digest(h.digest())) for a, h in self.hashes.items())
+
+
+def file_digests(path, algorithms=('md5',)):
+    ''' the same digests by reading a file, for copies not made through a HashingWriter
+    '''
+    hashes = dict((a, new_hash(a)) for a in algorithms)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            for h in hashes.values():
+                h.update(chunk)
+    return dict((a, encode_digest(h.digest())) for a, h in hashes.items())
+
+
+def crc32c_available():
+    ''' True when crc32c can be computed at all, quickly or not
+    '''
+    return _crc32c_update is not None
+
+
+def choose_algorithm(info):
+    ''' the cheapest checksum the object's metadata lets us verify, or None
+    '''
+    if info.crc32c and CRC32C_FAST:
+        return 'crc32c'
+    if info.md5:
+        return 'md5'
+    if info.crc32c and crc32c_available():
+        return 'crc32c'
+    return None
+
+
+def check_copy(info, size, digests):
+    ''' (check, problem): which check passed, or a description of the mismatch
+    '''
+    if info.size is not None and size != info.size:
+        return None, 'size {} != expected {}'.format(size, info.size)
+    for algorithm, expected in (('crc32c', info.crc32c), ('md5', info.md5)):
+        if algorithm in digests and expected:
+            if digests[algorithm] != expected:
+                return None, '{} {} != expected {}'.format(algorithm, digests[algorithm], expected)
+            return algorithm, None
+    return ('size' if info.size is not None else None), None
@@ -0,0 +1,101 @@
+""" one physical copy of identical files across tutorial directories
+
+notes:
+- find_duplicates walks directories and groups regular files by size; only
+files whose size collides are hashed (md5), and names that already share an
+inode count as one copy.
+- dedupe points every duplicate at the first copy with
+gatk.cache.share_file: a reflink where the filesystem supports it, else a
+hard link. A hard link shares later edits, so a tool rewriting one copy in
+place changes all of them. Only point it at directories whose files are
+never rewritten, such as downloaded inputs and the cache, not at tool
+output directories. Files on different filesystems are left alone.
+- space_report compares the size the files appear to have with the space
+their distinct inodes occupy. Reflinked blocks do not show up in stat, so
+the saving from reflinks is reported by dedupe, not by space_report.
+"""
+import collections
+import os
+import stat
+
+from gatk.cache import share_file
+from gatk.checksum import file_digests
+
+
+# bytes: space freed by this path (the size for the first name of an inode, else 0)
+DedupeResult = collections.namedtuple('DedupeResult', ['path', 'source', 'bytes', 'method'])
+
+
+def _files(directories):
+    ''' (path, stat) of every regular file below directories, symlinks excluded
+    '''
+    seen = set()
+    for directory in directories:
+        for root, _, names in os.walk(os.path.abspath(directory)):
+            if root in seen:
+                # a directory nested in one already walked
+                continue
+            seen.add(root)
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                st = os.lstat(path)
+                if stat.S_ISREG(st.st_mode):
+                    yield path, st
+
+
+def find_duplicates(directories):
+    ''' groups of identical files; each group is a list of inodes, each inode
+    a list of its names, the first inode being the copy to keep
+    '''
+    by_size = collections.defaultdict(lambda: collections.OrderedDict())
+    for path, st in _files(directories):
+        if st.st_size:
+            by_size[st.st_size].setdefault((st.st_dev, st.st_ino), []).append(path)
+    groups = []
+    for inodes in by_size.values():
+        if len(inodes) < 2:
+            continue
+        by_content = collections.OrderedDict()
+        for (device, _), names in inodes.items():
+            digest = file_digests(names[0], ('md5',))['md5']
+            by_content.setdefault((device, digest), []).append(names)
+        groups.extend(g for g in by_content.values() if len(g) > 1)
+    return groups
+
+
+def dedupe(directories, dry_run=False, verbose=False):
+    ''' replace duplicate files below directories by shared copies of one
+    returns a DedupeResult per replaced name; dry_run reports without changing files
+    '''
+    results = []
+    for group in find_duplicates(directories):
+        source = group[0][0]
+        for names in group[1:]:
+            size = os.path.getsize(names[0])
+            for i, path in enumerate(names):
+                method = 'dry run'
+                if not dry_run:
+                    try:
+                        method = share_file(source, path)
+                    except OSError as e:
+                        method = 'failed: {}'.format(e)
+                freed = size if i == 0 and not method.startswith('failed') else 0
+                results.append(DedupeResult(path, source, freed, method))
+                if verbose:
+                    print('{:10} {} -> {}'.format(method, path, source))
+    return results
+
+
+def space_report(directories):
+    ''' {'files', 'apparent_bytes', 'disk_bytes', 'saved_bytes'} of the files
+    below directories, counting each inode once for disk_bytes
+    '''
+    apparent, inodes = 0, {}
+    n = 0
+    for _, st in _files(directories):
+        n += 1
+        apparent += st.st_size
+        inodes[(st.st_dev, st.st_ino)] = st.st_size
+    disk = sum(inodes.values())
+    return {'files': n, 'apparent_bytes': apparent, 'disk_bytes': disk,
+            'saved_bytes': apparent - disk}
@@ -0,0 +1,84 @@
+""" indexed reference FASTA access through its .fai
+
+notes:
+- FastaFile reads the .fai written by samtools faidx and seeks straight to
+the bases asked for, so nothing is loaded beyond the lines holding them.
+- callers such as gatk.gvcf_merge ask for positions in order along a
+contig, so fetch reads WINDOW bases at a time and answers from that window
+until a request falls outside it.
+- plain FASTA only; a bgzipped reference needs its .gzi, which is not read here.
+
+usage:
+    with FastaFile('ref/ref.fasta') as ref:
+        ref.fetch('20', 10000000, 10000010)
+"""
+import collections
+import os
+
+
+FaiEntry = collections.namedtuple('FaiEntry', ['name', 'length', 'offset', 'line_bases', 'line_width'])
+
+WINDOW = 1 << 16
+
+
+def read_fai(path):
+    ''' {contig: FaiEntry} from a .fai file
+    '''
+    index = collections.OrderedDict()
+    with open(path) as f:
+        for line in f:
+            words = line.rstrip('\n').split('\t')
+            if len(words) < 5:
+                continue
+            index[words[0]] = FaiEntry(words[0], *(int(w) for w in words[1:5]))
+    return index
+
+
+class FastaFile(object):
+
+    def __init__(self, path, fai_path=None):
+        fai_path = fai_path or path + '.fai'
+        if not os.path.exists(fai_path):
+            raise IOError('no .fai index next to {}; run samtools faidx on it'.format(path))
+        self.path = path
+        self.index = read_fai(fai_path)
+        self._file = open(path, 'rb')
+        # (contig, first position, bases) of the last window read
+        self._window = (None, 0, '')
+
+    def _read(self, entry, start, end):
+        ''' bases start..end (1-based, inclusive) straight from the file
+        '''
+        first, last = start - 1, end - 1
+        begin = entry.offset + (first // entry.line_bases) * entry.line_width + first % entry.line_bases
+        stop = entry.offset + (last // entry.line_bases) * entry.line_width + last % entry.line_bases + 1
+        self._file.seek(begin)
+        data = self._file.read(stop - begin)
+        return data.replace(b'\n', b'').replace(b'\r', b'').decode().upper()
+
+    def fetch(self, contig, start, end):
+        ''' the bases from start to end (1-based, inclusive), upper case
+        '''
+        entry = self.index.get(contig)
+        if entry is None:
+            raise KeyError('{} is not in {}'.format(contig, self.path))
+        if start < 1 or end > entry.length or end < start:
+            raise ValueError('{}:{}-{} is outside {} (length {})'.format(
+                contig, start, end, contig, entry.length))
+        name, first, bases = self._window
+        if name != contig or start < first or end >= first + len(bases):
+            last = min(entry.length, max(end, start + WINDOW - 1))
+            self._window = name, first, bases = contig, start, self._read(entry, start, last)
+        return bases[start - first:end - first + 1]
+
+    def base(self, contig, pos):
+        return self.fetch(contig, pos, pos)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -7,6 +7,9 @@ accessible to Bash using Jupyter Magics.
 here outside of functions, but we need to import * in Jupyter to have them be 
 pushed to the value stack.
 - a global variable defined inside functions will not be pushed to the value stack
+- the accessibility check lists each tutorial folder recursively ('/**'), where
+gsutil ls used to list only its top level. That one listing is kept for the
+session and answers every narrower pattern the copies ask for.
 
 to do: 
 - figure out how to push a global variable to the value stack without import *
@@ -17,6 +20,15 @@ the globals do get pushed.
 import os
 import pip
 
+from gatk.cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, LocalCache
+from gatk.dedupe import dedupe
+from gatk.localize import DEFAULT_MAX_WORKERS, TransferResult, fetch_objects, summarize, verification_report
+from gatk.manifest import ManifestEntry, plan_transfers, read_manifest
+from gatk.pipeline import Pipeline, gatk_step
+from gatk.prefetch import Prefetch
+from gatk.storage import session_listings
+from gatk.sync import sync_directory
+
 
 # Set your workspace bucket variable for this notebook.
 BUCKET = os.environ['WORKSPACE_BUCKET']
@@ -24,6 +36,10 @@ BUCKET = os.environ['WORKSPACE_BUCKET']
 # Set workshop variable to access the most recent materials
 WORKSHOP = "workshop_1910"
 
+# Local cache of downloaded tutorial files, reused by later gatk_init calls
+CACHE_DIR = DEFAULT_CACHE_DIR
+CACHE_MAX_BYTES = DEFAULT_MAX_BYTES
+
 # Set up directories for the files to live inside this notebook
 file_directories = {'germline': ["/home/jupyter-user/2-germline-vd/sandbox/",
                                 "/home/jupyter-user/2-germline-vd/ref",
@@ -37,48 +53,122 @@ file_directories = {'germline': ["/home/jupyter-user/2-germline-vd/sandbox/",
                                 "/home/jupyter-user/3-somatic-cna/cna_inputs"]
                     }
 
-# Set up command to check for data accessibility
-check_data_commands = {'germline': 'gsutil ls gs://gatk-tutorials/'+WORKSHOP+'/2-germline/',
-                        'somatic': 'gsutil ls gs://gatk-tutorials/'+WORKSHOP+'/3-somatic/'
-                        }
-
-# Set up commands to copy data to the notebook
-data_copy_commands = {'germline': [ "gsutil cp gs://gatk-tutorials/"+WORKSHOP+"/2-germline/ref/* /home/jupyter-user/2-germline-vd/ref",
-                                    "gsutil cp gs://gatk-tutorials/"+WORKSHOP+"/2-germline/trio.ped /home/jupyter-user/2-germline-vd/",
-                                    "gsutil cp gs://gatk-tutorials/"+WORKSHOP+"/2-germline/resources/* /home/jupyter-user/2-germline-vd/resources/",
-                                    "gsutil cp gs://gatk-tutorials/"+WORKSHOP+"/2-germline/gvcfs/* /home/jupyter-user/2-germline-vd/gvcfs/"],
-                    'somatic': ["gsutil -m cp -r gs://gatk-tutorials/"+WORKSHOP+"/3-somatic/bams /home/jupyter-user/",
-                                "gsutil -m cp -r gs://gatk-tutorials/"+WORKSHOP+"/3-somatic/ref /home/jupyter-user/",
-                                "gsutil -m cp -r gs://gatk-tutorials/"+WORKSHOP+"/3-somatic/resources /home/jupyter-user/",
-                                "gsutil -m cp -r gs://gatk-tutorials/"+WORKSHOP+"/3-somatic/mutect2_precomputed /home/jupyter-user/"]
-                    }
+# Directories of downloaded tutorial inputs, which the tools only read.
+# dedupe_tutorials shares identical files across these and the cache; output
+# directories are left out, since a hard-linked output rewritten in place
+# would change its twin too.
+input_directories = {'germline': ["/home/jupyter-user/2-germline-vd/ref",
+                                  "/home/jupyter-user/2-germline-vd/resources",
+                                  "/home/jupyter-user/2-germline-vd/gvcfs"],
+                     'somatic': ["/home/jupyter-user/bams",
+                                 "/home/jupyter-user/ref",
+                                 "/home/jupyter-user/resources",
+                                 "/home/jupyter-user/mutect2_precomputed",
+                                 "/home/jupyter-user/3-somatic-cna/ref/",
+                                 "/home/jupyter-user/3-somatic-cna/cna_inputs"]
+                     }
 
+# Sandbox directory that sync_sandbox uploads to $BUCKET/sandbox
+sandbox_directories = {'germline': "/home/jupyter-user/2-germline-vd/sandbox/",
+                       'somatic': "/home/jupyter-user/3-somatic-cna/sandbox/"
+                       }
+
+# Set up the bucket listing used to check for data accessibility; recursive, so
+# the cached listing also covers the narrower patterns of the copies
+check_data_urls = {'germline': 'gs://gatk-tutorials/'+WORKSHOP+'/2-germline/**',
+                   'somatic': 'gs://gatk-tutorials/'+WORKSHOP+'/3-somatic/**'
+                   }
+
+# Tutorial data: which bucket objects go where (see gatk.manifest), in the
+# order the notebook uses them, which is also the background fetch order.
+# An entry may also pin size, md5 and crc32c, or be optional; group selects
+# subsets. A tutorial may instead name a JSON manifest file (write_manifest).
+TUTORIAL_DATA = 'gs://gatk-tutorials/' + WORKSHOP
+data_manifests = {'germline': [ManifestEntry(TUTORIAL_DATA + '/2-germline/ref/*', '/home/jupyter-user/2-germline-vd/ref/', group='ref'),
+                               ManifestEntry(TUTORIAL_DATA + '/2-germline/trio.ped', '/home/jupyter-user/2-germline-vd/', group='ref'),
+                               ManifestEntry(TUTORIAL_DATA + '/2-germline/resources/*', '/home/jupyter-user/2-germline-vd/resources/', group='resources'),
+                               ManifestEntry(TUTORIAL_DATA + '/2-germline/gvcfs/*', '/home/jupyter-user/2-germline-vd/gvcfs/', group='gvcfs')],
+                  'somatic': [ManifestEntry(TUTORIAL_DATA + '/3-somatic/bams/**', '/home/jupyter-user/bams/', group='bams'),
+                              ManifestEntry(TUTORIAL_DATA + '/3-somatic/ref/**', '/home/jupyter-user/ref/', group='ref'),
+                              ManifestEntry(TUTORIAL_DATA + '/3-somatic/resources/**', '/home/jupyter-user/resources/', group='resources'),
+                              ManifestEntry(TUTORIAL_DATA + '/3-somatic/mutect2_precomputed/**', '/home/jupyter-user/mutect2_precomputed/', group='mutect2_precomputed')]
+                  }
+
+
+def check_files(url, verbose=False, refresh=False):
+    ''' list the objects under a tutorial folder
+    returns ObjectInfo records (url, size, generation, md5, crc32c, updated),
+    or [] when nothing can be listed. Listings are kept for the session, so
+    repeated checks do not go back to the bucket unless refresh=True.
+    '''
+    try:
+        accessible_files = session_listings.list(url, refresh=refresh)
+    except ImportError:
+        accessible_files = []
+    except Exception as e:
+        print('WARNING: could not list {}: {}'.format(url, e))
+        accessible_files = []
 
-def check_files(system_command, verbose=False):
-    
-    file_contents = os.popen(system_command).read()
-    
-    # parse a list of the accessible files
-    accessible_files = []
-    for f in file_contents.split('\n'):
-        if 'gs://' in f:
-            accessible_files.append(f)
-    
     if len(accessible_files) > 0:
-        outcome = 'Data are accessible in '+file_contents
+        outcome = 'Data are accessible in {} ({} files, {:.1f} MB)'.format(
+            url, len(accessible_files), sum(f.size or 0 for f in accessible_files) / 1e6)
     else:
         outcome = 'WARNING: No data is accessible!'
 
     if verbose:
         print("\n\nAccessible files:")
-        print('\t'+'\n\t'.join(accessible_files))
+        print('\t'+'\n\t'.join('{}\t{}'.format(f.size, f.url) for f in accessible_files))
     else:
         print(outcome)
 
     return accessible_files
 
-def gatk_init(tutorial, verbose=False):
+def tutorial_manifest(tutorial):
+    manifest = data_manifests[tutorial]
+    return read_manifest(manifest) if isinstance(manifest, str) else manifest
+
+
+def plan_init(tutorial, select=None, optional=False, use_cache=True, verbose=False):
+    ''' what gatk_init would fetch, as a gatk.manifest.TransferPlan; nothing is copied
+    select = groups (such as 'ref' or 'bams') or file patterns to fetch; default all
+    optional = also fetch the entries marked optional
+    '''
+    cache = LocalCache(CACHE_DIR, CACHE_MAX_BYTES) if use_cache else None
+    manifest = tutorial_manifest(tutorial)
+
+    # Check if data is accessible. The listing should hold several objects and
+    # also answers the manifest patterns below without further requests.
+    # Skipped when the cache still knows every pattern's objects.
+    check_url = check_data_urls[tutorial]
+    if cache is None or any(cache.recall_listing(e.object) is None for e in manifest):
+        accessible_files = check_files(check_url, verbose)
+
+        # if files were not listed, pip install google cloud
+        # TODO: test that this works!
+        if len(accessible_files) == 0:
+            print('WARNING: no files were found. pip installing google-cloud-storage...')
+            pip.main(['install', 'google-cloud-storage'])
+
+            # try again to access the files
+            accessible_files = check_files(check_url, verbose, refresh=True)
+
+            if len(accessible_files) == 0: # if you still have a problem
+                print('WARNING: pip install google-cloud-storage did not solve the problem! Data not accessible.')
+
+    return plan_transfers(manifest, cache=cache, select=select, optional=optional)
+
+
+def gatk_init(tutorial, verbose=False, max_workers=DEFAULT_MAX_WORKERS, use_cache=True,
+              select=None, optional=False, background=False):
     ''' tutorial = 'germline' or 'somatic'
+    max_workers = how many files are downloaded at the same time
+    use_cache = link files from CACHE_DIR when an earlier call already fetched them
+    select, optional = which manifest entries to fetch, as for plan_init
+    background = return at once with a gatk.prefetch.Prefetch that fetches the
+    files in manifest order; handle.wait_for(path) blocks until path is local
+    returns one TransferResult (url, path, bytes, seconds, status, error) per file
+    raises gatk.manifest.DiskSpaceError, before downloading anything, when the
+    files would not fit on disk
     '''
     global BUCKET
     global WORKSHOP
@@ -90,40 +180,126 @@ def gatk_init(tutorial, verbose=False):
         if not os.path.exists(path):
             os.makedirs(path)
 
-    # Check if data is accessible. The command should list several gs:// URLs.
-    system_command = check_data_commands[tutorial]
-    accessible_files = check_files(system_command, verbose)
-    
-    # if files were not listed, pip install google cloud
-    # TODO: test that this works!
-    if len(accessible_files) == 0:
-        print('WARNING: no files were found. pip installing google-cloud-storage...')
-        pip.main(['install', google-cloud-storage])
-
-        # try again to access the files
-        accessible_files = check_files(system_command, verbose)
-        
-        if len(accessible_files) == 0: # if you still have a problem
-            print('WARNING: pip install google-cloud-storage did not solve the problem! Data not accessible.')
-
-
-    # Download Data to the Notebook
-    system_commands = data_copy_commands[tutorial]
-
-    for system_command in system_commands:
-        os.system(system_command)
-        target_folder = system_command.split(" ")[-1]
-        copied_files = os.popen("ls "+target_folder).read()
-        if len(copied_files) > 0:
-            outcome = 'Data copied successfully!'
-        else:
-            outcome = 'WARNING: No data copied!'
-        if verbose:
-            print("Copied files to "+target_folder+":")
-            print(copied_files)
-        else:
-            print("Copied files to " + target_folder + " - " + outcome)
+    # Work out every transfer and check the disk before any bytes move
+    plan = plan_init(tutorial, select, optional, use_cache, verbose)
+    plan.report(verbose)
+    plan.check_space()
+
+    known = [TransferResult(item.info.url, item.path, item.info.size, 0.0, 'unchanged', None, 'size', 0)
+             for item in plan.by_action('present')]
+    known += [TransferResult(item.entry.object, item.entry.destination, 0, 0.0, 'missing',
+                             'no objects matched')
+              for item in plan.by_action('missing') if not item.entry.optional]
+    known += [TransferResult(item.info.url, item.path, 0, 0.0, 'failed', item.problem)
+              for item in plan.by_action('changed')]
+
+    if background:
+        handle = Prefetch(plan.transfers(), max_workers=max_workers, cache=plan.cache,
+                          verbose=verbose, results=known)
+        print("Fetching {} files in the background; use wait_for(path) before reading one.".format(
+            len(plan.transfers())))
+        return handle
+
+    # Download Data to the Notebook, several files at a time
+    results = known + fetch_objects(plan.transfers(), max_workers=max_workers, cache=plan.cache,
+                                    verbose=verbose)
+    report_init(results, verbose)
+    return results
+
+
+def tutorial_directories():
+    ''' the cache and every tutorial's input directories that exist on this VM
+    '''
+    directories = [CACHE_DIR] + [d for dirs in input_directories.values() for d in dirs]
+    return [d for d in directories if os.path.isdir(d)]
+
+
+def report_init(results, verbose=False):
+    ''' totals per status and warnings for the files gatk_init fetched
+    '''
+    for status, (n_files, n_bytes) in sorted(summarize(results).items()):
+        print("{}: {} files, {:.1f} MB".format(status, n_files, n_bytes / 1e6))
+    for r in results:
+        if r.status in ('failed', 'missing'):
+            print("WARNING: {} - {}".format(r.url, r.error))
+    if verbose:
+        print("\nVerification:")
+        verification_report(results)
     
     print("\nInitialization complete!")
 
 
+def dedupe_tutorials(dry_run=False, verbose=False):
+    ''' replace identical files across the tutorial input directories and the
+    cache by shared copies (reflinks where the disk supports them, else hard
+    links) and report the space freed; sandboxes and other outputs are not touched
+    '''
+    results = dedupe(tutorial_directories(), dry_run=dry_run, verbose=verbose)
+    freed = sum(r.bytes for r in results)
+    print("{} duplicate files, {:.1f} MB {}".format(
+        len(results), freed / 1e6, 'could be freed' if dry_run else 'freed'))
+    return results
+
+
+def sync_sandbox(tutorial='germline', delete=False, verbose=False, max_workers=DEFAULT_MAX_WORKERS):
+    ''' upload new or changed sandbox files to $BUCKET/sandbox
+    replaces re-running "gsutil cp sandbox/* $BUCKET/sandbox" after every step;
+    files already uploaded and unchanged since are skipped.
+    delete = also remove bucket copies of files deleted from the sandbox
+    '''
+    results = sync_directory(sandbox_directories[tutorial], BUCKET + '/sandbox', delete=delete,
+                             max_workers=max_workers, verbose=verbose)
+    for status, (n_files, n_bytes) in sorted(summarize(results).items()):
+        print("{}: {} files, {:.1f} MB".format(status, n_files, n_bytes / 1e6))
+    return results
+
+
+def germline_pipeline(interval='20:10,000,000-10,200,000', home='/home/jupyter-user/2-germline-vd'):
+    ''' the germline notebook's GATK cells as a gatk.pipeline.Pipeline
+    HaplotypeCaller and GenomicsDBImport run side by side, as do SelectVariants
+    and GenotypeGVCFs, the two CalculateGenotypePosteriors runs and the two
+    CollectVariantCallingMetrics runs. Usage:
+        germline_pipeline().run(max_cpus=4, max_memory_gb=14)
+    '''
+    data = 'gs://gatk-tutorials/' + WORKSHOP + '/2-germline'
+    ref = home + '/ref/ref.fasta'
+    sandbox = home + '/sandbox/'
+    workspace = sandbox + 'trio'
+    gvcfs = [data + '/gvcfs/' + s + '.g.vcf.gz' for s in ('mother', 'father', 'son')]
+    ped = home + '/trio.ped'
+    gnomad = home + '/resources/af-only-gnomad.chr20subset.b37.vcf.gz'
+    dbsnp = home + '/resources/dbsnp.vcf'
+
+    pipeline = Pipeline(state_path=sandbox + '.pipeline_state.json')
+    pipeline.add(gatk_step('mother_gvcf', 'HaplotypeCaller',
+                           inputs=[data + '/ref/ref.fasta', data + '/bams/mother.bam'],
+                           outputs=[sandbox + 'mother.g.vcf'],
+                           R=data + '/ref/ref.fasta', I=data + '/bams/mother.bam',
+                           O=sandbox + 'mother.g.vcf', ERC='GVCF', L=interval))
+    # GenomicsDBImport refuses to write into an existing workspace
+    pipeline.add(gatk_step('genomicsdb', 'GenomicsDBImport', inputs=gvcfs, outputs=[workspace],
+                           clean_outputs=True, V=gvcfs, genomicsdb_workspace_path=workspace,
+                           intervals=interval))
+    pipeline.add(gatk_step('select_variants', 'SelectVariants', inputs=[ref, workspace],
+                           outputs=[sandbox + 'trio_selectvariants.g.vcf'],
+                           R=ref, V='gendb://' + workspace, O=sandbox + 'trio_selectvariants.g.vcf'))
+    pipeline.add(gatk_step('genotype_gvcfs', 'GenotypeGVCFs', inputs=[ref, workspace],
+                           outputs=[sandbox + 'trioGGVCF.vcf'],
+                           R=ref, V='gendb://' + workspace, O=sandbox + 'trioGGVCF.vcf', L=interval))
+    pipeline.add(gatk_step('cgp', 'CalculateGenotypePosteriors',
+                           inputs=[sandbox + 'trioGGVCF.vcf', ped], outputs=[sandbox + 'trioCGP.vcf'],
+                           V=sandbox + 'trioGGVCF.vcf', ped=ped, skip_population_priors=True,
+                           O=sandbox + 'trioCGP.vcf'))
+    pipeline.add(gatk_step('cgp_gnomad', 'CalculateGenotypePosteriors',
+                           inputs=[sandbox + 'trioGGVCF.vcf', ped, gnomad],
+                           outputs=[sandbox + 'trioCGP_gnomad.vcf'],
+                           V=sandbox + 'trioGGVCF.vcf', ped=ped, supporting_callsets=gnomad,
+                           O=sandbox + 'trioCGP_gnomad.vcf'))
+    for name, vcf in (('ggvcf_metrics', 'trioGGVCF'), ('cgp_metrics', 'trioCGP')):
+        prefix = sandbox + vcf + '_metrics'
+        pipeline.add(gatk_step(name, 'CollectVariantCallingMetrics',
+                               inputs=[sandbox + vcf + '.vcf', dbsnp],
+                               outputs=[prefix + '.variant_calling_detail_metrics',
+                                        prefix + '.variant_calling_summary_metrics'],
+                               I=sandbox + vcf + '.vcf', DBSNP=dbsnp, O=prefix))
+    return pipeline
@@ -0,0 +1,182 @@
+""" memory-mapped genotype arrays for callsets, converted once per file
+
+notes:
+- the first load_callset of a VCF parses GT, GQ, DP, PL and PP into .npy
+files under ~/.cache/terranblib/genotypes/<md5 of the VCF>.v1/; later loads, from
+a restarted kernel or another notebook on the same VM, open them with
+mmap_mode='r', so nothing is parsed or copied until the values are used.
+- the cache key is the content hash, so an edited or regenerated VCF gets a
+new entry. Hashing is itself a full read, so sources.json remembers each
+path's hash next to its size and mtime and only rehashes when those change.
+- conversion makes two passes: one counts sites and the widest ALT to size
+the arrays, the second fills them batch by batch through np.lib.format
+.open_memmap, so memory use does not grow with the file. The entry is built
+in a temporary directory and renamed into place, so a reader never sees a
+half-written one.
+- arrays are samples x sites like gatk.pedigree.Genotypes: gt int8 genotype
+codes (-1 no-call), gq int16 and dp int32 (-1 when absent), pl and pp int32
+samples x sites x genotypes, padded with -1 past each site's genotype count.
+
+usage:
+    cgp = load_callset('sandbox/trioCGP.vcf')
+    cgp.pl[0, :10]
+    compare_callsets(load_callset('sandbox/trioGGVCF.vcf').genotypes(), cgp.genotypes(), ped)
+"""
+import base64
+import json
+import os
+import shutil
+
+import numpy as np
+
+from gatk.cache import DEFAULT_CACHE_DIR as CACHE_ROOT
+from gatk.checksum import file_digests
+from gatk.pedigree import DEFAULT_BATCH_SIZE, Genotypes, decode_genotypes
+from gatk.vcf import MISSING, VCFReader
+from gatk.vcf_columns import batches, format_field, int_column, list_column, site_columns, split_lines
+
+
+DEFAULT_CACHE_DIR = os.path.join(CACHE_ROOT, 'genotypes')
+# bump when the layout changes so old entries are not opened
+CACHE_VERSION = 1
+SITE_ARRAYS = ('contig', 'pos', 'n_alleles')
+SAMPLE_ARRAYS = ('gt', 'gq', 'dp')
+LIKELIHOOD_ARRAYS = ('pl', 'pp')
+DTYPES = {'contig': np.int32, 'pos': np.int64, 'n_alleles': np.int8,
+          'gt': np.int8, 'gq': np.int16, 'dp': np.int32, 'pl': np.int32, 'pp': np.int32}
+
+
+def _save_json(path, value):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+
+
+def source_hash(path, cache_dir=DEFAULT_CACHE_DIR):
+    ''' hex md5 of a file, remembered against its size and mtime
+    '''
+    sources_path = os.path.join(cache_dir, 'sources.json')
+    try:
+        with open(sources_path) as f:
+            sources = json.load(f)
+    except (IOError, ValueError):
+        sources = {}
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    known = sources.get(key)
+    if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+    digest = base64.b64decode(file_digests(path, ('md5',))['md5']).hex()
+    sources[key] = [stat.st_size, stat.st_mtime_ns, digest]
+    os.makedirs(cache_dir, exist_ok=True)
+    _save_json(sources_path, sources)
+    return digest
+
+
+class Callset(object):
+    ''' arrays of one converted VCF; see the module notes for shapes and dtypes
+    '''
+
+    def __init__(self, directory, meta, arrays):
+        self.directory = directory
+        self.source = meta['source']
+        self.samples = meta['samples']
+        self.contigs = meta['contigs']
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.pos)
+
+    def genotypes(self):
+        ''' the GT/GQ view used by gatk.pedigree
+        '''
+        return Genotypes(self.samples, self.contigs, self.contig, self.pos, self.n_alleles,
+                         self.gt, self.gq)
+
+
+def _shape(lines):
+    ''' (sites, widest genotype count) of a VCF body, for sizing the arrays
+    '''
+    sites, max_alleles = 0, 1
+    for line in lines:
+        if line.startswith('#') or not line.strip():
+            continue
+        sites += 1
+        alt = line.split('\t', 5)[4]
+        max_alleles = max(max_alleles, 1 if alt == MISSING else alt.count(',') + 2)
+    return sites, max_alleles * (max_alleles + 1) // 2
+
+
+def convert(path, directory, batch_size=DEFAULT_BATCH_SIZE):
+    ''' write the arrays of a VCF into directory as .npy files
+    '''
+    with VCFReader(path) as reader:
+        samples = reader.header.samples
+        n_sites, width = _shape(reader.lines())
+    os.makedirs(directory)
+    n = len(samples)
+    shapes = dict([(name, (n_sites,)) for name in SITE_ARRAYS]
+                  + [(name, (n, n_sites)) for name in SAMPLE_ARRAYS]
+                  + [(name, (n, n_sites, width)) for name in LIKELIHOOD_ARRAYS])
+    arrays = dict((name, np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), 'w+',
+                                                   DTYPES[name], shapes[name]))
+                  for name in DTYPES)
+    contigs, contig_codes = [], {}
+    start = 0
+    with VCFReader(path) as reader:
+        for batch in batches(reader.lines(), batch_size):
+            chrom, pos, alt, formats, fields = split_lines(batch)
+            stop = start + len(pos)
+            contig, n_alleles = site_columns(chrom, alt, contig_codes, contigs)
+            for name, column in zip(SITE_ARRAYS, (contig, pos, n_alleles)):
+                arrays[name][start:stop] = column
+            arrays['gt'][:, start:stop] = decode_genotypes(np.char.partition(fields, ':')[..., 0]).T
+            for name in ('gq', 'dp'):
+                values = format_field(fields, formats, name.upper())
+                arrays[name][:, start:stop] = int_column(values, DTYPES[name]).T
+            for name in LIKELIHOOD_ARRAYS:
+                values = format_field(fields, formats, name.upper())
+                arrays[name][:, start:stop] = np.swapaxes(list_column(values, width, DTYPES[name]), 0, 1)
+            start = stop
+    for array in arrays.values():
+        array.flush()
+    del arrays
+    meta = {'version': CACHE_VERSION, 'source': os.path.abspath(path), 'samples': samples,
+            'contigs': contigs, 'sites': n_sites}
+    _save_json(os.path.join(directory, 'meta.json'), meta)
+
+
+def open_callset(directory):
+    ''' Callset of an existing entry, arrays memory-mapped read-only
+    '''
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_VERSION:
+        raise ValueError('{} has cache version {}, expected {}'.format(
+            directory, meta.get('version'), CACHE_VERSION))
+    arrays = dict((name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+                  for name in DTYPES)
+    return Callset(directory, meta, arrays)
+
+
+def load_callset(path, cache_dir=DEFAULT_CACHE_DIR, refresh=False, batch_size=DEFAULT_BATCH_SIZE):
+    ''' Callset of a VCF, converting it on the first call for its contents
+    '''
+    directory = os.path.join(cache_dir, '{}.v{}'.format(source_hash(path, cache_dir), CACHE_VERSION))
+    if refresh:
+        shutil.rmtree(directory, ignore_errors=True)
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        tmp = '{}.{}.tmp'.format(directory, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            convert(path, tmp, batch_size)
+            try:
+                os.rename(tmp, directory)
+            except OSError:
+                # another process finished the same conversion first
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return open_callset(directory)
@@ -0,0 +1,401 @@
+""" streaming merge of single- or multi-sample GVCFs into one cohort GVCF
+
+notes:
+- a lightweight stand-in for GenomicsDBImport/CombineGVCFs on small cohorts:
+the inputs are read once, side by side, with a heap keyed on (contig, start)
+deciding which record comes next. Only the records of every input still
+open at the current position are held in memory.
+- an input may have records inside an earlier one (GATK writes the positions
+inside a deletion as records of their own). Each input keeps a stack of its
+open records and the latest one describes the sample until it ends; two
+records of one input starting at the same position are an error.
+- reference blocks are split wherever another input's record starts or
+ends, so every output block has one row of values per sample. The REF base
+of a split block comes from a record covering it, else from reference (a
+FASTA with its .fai, as CombineGVCFs takes -R); without a reference such a
+block raises ValueError rather than writing a made-up base.
+- at a variant site the longest REF wins and shorter REFs extend their ALT
+alleles to match, as CombineGVCFs does. Number=R/A/G FORMAT values (AD, PL)
+are remapped to the merged allele list; alleles a sample did not see take the
+values of its <NON_REF> allele. Samples in a reference block there keep
+0/0 with their block PL mapped the same way.
+- samples with no record at a position, or inside their own deletion, are
+no-calls (./.).
+- INFO at variant sites is the first value of each key across the samples'
+records; allele-specific keys are kept only when the allele list is unchanged.
+
+usage, instead of GenomicsDBImport followed by SelectVariants:
+    merge_gvcfs(['mother.g.vcf.gz', 'father.g.vcf.gz', 'son.g.vcf.gz'],
+                'sandbox/trio.g.vcf', region='20:10,000,000-10,200,000',
+                reference='ref/ref.fasta')
+"""
+import functools
+import heapq
+
+from gatk.bgzf import BgzfWriter
+from gatk.fasta import FastaFile
+from gatk.intervals import parse_region
+from gatk.tabix import TabixFile, index_path_for
+from gatk.vcf import COLUMNS, MISSING, VCFReader
+
+NON_REF = '<NON_REF>'
+ALLELE_NUMBERS = ('A', 'R', 'G')
+
+
+class _Site(object):
+    ''' the parts of one input line the merge needs
+    '''
+    __slots__ = ('contig', 'start', 'end', 'id', 'ref', 'alts', 'non_ref', 'info',
+                 'format', 'samples')
+
+    def __init__(self, fields):
+        self.contig = fields[0]
+        self.start = int(fields[1])
+        self.id = fields[2]
+        self.ref = fields[3]
+        alts = [] if fields[4] == MISSING else fields[4].split(',')
+        self.non_ref = NON_REF in alts
+        self.alts = [a for a in alts if a != NON_REF]
+        self.info = [] if fields[7] == MISSING else fields[7].split(';')
+        self.end = self.start + len(self.ref) - 1
+        for item in self.info:
+            if item.startswith('END='):
+                self.end = int(item[4:])
+        self.format = fields[8].split(':') if len(fields) > 8 else []
+        self.samples = [s.split(':') for s in fields[9:]]
+
+    @property
+    def is_variant(self):
+        return bool(self.alts)
+
+    def alleles(self):
+        return [self.ref] + self.alts + ([NON_REF] if self.non_ref else [])
+
+    def value(self, sample, key):
+        try:
+            return self.samples[sample][self.format.index(key)]
+        except (ValueError, IndexError):
+            return MISSING
+
+
+def merge_headers(headers):
+    ''' header lines of the first input plus definitions only the others have,
+    and a #CHROM line naming every sample
+    '''
+    lines = [l for l in headers[0].lines if not l.startswith('#CHROM')]
+    seen = set(l.split(',', 1)[0] for l in lines if l.startswith('##') and '=<' in l)
+    samples = []
+    for header in headers:
+        for line in header.lines:
+            if line.startswith('##') and '=<' in line:
+                key = line.split(',', 1)[0]
+                if key not in seen:
+                    seen.add(key)
+                    lines.append(line)
+        for name in header.samples:
+            if name in samples:
+                raise ValueError('sample {} appears in more than one input'.format(name))
+            samples.append(name)
+    lines.append('\t'.join(('#' + COLUMNS[0],) + COLUMNS[1:] + tuple(samples)) + '\n')
+    return lines, samples
+
+
+def _genotypes(n_alleles, ploidy):
+    ''' allele index tuples in VCF genotype order
+    '''
+    if ploidy == 1:
+        return [(a,) for a in range(n_alleles)]
+    return [(j, k) for k in range(n_alleles) for j in range(k + 1)]
+
+
+def _genotype_index(alleles):
+    if len(alleles) == 1:
+        return alleles[0]
+    j, k = sorted(alleles)
+    return k * (k + 1) // 2 + j
+
+
+@functools.lru_cache(maxsize=4096)
+def _genotype_map(mapping, ploidy):
+    ''' for every merged genotype, the index of the sample genotype it takes
+    its value from, or None
+    '''
+    out = []
+    for genotype in _genotypes(len(mapping), ploidy):
+        sample = [mapping[a] for a in genotype]
+        out.append(None if None in sample else _genotype_index(sample))
+    return out
+
+
+def _remap_values(raw, number, mapping, ploidy):
+    ''' reorder a Number=A/R/G value for the merged alleles; mapping[m] is
+    the sample's allele index for merged allele m, or None
+    '''
+    if raw == MISSING:
+        return raw
+    values = raw.split(',')
+    if number == 'R':
+        indices = mapping
+    elif number == 'A':
+        indices = [i - 1 if i else None for i in mapping[1:]]
+    elif ploidy in (1, 2):
+        indices = _genotype_map(mapping, ploidy)
+    else:
+        return MISSING
+    return ','.join(values[i] if i is not None and i < len(values) else MISSING for i in indices)
+
+
+def _remap_gt(gt, inverse):
+    ''' sample allele indices in a GT string -> merged indices
+    '''
+    out = []
+    allele = ''
+    for c in gt + '/':
+        if c in '/|':
+            out.append(allele if allele in ('', MISSING) else str(inverse[int(allele)]))
+            out.append(c)
+            allele = ''
+        else:
+            allele += c
+    return ''.join(out[:-1])
+
+
+def _no_call(keys, ploidy=2):
+    return ':'.join('/'.join([MISSING] * ploidy) if k == 'GT' else MISSING for k in keys)
+
+
+def _format_keys(sites):
+    keys = ['GT']
+    for site in sites:
+        for key in site.format:
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def _ploidy(site, sample):
+    gt = site.value(sample, 'GT')
+    return gt.count('/') + gt.count('|') + 1 if gt != MISSING else 2
+
+
+def _has_index(path):
+    try:
+        index_path_for(path)
+        return True
+    except IOError:
+        return False
+
+
+class _Input(object):
+    ''' one GVCF being merged: its header, sample columns and record stream
+    '''
+
+    def __init__(self, path, region):
+        self.path = path
+        if region is not None and _has_index(path):
+            self._tabix = TabixFile(path)
+            self.header = self._tabix.header()
+            lines = self._tabix.fetch(region)
+        else:
+            self._tabix = None
+            self._reader = VCFReader(path)
+            self.header = self._reader.header
+            lines = self._reader.lines()
+        self.records = (_Site(line.rstrip('\n').split('\t')) for line in lines
+                        if line.strip() and not line.startswith('#'))
+        self.n_samples = len(self.header.samples)
+
+    def close(self):
+        if self._tabix is not None:
+            self._tabix.close()
+        else:
+            self._reader.close()
+
+
+class GVCFMerger(object):
+    ''' merges inputs into out (a file opened for writing bytes)
+    '''
+
+    def __init__(self, paths, region=None, reference=None):
+        self.region = parse_region(region) if region else None
+        self.reference = FastaFile(reference) if reference else None
+        self.inputs = [_Input(p, region) for p in paths]
+        self.header_lines, self.samples = merge_headers([i.header for i in self.inputs])
+        self.formats = {}
+        self.infos = {}
+        for i in self.inputs:
+            for key, definition in i.header.format.items():
+                self.formats.setdefault(key, definition.get('Number'))
+            for key, definition in i.header.info.items():
+                self.infos.setdefault(key, definition.get('Number'))
+        self.contigs = dict((c.get('ID'), n) for n, c in enumerate(self.inputs[0].header.contigs))
+        # (input index, sample index within it) for every output sample column
+        self.columns = [(i, s) for i, inp in enumerate(self.inputs) for s in range(inp.n_samples)]
+
+    def _contig_order(self, name):
+        if name not in self.contigs:
+            self.contigs[name] = len(self.contigs)
+        return self.contigs[name]
+
+    def _push(self, heap, i):
+        for site in self.inputs[i].records:
+            if self.region is not None:
+                contig, start, end = self.region
+                if site.contig != contig or site.end < start or (end is not None and site.start > end):
+                    continue
+            heapq.heappush(heap, (self._contig_order(site.contig), site.start, i, site))
+            return
+
+    def records(self):
+        ''' the merged data lines, without newline
+        '''
+        heap = []
+        for i in range(len(self.inputs)):
+            self._push(heap, i)
+        # every input's open records, oldest first; the last one is current
+        stacks = [[] for _ in self.inputs]
+        columns = self.columns
+        region_start, region_end = (self.region[1], self.region[2]) if self.region else (1, None)
+        contig, pos = None, None
+        while heap or any(stacks):
+            if not any(stacks):
+                contig, pos = heap[0][3].contig, max(heap[0][1], region_start)
+            order = self._contig_order(contig)
+            while heap and heap[0][:2] <= (order, pos):
+                _, _, i, site = heapq.heappop(heap)
+                if stacks[i] and stacks[i][-1].start == site.start:
+                    raise ValueError('{} has two records at {}:{}'.format(
+                        self.inputs[i].path, site.contig, site.start))
+                stacks[i].append(site)
+                self._push(heap, i)
+            if region_end is not None and pos > region_end:
+                break
+            active = [stack[-1] if stack else None for stack in stacks]
+            starting = [i for i, s in enumerate(active) if s is not None and s.start == pos and s.is_variant]
+            if starting:
+                yield self._variant_line(active, starting, columns, contig, pos)
+                stop = pos + 1
+            else:
+                stop = min(s.end for s in active if s is not None) + 1
+                if heap and heap[0][0] == order:
+                    stop = min(stop, heap[0][1])
+                if region_end is not None:
+                    stop = min(stop, region_end + 1)
+                line = self._block_line(active, stacks, columns, contig, pos, stop - 1)
+                if line is not None:
+                    yield line
+            pos = stop
+            for i, stack in enumerate(stacks):
+                if any(site.end < pos for site in stack):
+                    stacks[i] = [site for site in stack if site.end >= pos]
+
+    def _reference_base(self, stacks, contig, pos):
+        for stack in stacks:
+            for site in stack:
+                if site.start <= pos < site.start + len(site.ref):
+                    return site.ref[pos - site.start]
+        if self.reference is None:
+            raise ValueError('no input has the reference base at {}:{}; pass reference= '
+                             '(a FASTA with its .fai)'.format(contig, pos))
+        return self.reference.base(contig, pos)
+
+    def _block_line(self, active, stacks, columns, contig, pos, end):
+        blocks = [s for s in active if s is not None and not s.is_variant]
+        if not blocks:
+            # only deletions span this stretch; their samples are no-calls
+            return None
+        ref = self._reference_base(stacks, contig, pos)
+        keys = _format_keys(blocks)
+        samples = []
+        for i, s in columns:
+            site = active[i]
+            if site is None or site.is_variant:
+                samples.append(_no_call(keys))
+            else:
+                samples.append(':'.join(site.value(s, k) for k in keys))
+        return '\t'.join([contig, str(pos), MISSING, ref, NON_REF, MISSING, MISSING,
+                          'END={}'.format(end), ':'.join(keys)] + samples)
+
+    def _variant_line(self, active, starting, columns, contig, pos):
+        ref = max((active[i].ref for i in starting), key=len)
+        alts = []
+        for i in starting:
+            site = active[i]
+            for alt in site.alts:
+                extended = alt if alt.startswith('<') or alt == '*' else alt + ref[len(site.ref):]
+                if extended not in alts:
+                    alts.append(extended)
+        merged = [ref] + alts + [NON_REF]
+        present = [s for s in active if s is not None and (s.start == pos or not s.is_variant)]
+        keys = _format_keys(present)
+
+        samples = []
+        for i, s in columns:
+            site = active[i]
+            if site is None or (site.is_variant and site.start != pos):
+                samples.append(_no_call(keys))
+                continue
+            # the sample's alleles written against the merged REF
+            suffix = ref[len(site.ref):] if site.is_variant else ''
+            own = [ref] + [a if a.startswith('<') or a == '*' else a + suffix
+                           for a in site.alleles()[1:]]
+            fallback = own.index(NON_REF) if NON_REF in own else None
+            mapping = tuple(own.index(a) if a in own else fallback for a in merged)
+            inverse = dict((j, merged.index(a)) for j, a in enumerate(own))
+            ploidy = _ploidy(site, s)
+            values = []
+            for key in keys:
+                raw = site.value(s, key)
+                if key == 'GT':
+                    values.append(_remap_gt(raw, inverse) if raw != MISSING else raw)
+                elif self.formats.get(key) in ALLELE_NUMBERS:
+                    values.append(_remap_values(raw, self.formats[key], mapping, ploidy))
+                else:
+                    values.append(raw)
+            samples.append(':'.join(values))
+
+        info, ids = [], []
+        seen = set()
+        for i in starting:
+            site = active[i]
+            if site.id != MISSING and site.id not in ids:
+                ids.append(site.id)
+            same_alleles = site.alleles() == merged
+            for item in site.info:
+                key = item.split('=', 1)[0]
+                if key == 'END' or key in seen:
+                    continue
+                if self.infos.get(key) in ALLELE_NUMBERS and not same_alleles:
+                    continue
+                seen.add(key)
+                info.append(item)
+        return '\t'.join([contig, str(pos), ';'.join(ids) or MISSING, ref, ','.join(alts + [NON_REF]),
+                          MISSING, MISSING, ';'.join(info) or MISSING, ':'.join(keys)] + samples)
+
+    def write(self, out):
+        out.write(''.join(self.header_lines).encode())
+        for line in self.records():
+            out.write((line + '\n').encode())
+
+    def close(self):
+        for i in self.inputs:
+            i.close()
+        if self.reference is not None:
+            self.reference.close()
+
+
+def merge_gvcfs(paths, output, region=None, reference=None):
+    ''' merge sorted GVCFs into output (bgzipped when it ends in .gz)
+
+    region limits the merge to one interval string; inputs with a tabix index
+    are then read only around it. reference is the FASTA (with .fai) the
+    GVCFs were called against, for the REF base of blocks no input starts.
+    Returns the merged sample names.
+    '''
+    merger = GVCFMerger(paths, region, reference)
+    try:
+        with (BgzfWriter(output) if output.endswith('.gz') else open(output, 'wb')) as out:
+            merger.write(out)
+    finally:
+        merger.close()
+    return merger.samples
@@ -0,0 +1,369 @@
+""" genomic interval strings as used by GATK -L and IGV
+
+notes:
+- positions are 1-based and inclusive, like the strings themselves.
+- commas are allowed as thousands separators: '20:10,002,371-10,002,546'.
+- a bare contig ('20') covers the whole contig and has end None, as does
+the open-ended form '20:10,000,000+'.
+- IntervalList keeps many intervals as three NumPy arrays (contig code,
+start, end) plus a sequence dictionary, so exome target lists with hundreds
+of thousands of intervals cost a few MB and every operation is vectorized.
+BED files are converted from 0-based half-open on the way in and out.
+- contig order comes from the sequence dictionary (interval_list @SQ lines
+or `lengths`), otherwise from first appearance.
+"""
+import gzip
+import re
+
+import numpy as np
+
+
+_RANGE = re.compile(r'^([0-9,]+)(?:-([0-9,]+)|(\+))?$')
+
+
+def parse_region(region):
+    ''' '20:10,002,371-10,002,546' -> ('20', 10002371, 10002546)
+    '20:10002458' -> ('20', 10002458, 10002458), '20' -> ('20', 1, None)
+    '''
+    region = region.strip()
+    contig, sep, span = region.rpartition(':')
+    match = _RANGE.match(span) if sep else None
+    if match is None:
+        # no range, or a contig name that itself contains ':'
+        return region, 1, None
+    start = int(match.group(1).replace(',', ''))
+    if match.group(3):
+        end = None
+    else:
+        end = int(match.group(2).replace(',', '')) if match.group(2) else start
+    if start < 1 or (end is not None and end < start):
+        raise ValueError('invalid interval: ' + region)
+    return contig, start, end
+
+
+def format_region(contig, start=1, end=None):
+    ''' inverse of parse_region, without thousands separators
+    '''
+    if end is None:
+        return contig if start == 1 else '{}:{}+'.format(contig, start)
+    return '{}:{}-{}'.format(contig, start, end)
+
+
+def split_region(region, n, contig_length=None):
+    ''' split a region string into n contiguous, near-equal shards
+
+    A whole-contig or open-ended region needs contig_length. Returns region
+    strings in coordinate order; fewer than n when the region is shorter.
+    '''
+    contig, start, end = parse_region(region)
+    if end is None:
+        if contig_length is None:
+            raise ValueError('contig_length is needed to split ' + region)
+        end = contig_length
+    length = end - start + 1
+    n = max(1, min(n, length))
+    bounds = [start + (length * i) // n for i in range(n + 1)]
+    return [format_region(contig, bounds[i], bounds[i + 1] - 1) for i in range(n)]
+
+
+# GATK's largest position, standing in for the end of a contig of unknown length
+MAX_POSITION = 2**31 - 1
+
+
+def _key(codes, positions):
+    ''' one sortable int64 per (contig, position) pair
+    '''
+    return (np.asarray(codes, dtype=np.int64) << 32) | np.asarray(positions, dtype=np.int64)
+
+
+def _open(path):
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+
+class IntervalList(object):
+    ''' intervals as arrays: contig codes into contigs, 1-based inclusive start/end
+    '''
+
+    def __init__(self, contigs, contig, start, end, lengths=None):
+        self.contigs = list(contigs)
+        self.contig = np.asarray(contig, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.lengths = dict(lengths or {})
+        self._index = None
+
+    @classmethod
+    def from_strings(cls, regions, lengths=None):
+        ''' IntervalList from strings such as '20:10,000,000-10,200,000'
+        '''
+        lengths = dict(lengths or {})
+        contigs = list(lengths)
+        codes = dict((c, i) for i, c in enumerate(contigs))
+        parsed = [parse_region(r) for r in regions]
+        for c, _, _ in parsed:
+            if c not in codes:
+                codes[c] = len(contigs)
+                contigs.append(c)
+        contig = np.fromiter((codes[c] for c, _, _ in parsed), dtype=np.int32, count=len(parsed))
+        start = np.fromiter((s for _, s, _ in parsed), dtype=np.int64, count=len(parsed))
+        end = np.fromiter((lengths.get(c, MAX_POSITION) if e is None else e for c, _, e in parsed),
+                          dtype=np.int64, count=len(parsed))
+        return cls(contigs, contig, start, end, lengths)
+
+    @classmethod
+    def _from_columns(cls, names, start, end, contigs=(), lengths=None):
+        names = np.asarray(names, dtype=str)
+        uniques, first, inverse = np.unique(names, return_index=True, return_inverse=True)
+        contigs = list(contigs)
+        known = dict((c, i) for i, c in enumerate(contigs))
+        for i in np.argsort(first):
+            if uniques[i] not in known:
+                known[str(uniques[i])] = len(contigs)
+                contigs.append(str(uniques[i]))
+        lookup = np.array([known[u] for u in uniques], dtype=np.int32)
+        return cls(contigs, lookup[inverse.ravel()] if len(names) else [], start, end, lengths)
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, selection):
+        ''' a subset by index array, boolean mask or slice
+        '''
+        if isinstance(selection, (int, np.integer)):
+            selection = [selection]
+        return IntervalList(self.contigs, self.contig[selection], self.start[selection],
+                            self.end[selection], self.lengths)
+
+    def __repr__(self):
+        return '<IntervalList {} intervals, {} bases>'.format(len(self), self.total_bases())
+
+    def total_bases(self):
+        return int((self.end - self.start + 1).sum())
+
+    def to_strings(self):
+        ''' GATK/IGV region strings, whole contigs written as the bare name
+        '''
+        out = []
+        for c, s, e in zip(self.contig.tolist(), self.start.tolist(), self.end.tolist()):
+            name = self.contigs[c]
+            whole = e >= self.lengths.get(name, MAX_POSITION)
+            out.append(format_region(name, s, None if whole and s == 1 else e))
+        return out
+
+    def _with(self, contig, start, end):
+        return IntervalList(self.contigs, contig, start, end, self.lengths)
+
+    def _aligned(self, other):
+        ''' (contigs, other's contig codes in them): this list's contigs followed
+        by those only other has; this list is left as it is
+        '''
+        if other.contigs == self.contigs:
+            return self.contigs, other.contig
+        contigs = list(self.contigs)
+        codes = dict((name, i) for i, name in enumerate(contigs))
+        for name in other.contigs:
+            if name not in codes:
+                codes[name] = len(contigs)
+                contigs.append(name)
+        lookup = np.array([codes[n] for n in other.contigs], dtype=np.int32)
+        return contigs, lookup[other.contig] if len(other.contig) else other.contig
+
+    def sort(self):
+        order = np.lexsort((self.end, self.start, self.contig))
+        return self[order]
+
+    def merge(self, gap=0):
+        ''' sorted union; overlapping and abutting intervals, and those less
+        than gap bases apart, become one
+        '''
+        if len(self) == 0:
+            return self
+        s = self.sort()
+        reach = np.maximum.accumulate(_key(s.contig, s.end))
+        new = np.ones(len(s), dtype=bool)
+        new[1:] = _key(s.contig[1:], s.start[1:]) > reach[:-1] + 1 + gap
+        first = np.flatnonzero(new)
+        return self._with(s.contig[first], s.start[first], np.maximum.reduceat(s.end, first))
+
+    def pad(self, bases):
+        ''' extend both ends by bases, clipped to 1 and the contig length
+        '''
+        limits = np.array([self.lengths.get(c, MAX_POSITION) for c in self.contigs] or [0],
+                          dtype=np.int64)[self.contig]
+        return self._with(self.contig, np.maximum(self.start - bases, 1),
+                          np.minimum(self.end + bases, limits))
+
+    def _combine(self, other, keep):
+        ''' intervals where keep(in self, in other) holds, from a sweep over
+        the start/end events of both lists
+        '''
+        contigs, other_contig = self._aligned(other)
+        a = IntervalList(contigs, self.contig, self.start, self.end, self.lengths).merge()
+        b = IntervalList(contigs, other_contig, other.start, other.end).merge()
+        positions = np.concatenate([_key(a.contig, a.start), _key(a.contig, a.end + 1),
+                                    _key(b.contig, b.start), _key(b.contig, b.end + 1)])
+        na, nb = len(a), len(b)
+        delta_a = np.concatenate([np.ones(na), -np.ones(na), np.zeros(2 * nb)]).astype(np.int64)
+        delta_b = np.concatenate([np.zeros(2 * na), np.ones(nb), -np.ones(nb)]).astype(np.int64)
+        order = np.argsort(positions, kind='stable')
+        positions = positions[order]
+        in_a = np.cumsum(delta_a[order]) > 0
+        in_b = np.cumsum(delta_b[order]) > 0
+        # the state after the last event at each position holds up to the next position
+        last = np.ones(len(positions), dtype=bool)
+        last[:-1] = positions[1:] != positions[:-1]
+        positions, in_a, in_b = positions[last], in_a[last], in_b[last]
+        selected = np.flatnonzero(keep(in_a, in_b)[:-1])
+        starts, ends = positions[selected], positions[selected + 1] - 1
+        mask = np.int64(0xffffffff)
+        result = IntervalList(contigs, (starts >> 32).astype(np.int32), starts & mask, ends & mask,
+                              self.lengths)
+        return result.merge()
+
+    def union(self, other):
+        return self._combine(other, lambda a, b: a | b)
+
+    def intersect(self, other):
+        return self._combine(other, lambda a, b: a & b)
+
+    def subtract(self, other):
+        ''' the bases of this list not covered by other, merged
+        '''
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def split(self, n):
+        ''' n IntervalLists of near-equal size (in bases) covering the merged
+        list in order, cutting intervals at the shard boundaries
+        '''
+        merged = self.merge()
+        sizes = merged.end - merged.start + 1
+        cum_end = np.cumsum(sizes)
+        cum_start = cum_end - sizes
+        total = int(cum_end[-1]) if len(merged) else 0
+        n = max(1, min(n, total or 1))
+        bounds = (total * np.arange(1, n, dtype=np.int64)) // n
+        cuts = np.unique(np.concatenate([cum_start, cum_end, bounds]))
+        piece_start, piece_end = cuts[:-1], cuts[1:]
+        which = np.searchsorted(cum_start, piece_start, 'right') - 1
+        start = merged.start[which] + (piece_start - cum_start[which])
+        end = start + (piece_end - piece_start) - 1
+        shard = np.searchsorted(bounds, piece_start, 'right')
+        contig = merged.contig[which]
+        return [self._with(contig[shard == i], start[shard == i], end[shard == i]) for i in range(n)]
+
+    def index(self):
+        ''' the OverlapIndex of this list, built on first use
+        '''
+        if self._index is None:
+            self._index = OverlapIndex(self)
+        return self._index
+
+    def overlapping(self, region):
+        ''' the intervals overlapping a region string, in sorted order
+        '''
+        contig, start, end = parse_region(region)
+        if contig not in self.contigs:
+            return self[[]]
+        index = self.index()
+        return self[index.query(self.contigs.index(contig), start,
+                                MAX_POSITION if end is None else end)]
+
+    def overlap_counts(self, other):
+        ''' for every interval of other, how many intervals here overlap it
+        '''
+        return self.index().counts(self._aligned(other)[1], other.start, other.end)
+
+
+class OverlapIndex(object):
+    ''' intervals sorted by (contig, start) with the running maximum end, so a
+    query is two binary searches plus a scan of the candidates
+    '''
+
+    def __init__(self, intervals):
+        self.order = np.lexsort((intervals.start, intervals.contig))
+        self.start_keys = _key(intervals.contig[self.order], intervals.start[self.order])
+        self.end_keys = _key(intervals.contig[self.order], intervals.end[self.order])
+        self.reach = np.maximum.accumulate(self.end_keys) if len(self.order) else self.end_keys
+        self.sorted_end_keys = np.sort(self.end_keys)
+
+    def query(self, contig, start, end):
+        ''' indices (into the original list) of intervals overlapping contig:start-end
+        '''
+        lo = np.searchsorted(self.reach, _key(contig, start), 'left')
+        hi = np.searchsorted(self.start_keys, _key(contig, end), 'right')
+        candidates = np.arange(lo, max(lo, hi))
+        hits = candidates[self.end_keys[candidates] >= _key(contig, start)]
+        return self.order[hits]
+
+    def counts(self, contig, start, end):
+        ''' vectorized overlap counts: intervals starting at or before each
+        query end, minus those ending before its start
+        '''
+        started = np.searchsorted(self.start_keys, _key(contig, end), 'right')
+        finished = np.searchsorted(self.sorted_end_keys, _key(contig, start), 'left')
+        return started - finished
+
+
+_ROW = re.compile(r'^(?!#|@|track|browser)([^\t\n]+)\t(\d+)\t(\d+)', re.M)
+
+
+def _rows(text):
+    ''' (contig, start, end) columns of a BED or interval_list body, in one regex pass
+    '''
+    found = _ROW.findall(text)
+    if not found:
+        return np.array([], dtype=str), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    names, start, end = np.array(found, dtype=str).T
+    return names, start.astype(np.int64), end.astype(np.int64)
+
+
+def read_bed(path, lengths=None):
+    ''' IntervalList from a BED file (0-based, half-open)
+    '''
+    with _open(path) as f:
+        names, start, end = _rows(f.read())
+    return IntervalList._from_columns(names, start + 1, end, list(lengths or {}), lengths)
+
+
+def read_interval_list(path):
+    ''' IntervalList from a Picard interval_list; @SQ lines give contig order and lengths
+    '''
+    with _open(path) as f:
+        text = f.read()
+    lengths = {}
+    for line in re.findall(r'^@SQ\t.*$', text, re.M):
+        tags = dict(t.split(':', 1) for t in line.split('\t')[1:] if ':' in t)
+        lengths[tags['SN']] = int(tags['LN'])
+    names, start, end = _rows(text)
+    return IntervalList._from_columns(names, start, end, list(lengths), lengths)
+
+
+def read_intervals(path, lengths=None):
+    ''' .bed, .interval_list or a file of region strings (.list/.intervals), by extension
+    '''
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.bed'):
+        return read_bed(path, lengths)
+    if name.endswith('.interval_list'):
+        return read_interval_list(path)
+    with _open(path) as f:
+        return IntervalList.from_strings([l for l in f if l.strip() and not l.startswith('#')],
+                                         lengths)
+
+
+def write_bed(intervals, path):
+    with open(path, 'w') as f:
+        for c, s, e in zip(intervals.contig.tolist(), intervals.start.tolist(), intervals.end.tolist()):
+            f.write('{}\t{}\t{}\n'.format(intervals.contigs[c], s - 1, e))
+
+
+def write_interval_list(intervals, path):
+    ''' interval_list with an @SQ line per contig of known length
+    '''
+    with open(path, 'w') as f:
+        f.write('@HD\tVN:1.6\n')
+        for name in intervals.contigs:
+            if name in intervals.lengths:
+                f.write('@SQ\tSN:{}\tLN:{}\n'.format(name, intervals.lengths[name]))
+        for c, s, e in zip(intervals.contig.tolist(), intervals.start.tolist(), intervals.end.tolist()):
+            f.write('{}\t{}\t{}\t+\t.\n'.format(intervals.contigs[c], s, e))
@@ -0,0 +1,236 @@
+""" parallel localization of tutorial data into the notebook
+
+notes:
+- fetch_objects downloads (ObjectInfo, local path) pairs, as planned from a
+tutorial's manifest by gatk.manifest, with a bounded worker pool instead of
+one gsutil stream at a time.
+- each file gets a TransferResult so callers can see bytes, duration and
+status instead of a single "Data copied successfully!" line.
+- with a LocalCache (gatk.cache) listings and objects are reused across
+calls; cache hits are linked into place and reported as 'cached'.
+- a local file with the object's size that was written after the object was
+last updated is left alone and reported as 'unchanged'.
+- downloads go to a temporary file renamed into place, under a per-file lock
+shared with other notebooks on the VM (gatk.locking), so a file is fetched
+once and nobody reads it half-written.
+- large objects are fetched as concurrent byte ranges written into a file
+allocated up front (download_sliced), since a single stream is limited per
+connection rather than per VM. Every slice is hashed as it is written and
+the slices' crc32c values are combined in offset order; only an object with
+an md5 but no crc32c is hashed by reading the file back.
+- downloads are checked against the object's crc32c or md5, hashed while the
+bytes are written (gatk.checksum). A mismatch is downloaded again, up to
+`retries` more times, before the file is removed and reported as 'failed'.
+"""
+import collections
+import concurrent.futures
+import datetime
+import os
+import time
+
+from gatk.cache import LISTING_MAX_AGE, link_file
+from gatk.checksum import (ChecksumError, HashingWriter, check_copy, choose_algorithm,
+                           combined_crc32c, crc32c_available, file_digests)
+from gatk.locking import atomic_path, lock_for
+from gatk.storage import OffsetWriter, default_store, session_listings
+
+
+# verified: the check the file passed ('crc32c', 'md5', 'size') or None
+TransferResult = collections.namedtuple('TransferResult', ['url', 'path', 'bytes', 'seconds',
+                                                           'status', 'error', 'verified',
+                                                           'attempts'],
+                                        defaults=(None, 0))
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_RETRIES = 2
+# objects this big are split into SLICE_SIZE byte ranges fetched by up to
+# SLICE_WORKERS connections each; read when a download starts, so they can
+# be tuned here for a whole session
+SLICE_THRESHOLD = 128 << 20
+SLICE_SIZE = 32 << 20
+SLICE_WORKERS = 8
+
+
+def list_objects(pattern, store=None, cache=None, listing_max_age=LISTING_MAX_AGE):
+    ''' store.list(pattern), answered from the cache while its listing is fresh
+    and otherwise from the session's in-memory listings
+    '''
+    if cache is not None:
+        objects = cache.recall_listing(pattern, listing_max_age)
+        if objects is not None:
+            return objects
+    objects = session_listings.list(pattern, store or default_store())
+    if cache is not None:
+        cache.remember_listing(pattern, objects)
+    return objects
+
+
+def is_up_to_date(info, path):
+    ''' True when path has the object's size and was written after the object's
+    last update, so copying it again would change nothing
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if info.size is None or st.st_size != info.size:
+        return False
+    if not info.updated:
+        return False
+    return st.st_mtime >= datetime.datetime.fromisoformat(info.updated).timestamp()
+
+
+def download_sliced(info, path, store, slice_size=None, max_workers=None, checksums=()):
+    ''' download an object as byte ranges fetched concurrently into a file
+    allocated up front; returns {'crc32c': base64 digest} when crc32c is in
+    checksums, else None (the slices cannot be hashed in order as they arrive)
+    '''
+    slice_size = slice_size or SLICE_SIZE
+    max_workers = max_workers or SLICE_WORKERS
+    algorithms = ('crc32c',) if 'crc32c' in checksums else ()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, info.size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, info.size)
+
+        def fetch_slice(start):
+            end = min(start + slice_size, info.size)
+            writer = HashingWriter(OffsetWriter(fd, start), algorithms)
+            if hasattr(store, 'download_range'):
+                # streamed to its offset; a slice is never held in memory whole
+                store.download_range(info.url, start, end, writer, info.generation)
+            else:
+                for chunk in store.read_range(info.url, start, end, info.generation):
+                    writer.write(chunk)
+            crc = writer.hashes['crc32c'].value if algorithms else None
+            return crc, writer.bytes_written
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(fetch_slice, start) for start in range(0, info.size, slice_size)]
+            pieces = [future.result() for future in futures]
+    finally:
+        os.close(fd)
+    return {'crc32c': combined_crc32c(pieces)} if algorithms else None
+
+
+def download_verified(info, path, store, retries=DEFAULT_RETRIES, slice_threshold=None,
+                      slice_size=None):
+    ''' download an object to path and check it, retrying on a mismatch
+    objects of slice_threshold bytes or more are fetched in slices of
+    slice_size, when the store can read byte ranges
+    returns (check passed, attempts); raises ChecksumError when every attempt failed
+    '''
+    sliced = (hasattr(store, 'read_range') and info.size is not None
+              and info.size >= (slice_threshold or SLICE_THRESHOLD))
+    if sliced and info.crc32c and crc32c_available():
+        # slice digests combine for crc32c only, even where it is computed slowly
+        algorithm = 'crc32c'
+    else:
+        algorithm = choose_algorithm(info)
+    checksums = (algorithm,) if algorithm else ()
+    for attempt in range(1, retries + 2):
+        if sliced:
+            digests = download_sliced(info, path, store, slice_size, checksums=checksums)
+        else:
+            digests = store.download(info.url, path, checksums=checksums)
+        if digests is None:
+            # md5 of a sliced download, and stores that cannot hash while writing
+            digests = file_digests(path, checksums)
+        verified, problem = check_copy(info, os.path.getsize(path), digests)
+        if problem is None:
+            return verified, attempt
+    os.remove(path)
+    raise ChecksumError('{}: {} after {} attempts'.format(info.url, problem, attempt))
+
+
+def fetch_object(info, path, store=None, cache=None, retries=DEFAULT_RETRIES):
+    ''' download one object (or link it from the cache) and report how it went
+
+    The destination is locked for the whole transfer, so a notebook fetching
+    the same file waits for this one and then finds it up to date.
+    '''
+    store = store or default_store()
+    start = time.time()
+    if is_up_to_date(info, path):
+        return TransferResult(info.url, path, info.size, 0.0, 'unchanged', None, 'size', 0)
+    checked = [None, 0]
+
+    def download(target):
+        checked[:] = download_verified(info, target, store, retries)
+
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with lock_for(path, 'fetching ' + info.url):
+            # another notebook may have fetched it while we waited for the lock
+            if is_up_to_date(info, path):
+                return TransferResult(info.url, path, info.size, time.time() - start, 'unchanged',
+                                      None, 'size', 0)
+            if cache is None:
+                with atomic_path(path) as tmp:
+                    download(tmp)
+                status = 'copied'
+            else:
+                # cache entries were verified when they were added
+                cached = cache.lookup(info)
+                status = 'cached' if cached else 'copied'
+                if cached is None:
+                    cached = cache.add(info, download)
+                if checked[1] == 0:
+                    # linked from the cache, possibly filled by another notebook
+                    status = 'cached'
+                    checked[:] = check_copy(info, os.path.getsize(cached), {})[0], 0
+                link_file(cached, path)
+        return TransferResult(info.url, path, os.path.getsize(path),
+                              time.time() - start, status, None, checked[0], checked[1])
+    except Exception as e:
+        attempts = retries + 1 if isinstance(e, ChecksumError) else 1
+        return TransferResult(info.url, path, 0, time.time() - start, 'failed', str(e),
+                              None, attempts)
+
+
+def fetch_objects(transfers, max_workers=DEFAULT_MAX_WORKERS, store=None, cache=None,
+                  verbose=False, retries=DEFAULT_RETRIES):
+    ''' fetch_object for every (ObjectInfo, path) pair, max_workers at a time
+    '''
+    store = store or default_store()
+    results = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(fetch_object, info, path, store, cache, retries)
+                       for info, path in transfers]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if verbose:
+                    print('{} {} -> {} ({} bytes, {:.1f}s)'.format(result.status, result.url,
+                                                                   result.path, result.bytes,
+                                                                   result.seconds))
+                results.append(result)
+    finally:
+        # one index save for the whole batch
+        if cache is not None:
+            cache.flush()
+    return results
+
+
+def summarize(results):
+    ''' totals per status: {'copied': (n_files, n_bytes), ...}
+    '''
+    totals = {}
+    for r in results:
+        n, size = totals.get(r.status, (0, 0))
+        totals[r.status] = (n + 1, size + r.bytes)
+    return totals
+
+
+def verification_report(results):
+    ''' one line per file: status, the check it passed, attempts and path
+    '''
+    for r in sorted(results, key=lambda r: r.path or r.url):
+        check = r.verified or 'UNVERIFIED'
+        line = '{:10} {:10} {:>2}  {}'.format(r.status, check, r.attempts, r.path or r.url)
+        if r.error:
+            line += '  (' + r.error + ')'
+        print(line)
+
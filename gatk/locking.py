@@ -0,0 +1,160 @@
+""" process-safe coordination between notebooks on one VM
+
+notes:
+- FileLock is an exclusive fcntl.flock on a lock file. The kernel releases
+it when the holder exits, so a kernel that crashes or is restarted
+mid-download never leaves a stale lock behind.
+- lock_for(path) locks a destination or cache file through a lock file under
+LOCK_DIR named after the path, so notebook directories stay clean. While a
+lock is held its file says who holds it (pid, host, what for, since when);
+in_progress(path) reads that back without waiting.
+- the holder removes the lock file when it releases the lock, so LOCK_DIR
+only holds the locks in use. A waiter that then gets the lock on the removed
+file sees that its file is no longer the one at the path, and starts over.
+- atomic_path(path) hands out a temporary name next to path and renames it
+into place only when the block completes, so no reader, in this process
+or another, ever sees a half-written file.
+"""
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+
+LOCK_DIR = os.path.expanduser('~/.cache/terranblib/locks')
+LOCK_POLL = 0.1
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class FileLock(object):
+
+    def __init__(self, path, description=None, timeout=None):
+        ''' timeout = seconds to wait for the lock, None to wait as long as it takes
+        '''
+        self.path = path
+        self.description = description
+        self.timeout = timeout
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                self._lock(fd, deadline)
+                if _same_file(fd, self.path):
+                    break
+            except BaseException:
+                os.close(fd)
+                raise
+            # the previous holder removed the file while we waited for it
+            os.close(fd)
+        try:
+            holder = {'pid': os.getpid(), 'host': socket.gethostname(),
+                      'description': self.description, 'since': time.time()}
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, json.dumps(holder).encode(), 0)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def _lock(self, fd, deadline):
+        if deadline is None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if time.time() >= deadline:
+                    raise LockTimeout('{} is held by {}'.format(self.path, _holder(fd)))
+                time.sleep(LOCK_POLL)
+
+    def release(self):
+        if self._fd is not None:
+            # removed while still locked, so nobody can lock this file and hold it
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _same_file(fd, path):
+    ''' True when the open file fd is still the file at path
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    fst = os.fstat(fd)
+    return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+
+def _holder(fd):
+    try:
+        return json.loads(os.pread(fd, 4096, 0).decode())
+    except ValueError:
+        return None
+
+
+def lock_path(path):
+    return os.path.join(LOCK_DIR, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + '.lock')
+
+
+def lock_for(path, description=None, timeout=None):
+    ''' FileLock coordinating everyone who writes path
+    '''
+    return FileLock(lock_path(path), description, timeout)
+
+
+def in_progress(path):
+    ''' {'pid', 'host', 'description', 'since'} of whoever holds path's lock, or None
+    '''
+    try:
+        fd = os.open(lock_path(path), os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return None
+    except OSError:
+        return _holder(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    ''' yield a temporary path; on success it replaces path, on failure it is removed
+    '''
+    tmp = '{}.{}.{}.part'.format(path, os.getpid(), threading.get_ident())
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
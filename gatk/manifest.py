@@ -0,0 +1,220 @@
+""" declarative tutorial data manifests and transfer plans
+
+notes:
+- a manifest is a list of ManifestEntry: a bucket object or wildcard
+pattern, where it goes, and optionally its expected size and md5/crc32c
+(base64, as GCS reports them), whether it is optional, and a group name
+('ref', 'bams', ...) for picking a subset.
+- destinations: a single object goes to destination, or into it when
+destination ends with '/'. Objects matched by a pattern keep their path
+below the pattern's literal prefix, so 'gs://b/3-somatic/bams/**' into
+'/home/jupyter-user/bams/' reproduces gsutil cp -r.
+- plan_transfers resolves the manifest through bucket listings (metadata
+only), decides per file whether it is present, in the cache or has to be
+downloaded, and totals the bytes each filesystem must take. Nothing is
+copied, so a plan that does not fit is rejected before the first byte moves.
+- pinned sizes and hashes are compared with the bucket; an object that no
+longer matches its manifest entry is a problem, not a silent download.
+- manifests are saved as JSON (write_manifest / read_manifest); pin_manifest
+turns a pattern manifest into one entry per object with sizes and hashes.
+
+usage:
+    plan = plan_transfers(manifest, cache=LocalCache(), select=['ref', 'resources'])
+    plan.report()
+    plan.check_space()
+"""
+import collections
+import fnmatch
+import json
+import os
+import shutil
+
+from gatk.cache import LISTING_MAX_AGE
+from gatk.localize import is_up_to_date, list_objects
+from gatk.storage import default_store, has_wildcard, split_url, wildcard_prefix
+
+
+ManifestEntry = collections.namedtuple('ManifestEntry', ['object', 'destination', 'size', 'md5',
+                                                         'crc32c', 'optional', 'group'],
+                                       defaults=(None, None, None, False, None))
+
+# action: 'present' (valid local copy), 'link' (cache hit), 'download',
+# 'missing' (no object matched) or 'changed' (the bucket object differs from
+# the pinned entry, described by problem)
+PlanItem = collections.namedtuple('PlanItem', ['entry', 'info', 'path', 'action', 'problem'],
+                                  defaults=(None,))
+
+# left free after the downloads, for the tools' own outputs
+MIN_FREE_BYTES = 1 << 30
+
+
+class DiskSpaceError(Exception):
+    pass
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return [ManifestEntry(**entry) for entry in json.load(f)]
+
+
+def write_manifest(path, manifest):
+    with open(path, 'w') as f:
+        json.dump([entry._asdict() for entry in manifest], f, indent=1)
+
+
+def object_path(entry, url):
+    ''' local path of one object matched by a manifest entry
+    '''
+    if has_wildcard(entry.object):
+        prefix = wildcard_prefix(split_url(entry.object)[1]).rpartition('/')[0]
+        relative = split_url(url)[1][len(prefix):].lstrip('/')
+        return os.path.join(entry.destination, relative)
+    if entry.destination.endswith('/'):
+        return os.path.join(entry.destination, os.path.basename(url))
+    return entry.destination
+
+
+def _mismatch(entry, info):
+    ''' description of how a listed object differs from a pinned entry, or None
+    '''
+    for field in ('size', 'md5', 'crc32c'):
+        expected, actual = getattr(entry, field), getattr(info, field)
+        if expected is not None and actual is not None and expected != actual:
+            return '{} {} != manifest {}'.format(field, actual, expected)
+    return None
+
+
+def _selected(entry, select, optional):
+    if select is None:
+        return optional or not entry.optional
+    return any(entry.group == s or fnmatch.fnmatch(entry.object, s)
+               or fnmatch.fnmatch(entry.destination, s) for s in select)
+
+
+def _filesystem(path):
+    ''' (device, existing directory) of the filesystem path will be written on
+    '''
+    directory = os.path.abspath(os.path.dirname(path) or '.')
+    while not os.path.exists(directory):
+        directory = os.path.dirname(directory)
+    return os.stat(directory).st_dev, directory
+
+
+class TransferPlan(object):
+    ''' what gatk_init would do, file by file, before it does any of it
+    '''
+
+    def __init__(self, items, cache=None, min_free_bytes=MIN_FREE_BYTES):
+        self.items = items
+        self.cache = cache
+        self.min_free_bytes = min_free_bytes
+
+    def by_action(self, action):
+        return [item for item in self.items if item.action == action]
+
+    def transfers(self):
+        ''' (ObjectInfo, path) pairs to fetch, for gatk.localize.fetch_objects
+        '''
+        return [(item.info, item.path) for item in self.items if item.action in ('download', 'link')]
+
+    def bytes_to_download(self):
+        return sum(item.info.size or 0 for item in self.by_action('download'))
+
+    def space(self):
+        ''' [(directory, bytes needed, bytes free)] per filesystem receiving downloads;
+        with a cache the bytes land in the cache and are linked into place
+        '''
+        needed = collections.OrderedDict()
+        for item in self.by_action('download'):
+            target = (os.path.join(self.cache.root, 'objects', '') if self.cache is not None
+                      else item.path)
+            device, directory = _filesystem(target)
+            if device not in needed:
+                needed[device] = [directory, 0]
+            needed[device][1] += item.info.size or 0
+        return [(directory, n, shutil.disk_usage(directory).free)
+                for directory, n in needed.values()]
+
+    def problems(self):
+        ''' required objects that are missing or no longer match the manifest
+        '''
+        found = []
+        for item in self.items:
+            if item.action == 'missing' and not item.entry.optional:
+                found.append('{}: no objects matched'.format(item.entry.object))
+            elif item.action == 'changed':
+                found.append('{}: {}'.format(item.info.url, item.problem))
+        return found
+
+    def check_space(self):
+        ''' raise DiskSpaceError when the downloads would not leave min_free_bytes
+        '''
+        short = ['{}: needs {:.1f} GB plus {:.1f} GB headroom, {:.1f} GB free'.format(
+                     directory, needed / 1e9, self.min_free_bytes / 1e9, free / 1e9)
+                 for directory, needed, free in self.space()
+                 if needed + self.min_free_bytes > free]
+        if short:
+            raise DiskSpaceError('not enough disk space for this plan:\n' + '\n'.join(short))
+
+    def report(self, verbose=False):
+        ''' files and bytes per group and action, then disk space per filesystem
+        '''
+        totals = collections.OrderedDict()
+        for item in self.items:
+            key = (item.entry.group or '-', item.action)
+            n, size = totals.get(key, (0, 0))
+            totals[key] = (n + 1, size + ((item.info.size or 0) if item.info else 0))
+        for (group, action), (n, size) in totals.items():
+            print('{:20} {:10} {:6} files {:10.1f} MB'.format(group, action, n, size / 1e6))
+        for directory, needed, free in self.space():
+            print('{}: {:.1f} GB to download, {:.1f} GB free'.format(directory, needed / 1e9, free / 1e9))
+        if verbose:
+            for item in self.items:
+                print('{:10} {}'.format(item.action, item.path or item.entry.object))
+
+
+def plan_transfers(manifest, store=None, cache=None, select=None, optional=False,
+                   listing_max_age=LISTING_MAX_AGE, min_free_bytes=MIN_FREE_BYTES):
+    ''' resolve a manifest into a TransferPlan without copying anything
+
+    select = group names or fnmatch patterns of objects/destinations to keep
+    (default: every entry that is not optional); optional = also take the
+    optional entries when select is None.
+    '''
+    store = store or default_store()
+    items = []
+    for entry in manifest:
+        if not _selected(entry, select, optional):
+            continue
+        objects = list_objects(entry.object, store, cache, listing_max_age)
+        if not objects:
+            items.append(PlanItem(entry, None, None, 'missing'))
+        for info in objects:
+            path = object_path(entry, info.url)
+            problem = _mismatch(entry, info)
+            if problem:
+                action = 'changed'
+            elif is_up_to_date(info, path):
+                action = 'present'
+            elif cache is not None and cache.contains(info):
+                action = 'link'
+            else:
+                action = 'download'
+            items.append(PlanItem(entry, info, path, action, problem))
+    if cache is not None:
+        cache.flush()
+    return TransferPlan(items, cache, min_free_bytes)
+
+
+def pin_manifest(manifest, store=None, cache=None, listing_max_age=LISTING_MAX_AGE):
+    ''' one entry per object currently matched, with its size and hashes
+    '''
+    store = store or default_store()
+    pinned = []
+    for entry in manifest:
+        for info in list_objects(entry.object, store, cache, listing_max_age):
+            pinned.append(entry._replace(object=info.url, destination=object_path(entry, info.url),
+                                         size=info.size, md5=info.md5, crc32c=info.crc32c))
+    if cache is not None:
+        cache.flush()
+    return pinned
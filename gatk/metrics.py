@@ -0,0 +1,162 @@
+""" Picard/GATK metrics files as typed columns
+
+notes:
+- parses any Picard-style metrics file: '## htsjdk...' header blocks, the
+'## METRICS CLASS' table and an optional '## HISTOGRAM' table.
+- every column becomes one NumPy array: int64 when all values are integers,
+float64 when numeric with gaps ('' or '?' become NaN), str otherwise.
+- compare_metrics aligns two runs on a key column (SAMPLE_ALIAS by
+default) and subtracts every numeric metric at once.
+
+usage, instead of grep -v "##" | grep -v "#" | cut -f1,6,11,13,18:
+    ggvcf = read_metrics('trioGGVCF_metrics.variant_calling_detail_metrics')
+    cgp = read_metrics('trioCGP_metrics.variant_calling_detail_metrics')
+    deltas = compare_metrics(ggvcf, cgp)
+"""
+import numpy as np
+
+
+MISSING_VALUES = ('', '?')
+
+
+def typed_column(values):
+    ''' list of strings -> int64, float64 or str array
+    '''
+    arr = np.asarray(values, dtype=str)
+    missing = np.isin(arr, MISSING_VALUES)
+    if not missing.any():
+        try:
+            return arr.astype(np.int64)
+        except ValueError:
+            pass
+    try:
+        return np.where(missing, 'nan', arr).astype(np.float64)
+    except ValueError:
+        return arr
+
+
+def _table(lines):
+    ''' header row + rows -> {column: typed array}, keeping column order
+    '''
+    if not lines:
+        return {}
+    names = lines[0].split('\t')
+    rows = [line.split('\t') for line in lines[1:]]
+    # Picard drops trailing empty cells, pad them back
+    rows = [row + [''] * (len(names) - len(row)) for row in rows]
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    return dict((name, typed_column(list(col))) for name, col in zip(names, columns))
+
+
+class MetricsFile(object):
+    ''' headers: the '# ...' lines of the header blocks
+    metrics_class / metrics: the METRICS CLASS name and its columns
+    histogram_class / histogram: the HISTOGRAM key type and its columns
+    '''
+
+    def __init__(self, headers, metrics_class, metrics, histogram_class=None, histogram=None):
+        self.headers = headers
+        self.metrics_class = metrics_class
+        self.metrics = metrics
+        self.histogram_class = histogram_class
+        self.histogram = histogram or {}
+
+    def columns(self):
+        return list(self.metrics)
+
+    def __len__(self):
+        return len(next(iter(self.metrics.values()))) if self.metrics else 0
+
+    def select(self, *names):
+        ''' a subset of the metrics columns, by name
+        '''
+        return dict((name, self.metrics[name]) for name in names)
+
+    def to_frame(self, histogram=False):
+        ''' the metrics (or histogram) table as a pandas DataFrame
+        '''
+        import pandas as pd
+        return pd.DataFrame(self.histogram if histogram else self.metrics)
+
+
+def parse_metrics(lines):
+    ''' parse the lines of a metrics file into a MetricsFile
+    '''
+    headers = []
+    sections = {}
+    current = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('## METRICS CLASS') or line.startswith('## HISTOGRAM'):
+            kind, _, cls = line[3:].partition('\t')
+            current = 'metrics' if kind.startswith('METRICS') else 'histogram'
+            sections[current] = (cls, [])
+        elif line.startswith('##'):
+            current = None
+        elif line.startswith('#'):
+            headers.append(line[1:].strip())
+        elif not line.strip():
+            current = None
+        elif current is not None:
+            sections[current][1].append(line)
+    metrics_class, metrics_lines = sections.get('metrics', (None, []))
+    histogram_class, histogram_lines = sections.get('histogram', (None, []))
+    return MetricsFile(headers, metrics_class, _table(metrics_lines),
+                       histogram_class, _table(histogram_lines))
+
+
+def read_metrics(path):
+    with open(path) as f:
+        return parse_metrics(f)
+
+
+def load_metrics(paths, source='SOURCE'):
+    ''' stack the metrics tables of many files of the same class
+
+    Columns are concatenated per name; a source column records which file
+    every row came from. Columns missing from a file are filled with NaN.
+    '''
+    parsed = [(path, read_metrics(path)) for path in paths]
+    names = []
+    for _, m in parsed:
+        names.extend(n for n in m.metrics if n not in names)
+    columns = {source: np.concatenate([np.full(len(m), str(path)) for path, m in parsed])
+               if parsed else np.array([], dtype=str)}
+    for name in names:
+        parts = [m.metrics[name] if name in m.metrics else np.full(len(m), np.nan)
+                 for _, m in parsed]
+        try:
+            columns[name] = np.concatenate(parts)
+        except (TypeError, ValueError):
+            columns[name] = np.concatenate([p.astype(str) for p in parts])
+    return columns
+
+
+def numeric_columns(table):
+    return [name for name, values in table.items() if np.issubdtype(values.dtype, np.number)]
+
+
+def compare_metrics(before, after, key='SAMPLE_ALIAS'):
+    ''' per-key deltas (after - before) for every numeric metric both runs share
+
+    before/after are MetricsFile objects or {column: array} tables. Rows are
+    matched on key; keys present in only one run are left out. Returns a table
+    with the key column and one '<metric>' delta column per shared metric,
+    plus '<metric>_before' and '<metric>_after'.
+    '''
+    if isinstance(before, MetricsFile):
+        before = before.metrics
+    if isinstance(after, MetricsFile):
+        after = after.metrics
+    keys, i, j = np.intersect1d(before[key].astype(str), after[key].astype(str),
+                                assume_unique=False, return_indices=True)
+    result = {key: keys}
+    shared = [n for n in numeric_columns(before) if n in after and n != key
+              and np.issubdtype(after[n].dtype, np.number)]
+    for name in shared:
+        b = before[name][i].astype(np.float64)
+        a = after[name][j].astype(np.float64)
+        result[name] = a - b
+        result[name + '_before'] = b
+        result[name + '_after'] = a
+    return result
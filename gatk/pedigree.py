@@ -0,0 +1,253 @@
+""" pedigrees, trio genotypes and Mendelian violations as NumPy arrays
+
+notes:
+- read_ped parses PED files such as trio.ped (family, sample, father,
+mother, sex, phenotype; '0' for an unknown parent).
+- read_genotypes loads a callset into a samples x sites int8 matrix of
+genotype codes (the VCF genotype index, so 0/0=0, 0/1=1, 1/1=2, 0/2=3 ...;
+-1 for no-calls) plus GQ. Each batch of GT strings is decoded once per
+distinct string with np.unique, not once per sample and site.
+- Mendelian checks, transmission counts and callset comparisons are array
+operations over every site and trio at once. Haploid calls are treated as
+homozygous.
+
+usage, to see what CalculateGenotypePosteriors changed:
+    ped = read_ped('trio.ped')
+    ggvcf = read_genotypes('sandbox/trioGGVCF.vcf')
+    cgp = read_genotypes('sandbox/trioCGP.vcf')
+    table = compare_callsets(ggvcf, cgp, ped)
+    print_comparison(table)
+"""
+import collections
+
+import numpy as np
+
+from gatk.vcf import MISSING, VCFReader
+from gatk.vcf_columns import batches, format_field, int_column, site_columns, split_lines
+
+
+Individual = collections.namedtuple('Individual', ['family', 'sample', 'father', 'mother',
+                                                   'sex', 'phenotype'])
+
+DEFAULT_BATCH_SIZE = 100000
+NO_CALL = -1
+# genotype codes must fit int8: 15 alleles give 120 diploid genotypes
+MAX_ALLELES = 15
+
+_FIRST = np.array([j for k in range(MAX_ALLELES) for j in range(k + 1)], dtype=np.int8)
+_SECOND = np.array([k for k in range(MAX_ALLELES) for j in range(k + 1)], dtype=np.int8)
+# copies of non-reference alleles in each genotype
+_ALT_DOSE = (_FIRST > 0).astype(np.int8) + (_SECOND > 0).astype(np.int8)
+
+
+def read_ped(path):
+    ''' list of Individuals; unknown parents are None
+    '''
+    individuals = []
+    with open(path) as f:
+        for line in f:
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            family, sample, father, mother, sex, phenotype = (words + ['0'] * 6)[:6]
+            individuals.append(Individual(family, sample, None if father == '0' else father,
+                                          None if mother == '0' else mother, sex, phenotype))
+    return individuals
+
+
+def trios(pedigree, samples):
+    ''' (n, 3) array of (child, father, mother) indices into samples, for every
+    individual whose parents are both in samples
+    '''
+    index = dict((name, i) for i, name in enumerate(samples))
+    rows = [(index[p.sample], index[p.father], index[p.mother]) for p in pedigree
+            if p.sample in index and p.father in index and p.mother in index]
+    return np.array(rows, dtype=np.int64).reshape(-1, 3)
+
+
+def genotype_code(gt):
+    ''' '0/1' -> 1, '1|1' -> 2, '2' (haploid) -> 5, './.' -> -1
+    '''
+    alleles = gt.replace('|', '/').split('/')
+    if len(alleles) == 1:
+        alleles = alleles * 2
+    if len(alleles) != 2 or MISSING in alleles:
+        return NO_CALL
+    try:
+        j, k = sorted(int(a) for a in alleles)
+    except ValueError:
+        return NO_CALL
+    if k >= MAX_ALLELES:
+        return NO_CALL
+    return k * (k + 1) // 2 + j
+
+
+def decode_genotypes(gts):
+    ''' int8 codes for an array of GT strings, decoding each distinct string once
+    '''
+    gts = np.asarray(gts, dtype=str)
+    uniques, inverse = np.unique(gts, return_inverse=True)
+    lookup = np.array([genotype_code(g) for g in uniques], dtype=np.int8)
+    return lookup[inverse.reshape(gts.shape)]
+
+
+class Genotypes(object):
+    ''' codes[sample, site] genotype codes and gq[sample, site] (-1 when absent)
+    '''
+
+    def __init__(self, samples, contigs, contig, pos, n_alleles, codes, gq):
+        self.samples = list(samples)
+        self.contigs = list(contigs)
+        self.contig = contig
+        self.pos = pos
+        self.n_alleles = n_alleles
+        self.codes = codes
+        self.gq = gq
+
+    def __len__(self):
+        return len(self.pos)
+
+    def site_keys(self, contigs=None):
+        ''' one int64 per site from (contig, position), with contig numbers
+        taken from contigs (default: this callset's own order)
+        '''
+        contigs = self.contigs if contigs is None else contigs
+        order = np.array([contigs.index(c) for c in self.contigs] or [0], dtype=np.int64)
+        return (order[self.contig] << 32) | self.pos
+
+
+def read_genotypes(path, samples=None, batch_size=DEFAULT_BATCH_SIZE):
+    ''' Genotypes of the chosen samples (default: all) in a VCF
+    '''
+    contigs = []
+    contig_codes = {}
+    parts = {'contig': [], 'pos': [], 'n_alleles': [], 'codes': [], 'gq': []}
+    with VCFReader(path) as reader:
+        names = reader.header.samples
+        samples = list(samples) if samples is not None else names
+        columns = [names.index(s) for s in samples]
+        for batch in batches(reader.lines(), batch_size):
+            chrom, pos, alt, formats, fields = split_lines(batch, columns)
+            contig, n_alleles = site_columns(chrom, alt, contig_codes, contigs)
+            parts['contig'].append(contig)
+            parts['pos'].append(pos)
+            parts['n_alleles'].append(n_alleles)
+            parts['codes'].append(decode_genotypes(np.char.partition(fields, ':')[..., 0]).T)
+            parts['gq'].append(int_column(format_field(fields, formats, 'GQ'), np.int16).T)
+
+    def joined(name, dtype, axis=0):
+        if parts[name]:
+            return np.concatenate(parts[name], axis=axis)
+        return np.zeros((len(samples), 0) if axis else 0, dtype=dtype)
+
+    return Genotypes(samples, contigs, joined('contig', np.int32), joined('pos', np.int64),
+                     joined('n_alleles', np.int8), joined('codes', np.int8, 1),
+                     joined('gq', np.int16, 1))
+
+
+def _family(genotypes, pedigree):
+    family = trios(pedigree, genotypes.samples)
+    if len(family) == 0:
+        raise ValueError('no trio with all three samples in the callset')
+    codes = genotypes.codes
+    return family, codes[family[:, 0]], codes[family[:, 1]], codes[family[:, 2]]
+
+
+def mendelian_violations(genotypes, pedigree):
+    ''' (trios, sites) boolean array: the child's genotype cannot be made from
+    one allele of each parent. Sites where any of the three is a no-call are False.
+    '''
+    _, child, father, mother = _family(genotypes, pedigree)
+    called = (child >= 0) & (father >= 0) & (mother >= 0)
+    c, f, m = np.maximum(child, 0), np.maximum(father, 0), np.maximum(mother, 0)
+    c1, c2 = _FIRST[c], _SECOND[c]
+    f1, f2, m1, m2 = _FIRST[f], _SECOND[f], _FIRST[m], _SECOND[m]
+
+    def from_father(a):
+        return (a == f1) | (a == f2)
+
+    def from_mother(a):
+        return (a == m1) | (a == m2)
+
+    consistent = (from_father(c1) & from_mother(c2)) | (from_father(c2) & from_mother(c1))
+    return called & ~consistent
+
+
+def transmission_counts(genotypes, pedigree):
+    ''' per trio, how often a heterozygous parent passed on its alternate allele
+
+    Only biallelic, Mendelian-consistent sites count, and only when the
+    transmitted allele is unambiguous (the other parent is homozygous, or the
+    child is homozygous). Returns a {column: array} table.
+    '''
+    family, child, father, mother = _family(genotypes, pedigree)
+    usable = ((genotypes.n_alleles == 2)[None, :] & (child >= 0) & (father >= 0) & (mother >= 0)
+              & ~mendelian_violations(genotypes, pedigree))
+    dc = _ALT_DOSE[np.maximum(child, 0)]
+    df = _ALT_DOSE[np.maximum(father, 0)]
+    dm = _ALT_DOSE[np.maximum(mother, 0)]
+    table = {'CHILD': np.array([genotypes.samples[i] for i in family[:, 0]])}
+    for name, parent, other in (('FATHER', df, dm), ('MOTHER', dm, df)):
+        het = usable & (parent == 1)
+        known_other = het & (other != 1)
+        both_het_hom_child = het & (other == 1) & (dc != 1)
+        # the other parent gives other/2 alt copies when homozygous; a homozygous
+        # child got the same allele from both
+        passed = np.where(known_other, dc - other // 2, dc // 2)
+        counted = known_other | both_het_hom_child
+        table[name + '_TRANSMITTED'] = (counted & (passed == 1)).sum(axis=1)
+        table[name + '_UNTRANSMITTED'] = (counted & (passed == 0)).sum(axis=1)
+    return table
+
+
+def compare_callsets(before, after, pedigree=None):
+    ''' per-site changes between two callsets of the same samples, such as
+    trioGGVCF.vcf (before) and trioCGP.vcf (after)
+
+    Sites are matched on contig and position. Returns a {column: array} table
+    with CHROM, POS, CHANGED (samples whose genotype changed), GQ_DELTA_MIN
+    and GQ_DELTA_MAX (after - before over samples with GQ in both), and with a
+    pedigree VIOLATIONS_BEFORE / VIOLATIONS_AFTER (trios in violation).
+    INDEX_BEFORE / INDEX_AFTER give the matching site columns of each callset.
+    '''
+    samples = [s for s in before.samples if s in after.samples]
+    rows_before = [before.samples.index(s) for s in samples]
+    rows_after = [after.samples.index(s) for s in samples]
+    contigs = before.contigs + [c for c in after.contigs if c not in before.contigs]
+    _, i, j = np.intersect1d(before.site_keys(contigs), after.site_keys(contigs),
+                             return_indices=True)
+    order = np.argsort(i)
+    i, j = i[order], j[order]
+    gt_before = before.codes[rows_before][:, i]
+    gt_after = after.codes[rows_after][:, j]
+    gq_before = before.gq[rows_before][:, i].astype(np.int32)
+    gq_after = after.gq[rows_after][:, j].astype(np.int32)
+    both = (gq_before >= 0) & (gq_after >= 0)
+    delta = gq_after - gq_before
+    any_gq = both.any(axis=0)
+    delta_min = np.where(both, delta, np.iinfo(np.int32).max).min(axis=0, initial=np.iinfo(np.int32).max)
+    delta_max = np.where(both, delta, np.iinfo(np.int32).min).max(axis=0, initial=np.iinfo(np.int32).min)
+    table = {'CHROM': np.array(before.contigs + [''])[before.contig[i]],
+             'POS': before.pos[i],
+             'CHANGED': (gt_before != gt_after).sum(axis=0),
+             'GQ_DELTA_MIN': np.where(any_gq, delta_min, 0),
+             'GQ_DELTA_MAX': np.where(any_gq, delta_max, 0),
+             'INDEX_BEFORE': i,
+             'INDEX_AFTER': j}
+    if pedigree is not None:
+        table['VIOLATIONS_BEFORE'] = mendelian_violations(before, pedigree)[:, i].sum(axis=0)
+        table['VIOLATIONS_AFTER'] = mendelian_violations(after, pedigree)[:, j].sum(axis=0)
+    return table
+
+
+def print_comparison(table):
+    ''' counts of changed sites and, with a pedigree, fixed and new violations
+    '''
+    print('sites compared: {}'.format(len(table['POS'])))
+    print('sites with a changed genotype: {}'.format(int((table['CHANGED'] > 0).sum())))
+    print('sites where GQ dropped: {}'.format(int((table['GQ_DELTA_MIN'] < 0).sum())))
+    if 'VIOLATIONS_BEFORE' in table:
+        before, after = table['VIOLATIONS_BEFORE'], table['VIOLATIONS_AFTER']
+        print('Mendelian violations: {} before, {} after'.format(int(before.sum()), int(after.sum())))
+        print('sites fixed: {}, sites newly in violation: {}'.format(
+            int(((before > 0) & (after == 0)).sum()), int(((before == 0) & (after > 0)).sum())))
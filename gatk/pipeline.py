@@ -0,0 +1,213 @@
+""" declarative step graph for notebook workflows
+
+notes:
+- each Step names its input and output paths; a step depends on every step
+that produces one of its inputs. Steps with no path between them run
+concurrently, as long as their declared cpus/memory fit the budget.
+- a step is skipped when all its outputs exist, are newer than its local
+inputs, and its parameters match the last successful run (kept in a small
+JSON state file). Changing one step's parameters therefore reruns that step
+and, through the refreshed outputs, only the steps downstream of it.
+- gs:// and other remote inputs order the graph but are not timestamped.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+
+from gatk.runner import gatk_command, run_command
+
+
+class Step(object):
+    ''' action() does the work; it fails if it raises or returns an object with
+    a non-zero exit_status (such as a gatk.runner.ToolRun)
+    '''
+
+    def __init__(self, name, action, inputs=(), outputs=(), cpus=1, memory_gb=1,
+                 params=None, clean_outputs=False):
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cpus = cpus
+        self.memory_gb = memory_gb
+        self.params = params
+        # remove existing outputs first, for tools that refuse to overwrite
+        self.clean_outputs = clean_outputs
+
+    def signature(self):
+        return hashlib.sha1(json.dumps(self.params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def gatk_step(name, tool, inputs=(), outputs=(), cpus=1, memory_gb=4, clean_outputs=False, **options):
+    ''' a Step running one gatk tool; java heap follows memory_gb unless
+    java_options is given
+    '''
+    options.setdefault('java_options', '-Xmx{}g'.format(memory_gb))
+    argv = gatk_command(tool, **options)
+    return Step(name, lambda: run_command(argv, name=name, echo=False), inputs, outputs,
+                cpus, memory_gb, params=argv, clean_outputs=clean_outputs)
+
+
+def _is_local(path):
+    return '://' not in path
+
+
+def _mtime(path):
+    return os.stat(path).st_mtime if os.path.exists(path) else None
+
+
+class Pipeline(object):
+
+    def __init__(self, state_path=None):
+        self.steps = []
+        self.state_path = state_path
+        self.state = {}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def add(self, step):
+        if any(s.name == step.name for s in self.steps):
+            raise ValueError('duplicate step name: ' + step.name)
+        self.steps.append(step)
+        return step
+
+    def dependencies(self):
+        ''' {step name: set of step names it waits for}
+        '''
+        producers = {}
+        for step in self.steps:
+            for output in step.outputs:
+                producers[output] = step.name
+        deps = dict((step.name, set(producers[i] for i in step.inputs
+                                    if i in producers and producers[i] != step.name))
+                    for step in self.steps)
+        self._check_acyclic(deps)
+        return deps
+
+    def _check_acyclic(self, deps):
+        done, visiting = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError('cycle in pipeline at step ' + name)
+            visiting.add(name)
+            for dep in deps[name]:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in deps:
+            visit(name)
+
+    def outdated(self, step, rerun):
+        ''' why step has to run, or None when it is up to date
+        '''
+        if rerun:
+            return 'upstream ' + ', '.join(sorted(rerun)) + ' reran'
+        if step.params is not None and self.state.get(step.name) != step.signature():
+            return 'parameters changed'
+        output_times = [_mtime(o) for o in step.outputs]
+        if not output_times or None in output_times:
+            return 'missing outputs'
+        input_times = [_mtime(i) for i in step.inputs if _is_local(i)]
+        if None in input_times:
+            return 'missing inputs'
+        if input_times and max(input_times) > min(output_times):
+            return 'inputs newer than outputs'
+        return None
+
+    def _run_step(self, step):
+        if step.clean_outputs:
+            for output in step.outputs:
+                if os.path.isdir(output):
+                    shutil.rmtree(output)
+                elif os.path.exists(output):
+                    os.remove(output)
+        result = step.action()
+        if getattr(result, 'exit_status', 0) != 0:
+            raise RuntimeError('{} exited with status {}'.format(step.name, result.exit_status))
+        return result
+
+    def _save_state(self):
+        if self.state_path:
+            tmp = self.state_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.state, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.state_path)
+
+    def run(self, max_cpus=None, max_memory_gb=None, force=False, dry_run=False, verbose=True):
+        ''' run outdated steps, independent ones concurrently within the budget
+
+        Returns {step name: status}, status being 'up to date', 'ran',
+        'would run' (dry_run), 'failed' or 'blocked' (an upstream step failed).
+        A step bigger than the whole budget still runs, alone.
+        '''
+        max_cpus = max_cpus or os.cpu_count() or 1
+        max_memory_gb = max_memory_gb or float('inf')
+        deps = self.dependencies()
+        by_name = dict((s.name, s) for s in self.steps)
+        status = {}
+        pending = [s.name for s in self.steps]
+        running = {}
+        used_cpus, used_memory = 0, 0
+
+        def log(message):
+            if verbose:
+                print(message)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.steps) or 1) as pool:
+            while pending or running:
+                for name in list(pending):
+                    if any(status.get(d) in ('failed', 'blocked') for d in deps[name]):
+                        status[name] = 'blocked'
+                        pending.remove(name)
+                        log('{}: blocked by a failed upstream step'.format(name))
+                        continue
+                    if not all(d in status for d in deps[name]):
+                        continue
+                    step = by_name[name]
+                    rerun = set(d for d in deps[name] if status[d] in ('ran', 'would run'))
+                    reason = 'forced' if force else self.outdated(step, rerun)
+                    if reason is None:
+                        status[name] = 'up to date'
+                        pending.remove(name)
+                        log('{}: up to date'.format(name))
+                        continue
+                    if dry_run:
+                        status[name] = 'would run'
+                        pending.remove(name)
+                        log('{}: would run ({})'.format(name, reason))
+                        continue
+                    fits = (used_cpus + step.cpus <= max_cpus
+                            and used_memory + step.memory_gb <= max_memory_gb)
+                    if not fits and running:
+                        continue
+                    log('{}: running ({})'.format(name, reason))
+                    running[pool.submit(self._run_step, step)] = step
+                    used_cpus += step.cpus
+                    used_memory += step.memory_gb
+                    pending.remove(name)
+                if not running:
+                    continue
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    used_cpus -= step.cpus
+                    used_memory -= step.memory_gb
+                    try:
+                        future.result()
+                        status[step.name] = 'ran'
+                        if step.params is not None:
+                            self.state[step.name] = step.signature()
+                            self._save_state()
+                        log('{}: done'.format(step.name))
+                    except Exception as e:
+                        status[step.name] = 'failed'
+                        log('{}: FAILED - {}'.format(step.name, e))
+        return status
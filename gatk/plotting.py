@@ -0,0 +1,264 @@
+""" R-free annotation plots, mirroring the functions in Rcode.py
+
+notes:
+- same function names and arguments as the R versions so notebook cells
+can switch backends by changing the import:
+    makeDensityPlot(df, 'QD', split='set')
+    makeScatterPlot(df, 'QD', 'DP', split='set')
+    makeScatterPlotWithMarginalDensity(df, 'QD', 'FS', split='set')
+- dataframe can be a pandas DataFrame, a dict of arrays or a
+gatk.annotations.AnnotationTable.
+- densities are Gaussian KDEs computed on a binned grid with an FFT
+convolution (the same approach R's density() takes), so millions of
+variants cost about as much as a few thousand. Bandwidth defaults to R's
+bw.nrd0 and, as with ggplot's xlim, values outside the limits are dropped.
+- bins=N on the scatter functions aggregates the points into an N x N grid
+of counts (per split level) and, with marginals, draws the marginal
+densities from the same bins, so render cost depends on N only.
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.colors import LogNorm, to_rgb
+from matplotlib.gridspec import GridSpec
+
+
+GRID_POINTS = 512
+
+
+def _column(dataframe, name):
+    if hasattr(dataframe, 'labels') and name in getattr(dataframe, 'categories', {}):
+        return dataframe.labels(name)
+    return np.asarray(dataframe[name])
+
+
+def _groups(dataframe, split, n):
+    ''' [(label, boolean mask)] per split level, or one unlabeled group
+    '''
+    if split is None:
+        return [(None, np.ones(n, dtype=bool))]
+    values = _column(dataframe, split).astype(str)
+    return [(level, values == level) for level in np.unique(values)]
+
+
+def _limits(values, low, high):
+    finite = values[np.isfinite(values)]
+    if low is None:
+        low = finite.min() if len(finite) else 0.0
+    if high is None:
+        high = finite.max() if len(finite) else 1.0
+    return float(low), float(high)
+
+
+def _widened(low, high):
+    ''' limits with room for bins: equal limits (a constant annotation) are
+    widened by half a unit each way, as ggplot does
+    '''
+    if high == low:
+        return low - 0.5, high + 0.5
+    return low, high
+
+
+def bw_nrd0(values):
+    ''' Silverman's rule of thumb, as R's bw.nrd0
+    '''
+    n = len(values)
+    if n < 2:
+        return 1.0
+    sd = np.std(values, ddof=1)
+    q75, q25 = np.percentile(values, [75, 25])
+    spread = min(sd, (q75 - q25) / 1.34)
+    if spread <= 0:
+        spread = sd or abs(values[0]) or 1.0
+    return 0.9 * spread * n ** -0.2
+
+
+def linear_bin(values, low, high, n_grid):
+    ''' spread each value over its two neighbouring grid points
+    '''
+    position = (values - low) / (high - low) * (n_grid - 1)
+    left = np.floor(position).astype(np.int64)
+    frac = position - left
+    counts = np.bincount(left, weights=1 - frac, minlength=n_grid + 1)
+    counts += np.bincount(left + 1, weights=frac, minlength=n_grid + 1)
+    return counts[:n_grid]
+
+
+def density(values, low=None, high=None, n_grid=GRID_POINTS, bw=None):
+    ''' (grid, density) of a Gaussian KDE evaluated on n_grid points over [low, high]
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    low, high = _limits(values, low, high)
+    values = values[(values >= low) & (values <= high)]
+    grid = np.linspace(low, high, n_grid)
+    if len(values) == 0 or high <= low:
+        return grid, np.zeros(n_grid)
+    bw = bw_nrd0(values) if bw is None else bw
+    counts = linear_bin(values, low, high, n_grid)
+    delta = (high - low) / (n_grid - 1)
+    size = 1 << int(np.ceil(np.log2(2 * n_grid)))
+    offsets = np.arange(n_grid) * delta
+    kernel = np.zeros(size)
+    kernel[:n_grid] = np.exp(-0.5 * (offsets / bw) ** 2)
+    kernel[size - n_grid + 1:] = kernel[1:n_grid][::-1]
+    kernel /= bw * np.sqrt(2 * np.pi)
+    smoothed = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel), size)[:n_grid]
+    return grid, np.maximum(smoothed, 0) / len(values)
+
+
+def _draw_density(ax, dataframe, var, split, low, high, alpha, vertical=False):
+    values = _column(dataframe, var).astype(np.float64)
+    low, high = _limits(values, low, high)
+    for label, mask in _groups(dataframe, split, len(values)):
+        grid, dens = density(values[mask], low, high)
+        if vertical:
+            line = ax.plot(dens, grid, label=label)[0]
+            if split is not None:
+                ax.fill_betweenx(grid, dens, color=line.get_color(), alpha=alpha)
+        else:
+            line = ax.plot(grid, dens, label=label)[0]
+            if split is not None:
+                ax.fill_between(grid, dens, color=line.get_color(), alpha=alpha)
+    return low, high
+
+
+def makeDensityPlot(dataframe, xvar, split=None, xmin=None, xmax=None, alpha=0.5):
+    ''' density of one annotation, one filled curve per split level
+    '''
+    fig, ax = plt.subplots()
+    xmin, xmax = _draw_density(ax, dataframe, xvar, split, xmin, xmax, alpha)
+    ax.set_xlim(xmin, xmax)
+    ax.set_xlabel(xvar)
+    ax.set_ylabel('density')
+    if split is not None:
+        ax.legend(title=split)
+    return fig
+
+
+def _draw_scatter(ax, dataframe, xvar, yvar, split, ptSize, alpha):
+    x = _column(dataframe, xvar).astype(np.float64)
+    y = _column(dataframe, yvar).astype(np.float64)
+    for label, mask in _groups(dataframe, split, len(x)):
+        ax.scatter(x[mask], y[mask], s=ptSize * 4, alpha=alpha, label=label, linewidths=0)
+    return x, y
+
+
+def bin_annotations(x, y, group_codes, n_groups, xlim, ylim, bins):
+    ''' counts of shape (n_groups, bins, bins) indexed [group, x bin, y bin]
+
+    Values outside xlim/ylim or not finite are dropped, like ggplot's limits;
+    equal limits are widened first (see _widened).
+    '''
+    (xmin, xmax), (ymin, ymax) = _widened(*xlim), _widened(*ylim)
+    keep = np.isfinite(x) & np.isfinite(y) & (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+    xi = np.minimum(((x[keep] - xmin) / (xmax - xmin) * bins).astype(np.int64), bins - 1)
+    yi = np.minimum(((y[keep] - ymin) / (ymax - ymin) * bins).astype(np.int64), bins - 1)
+    cell = (group_codes[keep] * bins + xi) * bins + yi
+    return np.bincount(cell, minlength=n_groups * bins * bins).reshape(n_groups, bins, bins)
+
+
+def _draw_binned(ax, dataframe, xvar, yvar, split, xlim, ylim, bins):
+    ''' density-shaded cells; returns (labels, counts) for the marginals
+    '''
+    x = _column(dataframe, xvar).astype(np.float64)
+    y = _column(dataframe, yvar).astype(np.float64)
+    groups = _groups(dataframe, split, len(x))
+    codes = np.zeros(len(x), dtype=np.int64)
+    for i, (_, mask) in enumerate(groups):
+        codes[mask] = i
+    counts = bin_annotations(x, y, codes, len(groups), xlim, ylim, bins)
+    xedges = np.linspace(xlim[0], xlim[1], bins + 1)
+    yedges = np.linspace(ylim[0], ylim[1], bins + 1)
+    if split is None:
+        cells = np.ma.masked_equal(counts[0].T, 0)
+        mesh = ax.pcolormesh(xedges, yedges, cells, cmap='Greys', norm=LogNorm())
+        ax.figure.colorbar(mesh, ax=ax, label='count')
+    else:
+        colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        for i, (label, _) in enumerate(groups):
+            color = colors[i % len(colors)]
+            cells = counts[i].T.astype(np.float64)
+            shade = np.log1p(cells) / max(np.log1p(cells.max()), 1e-12)
+            rgba = np.zeros(cells.shape + (4,))
+            rgba[..., :3] = to_rgb(color)
+            rgba[..., 3] = np.where(cells > 0, 0.2 + 0.8 * shade, 0)
+            ax.imshow(rgba, origin='lower', extent=(xlim[0], xlim[1], ylim[0], ylim[1]),
+                      aspect='auto', interpolation='nearest')
+            ax.scatter([], [], color=color, s=4, label=label)
+    return [label for label, _ in groups], counts
+
+
+def _draw_binned_marginals(top, right, labels, counts, xlim, ylim, split, alpha):
+    bins = counts.shape[1]
+    xcenters = xlim[0] + (np.arange(bins) + 0.5) * (xlim[1] - xlim[0]) / bins
+    ycenters = ylim[0] + (np.arange(bins) + 0.5) * (ylim[1] - ylim[0]) / bins
+    n = np.maximum(counts.sum(axis=(1, 2)), 1)[:, None]
+    xdens = counts.sum(axis=2) / n / ((xlim[1] - xlim[0]) / bins)
+    ydens = counts.sum(axis=1) / n / ((ylim[1] - ylim[0]) / bins)
+    for i, label in enumerate(labels):
+        line = top.plot(xcenters, xdens[i], label=label)[0]
+        right.plot(ydens[i], ycenters, color=line.get_color())
+        if split is not None:
+            top.fill_between(xcenters, xdens[i], color=line.get_color(), alpha=alpha)
+            right.fill_betweenx(ycenters, ydens[i], color=line.get_color(), alpha=alpha)
+
+
+def makeScatterPlot(dataframe, xvar, yvar, split=None, xmin=None, xmax=None,
+                    ymin=None, ymax=None, ptSize=1, alpha=0.6, bins=None):
+    ''' scatter plot of two annotations, colored by split level
+    bins = aggregate into a bins x bins grid of counts instead of drawing points
+    '''
+    fig, ax = plt.subplots()
+    xlim = _limits(_column(dataframe, xvar).astype(np.float64), xmin, xmax)
+    ylim = _limits(_column(dataframe, yvar).astype(np.float64), ymin, ymax)
+    if bins:
+        xlim, ylim = _widened(*xlim), _widened(*ylim)
+        _draw_binned(ax, dataframe, xvar, yvar, split, xlim, ylim, bins)
+    else:
+        _draw_scatter(ax, dataframe, xvar, yvar, split, ptSize, alpha)
+    ax.set_xlim(*xlim)
+    ax.set_ylim(*ylim)
+    ax.set_xlabel(xvar)
+    ax.set_ylabel(yvar)
+    if split is not None:
+        ax.legend(title=split, markerscale=3)
+    return fig
+
+
+def makeScatterPlotWithMarginalDensity(dataframe, xvar, yvar, split=None, xmin=None, xmax=None,
+                                       ymin=None, ymax=None, ptSize=1, ptAlpha=0.6, fillAlpha=0.5,
+                                       bins=None):
+    ''' scatter plot with the density of each annotation along its axis
+    bins = draw a bins x bins grid of counts and take the marginals from the same bins
+    '''
+    fig = plt.figure(figsize=(8, 8))
+    grid = GridSpec(2, 2, figure=fig, width_ratios=(4, 1), height_ratios=(1, 4),
+                    wspace=0.05, hspace=0.05)
+    scatter = fig.add_subplot(grid[1, 0])
+    top = fig.add_subplot(grid[0, 0], sharex=scatter)
+    right = fig.add_subplot(grid[1, 1], sharey=scatter)
+    legend = fig.add_subplot(grid[0, 1])
+
+    if bins:
+        xmin, xmax = _widened(*_limits(_column(dataframe, xvar).astype(np.float64), xmin, xmax))
+        ymin, ymax = _widened(*_limits(_column(dataframe, yvar).astype(np.float64), ymin, ymax))
+        labels, counts = _draw_binned(scatter, dataframe, xvar, yvar, split,
+                                      (xmin, xmax), (ymin, ymax), bins)
+        _draw_binned_marginals(top, right, labels, counts, (xmin, xmax), (ymin, ymax),
+                               split, fillAlpha)
+    else:
+        _draw_scatter(scatter, dataframe, xvar, yvar, split, ptSize, ptAlpha)
+        xmin, xmax = _draw_density(top, dataframe, xvar, split, xmin, xmax, fillAlpha)
+        ymin, ymax = _draw_density(right, dataframe, yvar, split, ymin, ymax, fillAlpha,
+                                   vertical=True)
+    scatter.set_xlim(xmin, xmax)
+    scatter.set_ylim(ymin, ymax)
+    scatter.set_xlabel(xvar)
+    scatter.set_ylabel(yvar)
+    for ax in (top, right):
+        ax.axis('off')
+    legend.axis('off')
+    if split is not None:
+        handles, labels = scatter.get_legend_handles_labels()
+        legend.legend(handles, labels, title=split, loc='center', markerscale=3)
+    return fig
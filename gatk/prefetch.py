@@ -0,0 +1,161 @@
+""" background localization, in workflow order, with on-demand waits
+
+notes:
+- Prefetch fetches (ObjectInfo, path) pairs with a fixed set of worker
+threads, in the order given (gatk_init passes manifest order, which follows
+the notebook's steps). The caller gets the handle back at once.
+- wait_for(path) blocks only until that file, or every file under that
+directory, has arrived. Files asked for that are still queued jump to the
+front of the queue, so the step being run is never stuck behind a BAM it
+does not read.
+- a file that fails is reported by wait_for raising IOError; the other files
+keep coming. results() and summary() describe everything fetched so far.
+
+usage:
+    data = gatk_init('germline', background=True)
+    ped = data.wait_for('/home/jupyter-user/2-germline-vd/trio.ped')
+    ...
+    data.wait()
+"""
+import collections
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from gatk.localize import DEFAULT_MAX_WORKERS, DEFAULT_RETRIES, fetch_object, summarize
+from gatk.storage import default_store
+
+# priority of files someone is waiting for; queued files count up from 0
+URGENT = -1
+
+
+class Prefetch(object):
+
+    def __init__(self, transfers, max_workers=DEFAULT_MAX_WORKERS, store=None, cache=None,
+                 retries=DEFAULT_RETRIES, verbose=False, results=()):
+        ''' transfers = (ObjectInfo, path) pairs in the order they should arrive
+        results = TransferResults known up front (files already present, missing ...)
+        '''
+        self.store = store or default_store()
+        self.cache = cache
+        self.retries = retries
+        self.verbose = verbose
+        self._done = collections.OrderedDict((os.path.abspath(r.path or r.url), r) for r in results)
+        # files not done yet, and those of them a worker has started on
+        self._pending = {}
+        self._started = set()
+        self._queue = []
+        self._counter = itertools.count()
+        self._arrived = threading.Condition()
+        self._cancelled = False
+        for priority, (info, path) in enumerate(transfers):
+            key = os.path.abspath(path)
+            self._pending[key] = info
+            heapq.heappush(self._queue, (priority, next(self._counter), key))
+        self._workers = [threading.Thread(target=self._work, name='prefetch-{}'.format(i), daemon=True)
+                         for i in range(min(max_workers, len(self._pending)))]
+        for worker in self._workers:
+            worker.start()
+
+    def _next(self):
+        ''' (key, ObjectInfo) of the most urgent file nobody has started, or None
+        '''
+        with self._arrived:
+            while self._queue and not self._cancelled:
+                _, _, key = heapq.heappop(self._queue)
+                if key in self._pending and key not in self._started:
+                    self._started.add(key)
+                    return key, self._pending[key]
+            return None
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                if self.cache is not None:
+                    # saves once; later workers find nothing left to save
+                    self.cache.flush()
+                return
+            key, info = task
+            result = fetch_object(info, key, self.store, self.cache, self.retries)
+            if self.verbose:
+                print('{} {} -> {} ({} bytes, {:.1f}s)'.format(result.status, result.url, result.path,
+                                                               result.bytes, result.seconds))
+            with self._arrived:
+                del self._pending[key]
+                self._started.discard(key)
+                self._done[key] = result
+                self._arrived.notify_all()
+
+    def _wanted(self, path):
+        ''' files of this prefetch at path or below it
+        '''
+        key = os.path.abspath(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        return [k for k in itertools.chain(self._done, self._pending)
+                if k == key or k.startswith(prefix)]
+
+    def wait_for(self, path, timeout=None):
+        ''' block until path (a file, or a directory of files) is local and
+        return it; raises IOError when it failed, was cancelled or is not part
+        of this prefetch
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._arrived:
+            wanted = self._wanted(path)
+            if not wanted:
+                raise IOError('{} is not being localized'.format(path))
+            for key in wanted:
+                if key in self._pending and key not in self._started:
+                    heapq.heappush(self._queue, (URGENT, next(self._counter), key))
+            while not all(key in self._done for key in wanted):
+                if self._cancelled and any(key in self._pending and key not in self._started
+                                           for key in wanted):
+                    raise IOError('localization was cancelled before {} arrived'.format(path))
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise IOError('timed out waiting for {}'.format(path))
+                self._arrived.wait(remaining)
+            failed = [self._done[key] for key in wanted
+                      if self._done[key].status in ('failed', 'missing')]
+        if failed:
+            raise IOError('; '.join('{}: {}'.format(r.url, r.error) for r in failed))
+        return path
+
+    def done(self):
+        with self._arrived:
+            return not self._pending
+
+    def progress(self):
+        ''' (files done, files in total, bytes done)
+        '''
+        with self._arrived:
+            return (len(self._done), len(self._done) + len(self._pending),
+                    sum(r.bytes for r in self._done.values()))
+
+    def results(self):
+        ''' TransferResults of the files done so far
+        '''
+        with self._arrived:
+            return list(self._done.values())
+
+    def summary(self):
+        return summarize(self.results())
+
+    def wait(self, timeout=None):
+        ''' block until every file is done (or the prefetch was cancelled) and
+        return the results; timeout bounds the whole wait, not each worker's
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0, deadline - time.time()))
+        return self.results()
+
+    def cancel(self):
+        ''' stop starting new downloads; those already running finish
+        '''
+        with self._arrived:
+            self._cancelled = True
+            self._arrived.notify_all()
@@ -0,0 +1,198 @@
+""" run GATK tools from Python with live logs, progress and resource accounting
+
+notes:
+- arguments are built as a list and run without a shell, so paths and
+intervals such as 20:10,000,000-10,200,000 need no quoting.
+- GATK logs to stderr; every line is echoed as it arrives and ProgressMeter
+lines are parsed into ProgressEvents (locus, elapsed time, items processed,
+items per second).
+- wall time, CPU time (user + sys) and peak RSS come from wait4(), which on
+Linux includes the java process the gatk wrapper starts.
+- a tool runs in its own process group. When the run is interrupted (an
+interrupted notebook cell, an on_progress callback raising) the whole group,
+java included, gets SIGTERM and then SIGKILL, and is reaped before the
+exception goes on.
+- every run is appended to run_history so the cost of each notebook step can
+be compared afterwards with print_history().
+
+usage, for the first HaplotypeCaller cell of the germline notebook:
+    run_gatk('HaplotypeCaller', R=ref, I=bam, O='sandbox/motherHC.vcf',
+             L='20:10,000,000-10,200,000')
+"""
+import collections
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+
+ProgressEvent = collections.namedtuple('ProgressEvent', ['locus', 'elapsed_seconds', 'processed',
+                                                         'per_second', 'unit'])
+ToolRun = collections.namedtuple('ToolRun', ['name', 'argv', 'exit_status', 'wall_seconds',
+                                             'cpu_seconds', 'peak_rss_bytes', 'progress'])
+
+GATK = 'gatk'
+
+_PROGRESS_HEADER = re.compile(r'ProgressMeter -\s+Current Locus\s+Elapsed Minutes\s+(\w+) Processed')
+_PROGRESS_LINE = re.compile(r'ProgressMeter -\s+(\S+)\s+([\d.]+)\s+(\d+)\s+([\d.]+)\s*$')
+_PROGRESS_DONE = re.compile(r'ProgressMeter - Traversal complete\. Processed (\d+) total (\w+) in ([\d.]+) minutes')
+
+# GATK short names longer than three characters
+SHORT_OPTIONS = ('bamout', 'stand_call_conf')
+
+run_history = []
+
+# seconds an interrupted tool gets to exit after SIGTERM before SIGKILL
+TERMINATE_TIMEOUT = 10
+
+
+def option_flag(name):
+    ''' R -> -R, ERC -> -ERC, bamout -> -bamout, DBSNP -> --DBSNP,
+    genomicsdb_workspace_path -> --genomicsdb-workspace-path
+    '''
+    if len(name) <= 3 or name in SHORT_OPTIONS:
+        return '-' + name.replace('_', '-')
+    return '--' + name.replace('_', '-')
+
+
+def gatk_command(tool, *args, **options):
+    ''' argument list for a gatk invocation
+
+    Keyword options become flags (see option_flag); list values repeat the
+    flag (V=[a, b] -> -V a -V b), True adds a bare flag and None/False are
+    dropped. java_options is passed to the wrapper as --java-options.
+    '''
+    java_options = options.pop('java_options', None)
+    argv = [GATK]
+    if java_options:
+        argv += ['--java-options', java_options]
+    argv.append(tool)
+    argv += [str(a) for a in args]
+    for name, value in options.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for v in values:
+            if v is None or v is False:
+                continue
+            argv.append(option_flag(name))
+            if v is not True:
+                argv.append(str(v))
+    return argv
+
+
+class ProgressParser(object):
+    ''' turns GATK ProgressMeter log lines into ProgressEvents
+    '''
+
+    def __init__(self):
+        self.unit = 'records'
+
+    def parse(self, line):
+        header = _PROGRESS_HEADER.search(line)
+        if header:
+            self.unit = header.group(1).lower()
+            return None
+        done = _PROGRESS_DONE.search(line)
+        if done:
+            processed, unit, minutes = int(done.group(1)), done.group(2), float(done.group(3))
+            seconds = minutes * 60
+            return ProgressEvent('complete', seconds, processed,
+                                 processed / seconds if seconds else 0.0, unit)
+        match = _PROGRESS_LINE.search(line)
+        if match:
+            locus, minutes, processed, per_minute = match.groups()
+            return ProgressEvent(locus, float(minutes) * 60, int(processed),
+                                 float(per_minute) / 60, self.unit)
+        return None
+
+
+def _stop(proc):
+    ''' terminate proc's process group, killing it if it outlives TERMINATE_TIMEOUT, and reap proc
+    '''
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(TERMINATE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        proc.wait()
+
+
+def run_command(argv, name=None, echo=True, on_progress=None, log_path=None):
+    ''' run argv, streaming its output, and return a ToolRun
+
+    on_progress(event) is called for every parsed ProgressMeter line.
+    log_path keeps a copy of the full output.
+    '''
+    name = name or os.path.basename(argv[0])
+    parser = ProgressParser()
+    progress = []
+    log = None
+    start = time.monotonic()
+    proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True, bufsize=1, start_new_session=True)
+    try:
+        if log_path:
+            log = open(log_path, 'w')
+        for line in proc.stdout:
+            if echo:
+                sys.stdout.write(line)
+            if log:
+                log.write(line)
+            event = parser.parse(line)
+            if event is not None:
+                progress.append(event)
+                if on_progress:
+                    on_progress(event)
+    except BaseException:
+        _stop(proc)
+        raise
+    finally:
+        proc.stdout.close()
+        if log:
+            log.close()
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.monotonic() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    run = ToolRun(name, argv, proc.returncode, wall, usage.ru_utime + usage.ru_stime,
+                  usage.ru_maxrss * 1024, progress)
+    run_history.append(run)
+    return run
+
+
+def run_gatk(tool, *args, **options):
+    ''' build a gatk command (see gatk_command) and run it (see run_command)
+
+    echo, on_progress, log_path and check are taken from options; with
+    check=True a non-zero exit raises CalledProcessError.
+    '''
+    echo = options.pop('echo', True)
+    on_progress = options.pop('on_progress', None)
+    log_path = options.pop('log_path', None)
+    check = options.pop('check', False)
+    argv = gatk_command(tool, *args, **options)
+    run = run_command(argv, name=tool, echo=echo, on_progress=on_progress, log_path=log_path)
+    if echo:
+        print(format_run(run))
+    if check and run.exit_status != 0:
+        raise subprocess.CalledProcessError(run.exit_status, argv)
+    return run
+
+
+def format_run(run):
+    rate = ''
+    if run.progress:
+        last = run.progress[-1]
+        rate = ', {:.1f} {}/s'.format(last.per_second, last.unit)
+    return '{}: exit {}, {:.1f}s wall, {:.1f}s cpu, {:.0f} MB peak RSS{}'.format(
+        run.name, run.exit_status, run.wall_seconds, run.cpu_seconds,
+        run.peak_rss_bytes / 2**20, rate)
+
+
+def print_history(runs=None):
+    ''' one line per recorded run, in the order they ran
+    '''
+    for run in (run_history if runs is None else runs):
+        print(format_run(run))
@@ -0,0 +1,142 @@
+""" interval scatter-gather for HaplotypeCaller, GenotypeGVCFs and friends
+
+notes:
+- the -L interval is split into N near-equal shards and the tool runs once
+per shard, up to `parallelism` at a time. Every shard is its own gatk/java
+process; the pool threads only start them and wait, so a thread pool is
+enough to keep N cores busy.
+- every running shard is a JVM with its own heap, so parallelism defaults to
+no more shards than there are CPUs or than memory_gb (by default
+MEMORY_FRACTION of the machine) holds at MIN_SHARD_MEMORY_GB each, and memory_gb
+is divided between them as -Xmx unless java_options is given.
+- options naming a per-run output besides O (SHARD_OUTPUT_OPTIONS, such as
+bamout) get one file per shard: bamout='sandbox/mother.bam' writes
+sandbox/mother.shard-000.bam, sandbox/mother.shard-001.bam, ...
+- shard outputs are gathered in coordinate order into a single VCF/GVCF
+(bgzipped when the output ends in .gz). A record is kept only by the shard
+whose interval holds its start, so nothing is duplicated at shard edges;
+GVCF reference blocks may be split at the shard boundaries, as in GATK's own
+scattered workflows.
+- the gathered output is indexed with IndexFeatureFile (.tbi when bgzipped,
+.idx otherwise), as the tool itself would have done for an unscattered run.
+
+usage, replacing the HaplotypeCaller cell of the germline notebook:
+    scatter_gather('HaplotypeCaller', 'sandbox/mother.g.vcf', '20:10,000,000-10,200,000',
+                   shards=4, R=ref, I=bam, ERC='GVCF')
+"""
+import concurrent.futures
+import os
+import shutil
+
+from gatk.bgzf import BgzfWriter
+from gatk.intervals import parse_region, split_region
+from gatk.runner import format_run, run_gatk
+from gatk.vcf import VCFReader
+
+
+# options of per-run outputs other than O; each shard writes its own copy
+SHARD_OUTPUT_OPTIONS = ('bamout', 'graph_output', 'assembly_region_out', 'activity_profile_out')
+# heap every shard's JVM gets at least, and the share of physical memory the
+# shards' heaps may take together
+MIN_SHARD_MEMORY_GB = 2
+MEMORY_FRACTION = 0.75
+
+
+def total_memory_gb():
+    ''' physical memory of the machine in GB, None where sysconf cannot tell
+    '''
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2**30
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def shard_path(path, i):
+    ''' sandbox/mother.bam -> sandbox/mother.shard-002.bam for shard 2
+    '''
+    directory, name = os.path.split(path)
+    stem, dot, extension = name.partition('.')
+    return os.path.join(directory, '{}.shard-{:03d}{}{}'.format(stem, i, dot, extension))
+
+
+def _open_output(path):
+    if path.endswith('.gz'):
+        return BgzfWriter(path)
+    return open(path, 'wb')
+
+
+def gather_vcfs(inputs, regions, output):
+    ''' concatenate shard VCFs (in the order given) into output
+
+    The header comes from the first shard. Records are kept only when their
+    start lies inside that shard's region.
+    '''
+    with _open_output(output) as out:
+        for i, (path, region) in enumerate(zip(inputs, regions)):
+            _, start, end = parse_region(region)
+            with VCFReader(path) as reader:
+                if i == 0:
+                    out.write(str(reader.header).encode())
+                for line in reader.lines():
+                    if line.startswith('#'):
+                        continue
+                    pos = int(line.split('\t', 2)[1])
+                    if pos >= start and (end is None or pos <= end):
+                        out.write(line.encode())
+
+
+def scatter_gather(tool, output, interval, shards=4, parallelism=None, memory_gb=None, workdir=None,
+                   contig_length=None, keep_shards=False, index=True, **options):
+    ''' run tool on `shards` pieces of interval and gather them into output
+
+    options are the other tool arguments, as for gatk.runner.run_gatk; L and
+    O are set per shard, and SHARD_OUTPUT_OPTIONS are renamed per shard (see
+    shard_path). memory_gb is the heap shared by the shards running at once;
+    parallelism defaults to as many shards as fit both the CPUs and memory_gb.
+    index = write the gathered output's index with IndexFeatureFile.
+    Raises ValueError when options hold L or O, which interval and output set.
+    Returns the ToolRun of every shard; raises RuntimeError if any failed.
+    '''
+    for key in ('L', 'O'):
+        if key in options:
+            raise ValueError('{}= is set per shard; pass the interval and output arguments '
+                             'of scatter_gather instead'.format(key))
+    regions = split_region(interval, shards, contig_length)
+    memory_gb = memory_gb or (total_memory_gb() or MIN_SHARD_MEMORY_GB) * MEMORY_FRACTION
+    if parallelism is None:
+        parallelism = min(len(regions), os.cpu_count() or 1,
+                          max(1, int(memory_gb // MIN_SHARD_MEMORY_GB)))
+    options.setdefault('java_options', '-Xmx{}m'.format(int(memory_gb * 1024 / parallelism)))
+    workdir = workdir or os.path.join(os.path.dirname(os.path.abspath(output)),
+                                      '.' + os.path.basename(output) + '.shards')
+    os.makedirs(workdir, exist_ok=True)
+    name = os.path.basename(output)
+    shard_outputs = [os.path.join(workdir, 'shard-{:03d}-{}'.format(i, name))
+                     for i in range(len(regions))]
+
+    def run_shard(i):
+        shard_options = dict(options)
+        for key in SHARD_OUTPUT_OPTIONS:
+            if shard_options.get(key):
+                shard_options[key] = shard_path(shard_options[key], i)
+        run = run_gatk(tool, L=regions[i], O=shard_outputs[i], echo=False, **shard_options)
+        print('shard {} ({}): {}'.format(i, regions[i], format_run(run)))
+        return run
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as pool:
+        runs = list(pool.map(run_shard, range(len(regions))))
+
+    failed = [regions[i] for i, run in enumerate(runs) if run.exit_status != 0]
+    if failed:
+        raise RuntimeError('{} failed on shards {}; outputs left in {}'.format(
+            tool, ', '.join(failed), workdir))
+
+    gather_vcfs(shard_outputs, regions, output)
+    if index:
+        run = run_gatk('IndexFeatureFile', I=output, echo=False)
+        print('index: ' + format_run(run))
+        if run.exit_status != 0:
+            raise RuntimeError('IndexFeatureFile failed on ' + output)
+    if not keep_shards:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return runs
@@ -0,0 +1,411 @@
+""" object store access for the notebook helpers
+
+notes:
+- the google-cloud-storage client is imported lazily so the rest of the
+package still imports on machines where it is not installed.
+- URL patterns follow gsutil wildcard rules: '*' and '?' stay inside one
+"directory" level, '**' crosses levels.
+- LocalStore serves the same calls from a local directory, for benchmarks
+and offline work; objects live at <root>/<bucket>/<name>. HTTPStore reads
+single objects over plain HTTP(S).
+- read_range(url, start, end) yields bytes start..end-1 of an object, for
+downloads split into slices fetched concurrently (gatk.localize). GCSStore
+also has download_range, which streams a slice into a file object (an
+OffsetWriter at the slice's offset) instead of holding it in memory.
+- listings are fetched page by page and kept by a ListingCache for
+LISTING_TTL seconds; a cached 'prefix/**' listing also answers any narrower
+pattern under that prefix, so one request covers a whole tutorial folder.
+"""
+import collections
+import datetime
+import email.utils
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from gatk.checksum import HashingWriter, file_digests
+
+ObjectInfo = collections.namedtuple('ObjectInfo', ['url', 'size', 'generation',
+                                                   'md5', 'crc32c', 'updated'])
+
+WILDCARD_CHARS = '*?['
+PAGE_SIZE = 1000
+LISTING_TTL = 300
+RANGE_CHUNK = 1 << 20
+
+
+def split_url(url):
+    ''' 'gs://bucket/some/object' -> ('bucket', 'some/object')
+    '''
+    if not url.startswith('gs://'):
+        raise ValueError('not a gs:// URL: ' + url)
+    bucket, _, name = url[len('gs://'):].partition('/')
+    return bucket, name
+
+
+def has_wildcard(url):
+    return any(c in url for c in WILDCARD_CHARS)
+
+
+def glob_to_regex(pattern):
+    ''' translate a gsutil-style wildcard into a compiled regular expression
+    '''
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body + ']')
+                i = j + 1
+                continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(out) + r'\Z')
+
+
+def wildcard_prefix(name):
+    ''' the literal part of an object name in front of its first wildcard
+    '''
+    for i, c in enumerate(name):
+        if c in WILDCARD_CHARS:
+            return name[:i]
+    return name
+
+
+class OffsetWriter(object):
+    ''' file-like object writing at consecutive offsets of a file descriptor
+    with os.pwrite, so several slices can be written into one file at once
+    '''
+
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(self.fd, view, self.offset)
+            self.offset += n
+            view = view[n:]
+        return len(data)
+
+
+class GCSStore(object):
+    ''' thin wrapper around google-cloud-storage, one client per thread
+    '''
+
+    def __init__(self, project=None):
+        self.project = project
+        self._local = threading.local()
+
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            from google.cloud import storage
+            client = storage.Client(project=self.project)
+            self._local.client = client
+        return client
+
+    def _info(self, bucket, blob):
+        updated = blob.updated.isoformat() if blob.updated else None
+        return ObjectInfo('gs://' + bucket + '/' + blob.name, blob.size, blob.generation,
+                          blob.md5_hash, blob.crc32c, updated)
+
+    def list(self, pattern, page_size=PAGE_SIZE):
+        ''' return ObjectInfo records for every object matching a URL pattern,
+        following the listing across pages of page_size objects
+        '''
+        bucket, name = split_url(pattern)
+        if not has_wildcard(name):
+            blob = self.client().bucket(bucket).get_blob(name)
+            return [self._info(bucket, blob)] if blob is not None else []
+        regex = glob_to_regex(name)
+        blobs = self.client().list_blobs(bucket, prefix=wildcard_prefix(name), page_size=page_size)
+        objects = []
+        for page in blobs.pages:
+            objects.extend(self._info(bucket, b) for b in page if regex.match(b.name))
+        return objects
+
+    def download(self, url, path, checksums=()):
+        ''' write the object to path, hashing it on the way; returns
+        {algorithm: base64 digest} for the requested checksums
+        '''
+        bucket, name = split_url(url)
+        blob = self.client().bucket(bucket).blob(name)
+        with open(path, 'wb') as f:
+            writer = HashingWriter(f, checksums)
+            # the digests are checked by the caller, so the client need not hash too
+            blob.download_to_file(writer, checksum=None)
+        return writer.digests()
+
+    def read_range(self, url, start, end, generation=None):
+        ''' bytes start..end-1 of an object, as an iterable of chunks; pass the
+        generation listed so every slice of one download reads the same object
+        '''
+        bucket, name = split_url(url)
+        blob = self.client().bucket(bucket).blob(name, generation=generation)
+        # the client's end is inclusive
+        yield blob.download_as_bytes(start=start, end=end - 1, checksum=None)
+
+    def download_range(self, url, start, end, f, generation=None):
+        ''' write bytes start..end-1 of an object to the file object f as they arrive
+        '''
+        bucket, name = split_url(url)
+        blob = self.client().bucket(bucket).blob(name, generation=generation)
+        blob.download_to_file(f, start=start, end=end - 1, checksum=None)
+
+    def upload(self, path, url):
+        bucket, name = split_url(url)
+        self.client().bucket(bucket).blob(name).upload_from_filename(path)
+
+    def delete(self, url):
+        bucket, name = split_url(url)
+        self.client().bucket(bucket).blob(name).delete()
+
+
+class LocalStore(object):
+    ''' a bucket stand-in backed by a directory
+
+    Checksums are computed when an object is written (or first listed) and
+    kept in <root>/.meta, so listings report md5/crc32c like GCS does.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, url):
+        bucket, name = split_url(url)
+        return os.path.join(self.root, bucket, name)
+
+    def _meta_path(self, url):
+        bucket, name = split_url(url)
+        return os.path.join(self.root, '.meta', bucket, name + '.json')
+
+    def _info(self, url, path, digests=None):
+        st = os.stat(path)
+        meta_path = self._meta_path(url)
+        meta = None
+        if digests is None:
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (IOError, ValueError):
+                pass
+        if meta is None or meta['size'] != st.st_size or meta['mtime_ns'] != st.st_mtime_ns:
+            digests = digests or file_digests(path, ('md5', 'crc32c'))
+            meta = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                    'md5': digests['md5'], 'crc32c': digests['crc32c']}
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        updated = datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc).isoformat()
+        return ObjectInfo(url, st.st_size, st.st_mtime_ns, meta['md5'], meta['crc32c'], updated)
+
+    def list(self, pattern):
+        bucket, name = split_url(pattern)
+        if not has_wildcard(name):
+            path = self._path(pattern)
+            return [self._info(pattern, path)] if os.path.isfile(path) else []
+        regex = glob_to_regex(name)
+        prefix = wildcard_prefix(name)
+        top = os.path.join(self.root, bucket, os.path.dirname(prefix))
+        objects = []
+        for root, dirs, files in os.walk(top):
+            dirs.sort()
+            for f in sorted(files):
+                path = os.path.join(root, f)
+                rel = os.path.relpath(path, os.path.join(self.root, bucket)).replace(os.sep, '/')
+                if rel.startswith(prefix) and regex.match(rel):
+                    objects.append(self._info('gs://' + bucket + '/' + rel, path))
+        return objects
+
+    def write(self, url, chunks):
+        ''' create an object from an iterable of bytes; returns its ObjectInfo
+        '''
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            writer = HashingWriter(f, ('md5', 'crc32c'))
+            for chunk in chunks:
+                writer.write(chunk)
+        return self._info(url, path, writer.digests())
+
+    def download(self, url, path, checksums=()):
+        with open(self._path(url), 'rb') as src, open(path, 'wb') as dst:
+            writer = HashingWriter(dst, checksums)
+            shutil.copyfileobj(src, writer, 1 << 20)
+        return writer.digests()
+
+    def read_range(self, url, start, end, generation=None):
+        with open(self._path(url), 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(remaining, RANGE_CHUNK))
+                if not chunk:
+                    raise IOError('{} ends before byte {}'.format(url, end))
+                remaining -= len(chunk)
+                yield chunk
+
+    def upload(self, path, url):
+        with open(path, 'rb') as f:
+            self.write(url, iter(lambda: f.read(1 << 20), b''))
+
+    def delete(self, url):
+        os.remove(self._path(url))
+        try:
+            os.remove(self._meta_path(url))
+        except OSError:
+            pass
+
+
+class HTTPStore(object):
+    ''' objects read over HTTP(S) from <base_url>/<bucket>/<name>: public
+    buckets through storage.googleapis.com, or any server that honours Range
+    requests, such as a local test server. Only single objects can be listed;
+    md5/crc32c come from the x-goog-hash header when the server sends one.
+    '''
+
+    def __init__(self, base_url='https://storage.googleapis.com', timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _http_url(self, url):
+        bucket, name = split_url(url)
+        return '{}/{}/{}'.format(self.base_url, bucket, urllib.parse.quote(name))
+
+    def _open(self, url, method='GET', headers=None):
+        request = urllib.request.Request(self._http_url(url), method=method, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _info(self, url, headers):
+        hashes = {}
+        for header in headers.get_all('x-goog-hash') or []:
+            for item in header.split(','):
+                algorithm, _, value = item.strip().partition('=')
+                hashes[algorithm] = value
+        modified = headers.get('Last-Modified')
+        updated = email.utils.parsedate_to_datetime(modified).isoformat() if modified else None
+        size = headers.get('Content-Length')
+        generation = headers.get('x-goog-generation')
+        return ObjectInfo(url, int(size) if size is not None else None,
+                          int(generation) if generation else None, hashes.get('md5'),
+                          hashes.get('crc32c'), updated)
+
+    def list(self, pattern):
+        if has_wildcard(pattern):
+            raise ValueError('HTTPStore cannot list wildcards: ' + pattern)
+        try:
+            with self._open(pattern, 'HEAD') as response:
+                return [self._info(pattern, response.headers)]
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return []
+            raise
+
+    def download(self, url, path, checksums=()):
+        with self._open(url) as response, open(path, 'wb') as f:
+            writer = HashingWriter(f, checksums)
+            shutil.copyfileobj(response, writer, RANGE_CHUNK)
+        return writer.digests()
+
+    def read_range(self, url, start, end, generation=None):
+        headers = {'Range': 'bytes={}-{}'.format(start, end - 1)}
+        with self._open(url, headers=headers) as response:
+            if response.status != 206:
+                raise IOError('{} ignored the Range request (status {})'.format(
+                    self._http_url(url), response.status))
+            remaining = end - start
+            while remaining > 0:
+                chunk = response.read(min(remaining, RANGE_CHUNK))
+                if not chunk:
+                    raise IOError('{} ended {} bytes early'.format(self._http_url(url), remaining))
+                remaining -= len(chunk)
+                yield chunk
+
+
+class ListingCache(object):
+    ''' store listings kept in memory for ttl seconds
+    '''
+
+    def __init__(self, ttl=LISTING_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _covering(self, store, pattern):
+        bucket, name = split_url(pattern)
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries.items())
+        for (entry_store, cached), (when, objects) in entries:
+            if entry_store is not store or now - when > self.ttl:
+                continue
+            if cached == pattern:
+                return objects
+            cached_bucket, cached_name = split_url(cached)
+            prefix = cached_name[:-2]
+            if (cached_bucket == bucket and cached_name.endswith('**')
+                    and not has_wildcard(prefix) and name.startswith(prefix)):
+                regex = glob_to_regex(name)
+                return [o for o in objects if regex.match(split_url(o.url)[1])]
+        return None
+
+    def list(self, pattern, store=None, refresh=False):
+        ''' store.list(pattern), or its cached answer while younger than ttl
+        '''
+        store = store or default_store()
+        if not refresh:
+            objects = self._covering(store, pattern)
+            if objects is not None:
+                return objects
+        objects = store.list(pattern)
+        with self._lock:
+            self._entries[(store, pattern)] = (time.time(), objects)
+        return objects
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# one cache for the notebook session
+session_listings = ListingCache()
+
+_default_store = None
+
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = GCSStore()
+    return _default_store
+
+
+def set_default_store(store):
+    ''' make every helper use store, e.g. a LocalStore, instead of GCS
+    '''
+    global _default_store
+    _default_store = store
@@ -0,0 +1,125 @@
+""" incremental upload of a local directory (the notebook sandbox) to a bucket
+
+notes:
+- a manifest in the directory records size, mtime and md5 of every file as
+it was last uploaded. Files whose size and mtime are unchanged are skipped
+without reading them; files whose mtime moved but whose md5 still matches
+are skipped too.
+- nothing is deleted from the bucket unless delete=True, and then only
+objects this manifest uploaded before.
+"""
+import concurrent.futures
+import json
+import os
+import time
+
+from gatk.checksum import file_digests
+from gatk.localize import DEFAULT_MAX_WORKERS, TransferResult
+from gatk.storage import default_store
+
+
+MANIFEST_NAME = '.sync_manifest.json'
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def local_files(local_dir, skip=(MANIFEST_NAME,)):
+    ''' relative paths of every file under local_dir, directories included recursively
+    '''
+    for root, dirs, files in os.walk(local_dir):
+        dirs.sort()
+        for name in sorted(files):
+            rel = os.path.relpath(os.path.join(root, name), local_dir)
+            if rel not in skip:
+                yield rel
+
+
+def changed_files(local_dir, entries):
+    ''' split local files into (changed, unchanged) against manifest entries
+
+    changed is a list of (relative path, new entry); unchanged entries get
+    their mtime refreshed when only the timestamp moved.
+    '''
+    changed, unchanged = [], []
+    for rel in local_files(local_dir):
+        path = os.path.join(local_dir, rel)
+        st = os.stat(path)
+        entry = entries.get(rel)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            unchanged.append(rel)
+            continue
+        new = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'md5': file_digests(path)['md5']}
+        if entry and entry['size'] == new['size'] and entry['md5'] == new['md5']:
+            entry['mtime_ns'] = new['mtime_ns']
+            unchanged.append(rel)
+        else:
+            changed.append((rel, new))
+    return changed, unchanged
+
+
+def _upload(store, path, url):
+    start = time.time()
+    try:
+        store.upload(path, url)
+        return TransferResult(url, path, os.path.getsize(path), time.time() - start, 'uploaded', None)
+    except Exception as e:
+        return TransferResult(url, path, 0, time.time() - start, 'failed', str(e))
+
+
+def sync_directory(local_dir, bucket_url, delete=False, manifest_path=None,
+                   max_workers=DEFAULT_MAX_WORKERS, store=None, verbose=False):
+    ''' upload new or changed files under local_dir to bucket_url
+
+    Returns one TransferResult per file with status 'uploaded', 'unchanged',
+    'deleted' or 'failed'. The manifest is keyed by bucket_url, so syncing the
+    same directory to a second bucket starts from scratch.
+    '''
+    store = store or default_store()
+    manifest_path = manifest_path or os.path.join(local_dir, MANIFEST_NAME)
+    bucket_url = bucket_url.rstrip('/')
+    manifest = load_manifest(manifest_path)
+    entries = manifest.setdefault(bucket_url, {})
+
+    changed, unchanged = changed_files(local_dir, entries)
+    results = [TransferResult(bucket_url + '/' + rel, os.path.join(local_dir, rel),
+                              0, 0.0, 'unchanged', None) for rel in unchanged]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_upload, store, os.path.join(local_dir, rel),
+                               bucket_url + '/' + rel): (rel, new) for rel, new in changed}
+        for future in concurrent.futures.as_completed(futures):
+            rel, new = futures[future]
+            result = future.result()
+            if result.status == 'uploaded':
+                entries[rel] = new
+            if verbose:
+                print('{} {} ({} bytes, {:.1f}s)'.format(result.status, result.url,
+                                                         result.bytes, result.seconds))
+            results.append(result)
+
+    if delete:
+        present = set(unchanged) | set(rel for rel, _ in changed)
+        for rel in sorted(set(entries) - present):
+            url = bucket_url + '/' + rel
+            try:
+                store.delete(url)
+                del entries[rel]
+                results.append(TransferResult(url, None, 0, 0.0, 'deleted', None))
+            except Exception as e:
+                results.append(TransferResult(url, None, 0, 0.0, 'failed', str(e)))
+
+    save_manifest(manifest, manifest_path)
+    return results
@@ -0,0 +1,256 @@
+""" indexed region queries on bgzipped VCF/GVCF (and other tabix-indexed) files
+
+notes:
+- reads the .tbi or .csi index next to the data file, picks the bins that
+overlap the region and seeks straight to their BGZF blocks, so a locus
+lookup decompresses a handful of 64 KB blocks instead of the whole file.
+- regions are the same strings the notebook passes to -L, commas allowed:
+    for rec in query_vcf('father.g.vcf.gz', '20:10,002,371-10,002,546'):
+        print(rec)
+- GVCF reference blocks are matched by their END, so a block that starts
+before the region but covers it is returned, as with tabix itself.
+- parsed indexes are kept (load_index) for the last INDEX_CACHE_SIZE index
+files and reused while the file's size and mtime stay the same, so repeated
+query_vcf calls on one file parse its index once.
+"""
+import collections
+import gzip
+import os
+import struct
+
+from gatk.bgzf import BgzfReader
+from gatk.intervals import parse_region
+from gatk.vcf import VCFHeader, Record
+
+
+TBI_MAGIC = b'TBI\x01'
+CSI_MAGIC = b'CSI\x01'
+FORMAT_VCF = 2
+MAX_POSITION = 1 << 62
+INDEX_CACHE_SIZE = 16
+
+# absolute index path -> ((size, mtime_ns), Index), least recently used first
+_indexes = collections.OrderedDict()
+
+
+def reg2bins(beg, end, min_shift=14, depth=5):
+    ''' bins that may hold features overlapping [beg, end) (0-based, half-open)
+    '''
+    bins = []
+    end -= 1
+    shift = min_shift + depth * 3
+    offset = 0
+    for level in range(depth + 1):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+        shift -= 3
+        offset += 1 << (level * 3)
+    return bins
+
+
+class Index(object):
+    ''' a parsed .tbi or .csi index
+
+    references maps contig name -> (bins, linear) where bins is
+    {bin: (loffset, [(start voffset, end voffset), ...])} and linear is the
+    tabix 16 KB linear index (empty for CSI, which keeps loffset per bin).
+    '''
+
+    def __init__(self, path):
+        with gzip.open(path, 'rb') as f:
+            data = f.read()
+        self.min_shift, self.depth = 14, 5
+        self.names = []
+        self.references = {}
+        if data[:4] == TBI_MAGIC:
+            n_ref = struct.unpack_from('<i', data, 4)[0]
+            offset = self._parse_conf(data, 8)
+            self._parse_references(data, offset, n_ref, csi=False)
+        elif data[:4] == CSI_MAGIC:
+            self.min_shift, self.depth, l_aux = struct.unpack_from('<iii', data, 4)
+            if l_aux >= 28:
+                self._parse_conf(data, 16)
+            else:
+                self.format, self.col_seq, self.col_beg, self.col_end = FORMAT_VCF, 1, 2, 0
+                self.meta, self.skip = '#', 0
+            n_ref = struct.unpack_from('<i', data, 16 + l_aux)[0]
+            self._parse_references(data, 20 + l_aux, n_ref, csi=True)
+        else:
+            raise ValueError('not a tabix or CSI index: ' + path)
+
+    def _parse_conf(self, data, offset):
+        (self.format, self.col_seq, self.col_beg, self.col_end,
+         meta, self.skip, l_nm) = struct.unpack_from('<iiiiiii', data, offset)
+        self.meta = chr(meta)
+        offset += 28
+        self.names = data[offset:offset + l_nm].split(b'\x00')[:-1]
+        self.names = [n.decode() for n in self.names]
+        return offset + l_nm
+
+    def _parse_references(self, data, offset, n_ref, csi):
+        unpack = struct.unpack_from
+        for i in range(n_ref):
+            n_bin = unpack('<i', data, offset)[0]
+            offset += 4
+            bins = {}
+            for _ in range(n_bin):
+                if csi:
+                    bin_id, loffset, n_chunk = unpack('<IQi', data, offset)
+                    offset += 16
+                else:
+                    bin_id, n_chunk = unpack('<Ii', data, offset)
+                    loffset = 0
+                    offset += 8
+                chunks = unpack('<{}Q'.format(2 * n_chunk), data, offset)
+                offset += 16 * n_chunk
+                bins[bin_id] = (loffset, list(zip(chunks[::2], chunks[1::2])))
+            linear = ()
+            if not csi:
+                n_intv = unpack('<i', data, offset)[0]
+                offset += 4
+                linear = unpack('<{}Q'.format(n_intv), data, offset)
+                offset += 8 * n_intv
+            name = self.names[i] if i < len(self.names) else str(i)
+            self.references[name] = (bins, linear)
+
+    def chunks(self, contig, beg, end):
+        ''' merged (start, end) virtual offset ranges that may hold [beg, end)
+        '''
+        if contig not in self.references:
+            return []
+        bins, linear = self.references[contig]
+        return overlapping_chunks(bins, linear, beg, end, self.min_shift, self.depth)
+
+
+def overlapping_chunks(bins, linear, beg, end, min_shift=14, depth=5):
+    ''' merged (start, end) virtual offset ranges of one reference's binning
+    index ({bin: (loffset, chunks)} plus linear index) that may hold [beg, end)
+    '''
+    max_pos = 1 << (min_shift + depth * 3)
+    wanted = reg2bins(beg, min(end, max_pos), min_shift, depth)
+    if linear:
+        min_offset = linear[min(beg >> min_shift, len(linear) - 1)]
+    else:
+        leaf = reg2bins(beg, beg + 1, min_shift, depth)[-1]
+        min_offset = bins[leaf][0] if leaf in bins else 0
+    found = sorted(c for b in wanted if b in bins for c in bins[b][1] if c[1] > min_offset)
+    merged = []
+    for start, stop in found:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(c) for c in merged]
+
+
+def load_index(path):
+    ''' the Index of an index file, parsed again only when the file changed
+    '''
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    cached = _indexes.get(key)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, Index(path))
+    _indexes[key] = cached
+    _indexes.move_to_end(key)
+    while len(_indexes) > INDEX_CACHE_SIZE:
+        _indexes.popitem(last=False)
+    return cached[1]
+
+
+def index_path_for(path):
+    for suffix in ('.tbi', '.csi'):
+        if os.path.exists(path + suffix):
+            return path + suffix
+    raise IOError('no .tbi or .csi index next to ' + path)
+
+
+def _vcf_end(fields, start):
+    ''' 0-based exclusive end of a VCF line: INFO END when present, else REF length
+    '''
+    if len(fields) > 7:
+        for item in fields[7].split(';'):
+            if item.startswith('END='):
+                return int(item[4:])
+    return start + len(fields[3])
+
+
+class TabixFile(object):
+    ''' a bgzipped, tabix/CSI-indexed file opened for repeated region queries
+    '''
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index = load_index(index_path or index_path_for(path))
+        self.reader = BgzfReader(path)
+
+    def fetch(self, region):
+        ''' the raw lines (str, without newline) overlapping a region string
+        '''
+        contig, start, end = parse_region(region)
+        beg = start - 1
+        end = MAX_POSITION if end is None else end
+        index = self.index
+        zero_based = bool(index.format & 0x10000)
+        is_vcf = (index.format & 0xffff) == FORMAT_VCF
+        for chunk_start, chunk_end in index.chunks(contig, beg, end):
+            self.reader.seek(chunk_start)
+            while self.reader.tell() < chunk_end:
+                line = self.reader.readline()
+                if not line:
+                    break
+                line = line.decode().rstrip('\n')
+                if line.startswith(index.meta):
+                    continue
+                fields = line.split('\t')
+                if fields[index.col_seq - 1] != contig:
+                    continue
+                rec_beg = int(fields[index.col_beg - 1]) - (0 if zero_based else 1)
+                if rec_beg >= end:
+                    break
+                if is_vcf:
+                    rec_end = _vcf_end(fields, rec_beg)
+                elif index.col_end:
+                    rec_end = int(fields[index.col_end - 1])
+                else:
+                    rec_end = rec_beg + 1
+                if rec_end > beg:
+                    yield line
+
+    def header(self):
+        ''' the VCF header at the start of the file
+        '''
+        self.reader.seek(0)
+        lines = []
+        while True:
+            line = self.reader.readline().decode()
+            if not line.startswith('#'):
+                break
+            lines.append(line)
+        return VCFHeader(lines)
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def query(path, region, index_path=None):
+    ''' raw lines of a bgzipped, indexed file overlapping region
+    '''
+    with TabixFile(path, index_path) as tabix:
+        for line in tabix.fetch(region):
+            yield line
+
+
+def query_vcf(path, region, index_path=None):
+    ''' gatk.vcf Records of a bgzipped, indexed VCF/GVCF overlapping region
+    '''
+    with TabixFile(path, index_path) as tabix:
+        header = tabix.header()
+        for line in tabix.fetch(region):
+            yield Record(header, line.split('\t'))
@@ -0,0 +1,292 @@
+""" streaming VCF/GVCF reader
+
+notes:
+- plain and gzipped (including bgzipped) files are read as a text stream,
+one line at a time, so memory use does not grow with the file.
+- the header is parsed once; each data line becomes a Record that keeps the
+raw column strings and only decodes INFO and FORMAT/sample values the first
+time they are accessed.
+- fields= projects columns: the line is split only as far as the last
+requested column, so the sample columns of a cohort GVCF are never split
+when only site-level fields are needed.
+
+usage:
+    for rec in read_vcf('trio_selectvariants.g.vcf', fields=('CHROM', 'POS', 'INFO')):
+        print(rec.chrom, rec.pos, rec.info.get('DP'))
+"""
+import gzip
+import itertools
+
+
+COLUMNS = ('CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT')
+SAMPLES = 'SAMPLES'
+MISSING = '.'
+
+
+def open_text(path):
+    ''' open a plain or gzip/bgzip compressed text file for reading
+    '''
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+def parse_structured_meta(value):
+    ''' '<ID=DP,Number=1,Type=Integer,Description="a, b">' -> dict
+    '''
+    value = value.strip()
+    if value.startswith('<') and value.endswith('>'):
+        value = value[1:-1]
+    out = {}
+    key, buf, quoted = None, [], False
+    for c in value + ',':
+        if c == '"':
+            quoted = not quoted
+        elif c == '=' and key is None and not quoted:
+            key = ''.join(buf)
+            buf = []
+        elif c == ',' and not quoted:
+            if key is not None:
+                out[key] = ''.join(buf)
+            key, buf = None, []
+        else:
+            buf.append(c)
+    return out
+
+
+def _converter(type_name):
+    if type_name == 'Integer':
+        return int
+    if type_name == 'Float':
+        return float
+    return str
+
+
+def decode_value(raw, definition):
+    ''' decode one INFO/FORMAT value using its header definition
+    '''
+    if definition is None:
+        return raw
+    convert = _converter(definition.get('Type'))
+    if definition.get('Number') == '1':
+        return None if raw == MISSING else convert(raw)
+    return [None if v == MISSING else convert(v) for v in raw.split(',')]
+
+
+class VCFHeader(object):
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.meta = {}
+        self.info = {}
+        self.format = {}
+        self.filters = {}
+        self.contigs = []
+        self.samples = []
+        # sample name -> its column in a data line
+        self.columns = {}
+        for line in lines:
+            if line.startswith('#CHROM'):
+                self.samples = line.rstrip('\n').split('\t')[len(COLUMNS):]
+                self.columns = {name: i for i, name in enumerate(self.samples, len(COLUMNS))}
+                continue
+            key, _, value = line[2:].rstrip('\n').partition('=')
+            if value.startswith('<'):
+                fields = parse_structured_meta(value)
+                if key == 'INFO':
+                    self.info[fields.get('ID')] = fields
+                elif key == 'FORMAT':
+                    self.format[fields.get('ID')] = fields
+                elif key == 'FILTER':
+                    self.filters[fields.get('ID')] = fields
+                elif key == 'contig':
+                    self.contigs.append(fields)
+            else:
+                self.meta.setdefault(key, []).append(value)
+
+    def __str__(self):
+        return ''.join(self.lines)
+
+
+class Record(object):
+    ''' one VCF data line, decoded on access
+    '''
+    __slots__ = ('header', 'fields', 'maxsplit', '_info', '_format', '_samples')
+
+    def __init__(self, header, fields, maxsplit=-1):
+        self.header = header
+        self.fields = fields
+        # with projection the last field holds the unsplit rest of the line
+        self.maxsplit = maxsplit
+        self._info = None
+        self._format = None
+        self._samples = None
+
+    def _column(self, i):
+        if i >= len(self.fields) or 0 <= self.maxsplit <= i:
+            raise KeyError('column {} was not read; add it to fields='.format(COLUMNS[i]))
+        return self.fields[i]
+
+    @property
+    def chrom(self):
+        return self._column(0)
+
+    @property
+    def pos(self):
+        return int(self._column(1))
+
+    @property
+    def id(self):
+        value = self._column(2)
+        return None if value == MISSING else value
+
+    @property
+    def ref(self):
+        return self._column(3)
+
+    @property
+    def alts(self):
+        value = self._column(4)
+        return [] if value == MISSING else value.split(',')
+
+    @property
+    def qual(self):
+        value = self._column(5)
+        return None if value == MISSING else float(value)
+
+    @property
+    def filters(self):
+        value = self._column(6)
+        return [] if value == MISSING else value.split(';')
+
+    @property
+    def info(self):
+        ''' INFO as a dict of decoded values; flags map to True
+        '''
+        if self._info is None:
+            self._info = {}
+            value = self._column(7)
+            if value != MISSING:
+                definitions = self.header.info
+                for item in value.split(';'):
+                    key, eq, raw = item.partition('=')
+                    self._info[key] = decode_value(raw, definitions.get(key)) if eq else True
+        return self._info
+
+    @property
+    def format(self):
+        if self._format is None:
+            self._format = self._column(8).split(':')
+        return self._format
+
+    @property
+    def samples(self):
+        ''' {sample name: {FORMAT key: decoded value}}
+        '''
+        if self._samples is None:
+            self._samples = {name: self._decode_sample(i)
+                             for i, name in enumerate(self.header.samples, len(COLUMNS))}
+        return self._samples
+
+    def sample(self, name):
+        ''' decode the FORMAT values of a single sample
+        '''
+        if self._samples is not None and name in self._samples:
+            return self._samples[name]
+        if name not in self.header.columns:
+            raise KeyError('no sample {} in this VCF'.format(name))
+        return self._decode_sample(self.header.columns[name])
+
+    def _decode_sample(self, i):
+        if self.maxsplit >= 0:
+            raise KeyError('sample columns were not read; add SAMPLES to fields=')
+        definitions = self.header.format
+        values = self.fields[i].split(':')
+        return {key: decode_value(raw, definitions.get(key))
+                for key, raw in zip(self.format, values)}
+
+    @property
+    def end(self):
+        ''' last reference base covered, using INFO END for GVCF reference blocks;
+        always an int, whether or not the header defines END
+        '''
+        end = self.info.get('END')
+        if isinstance(end, list):
+            end = end[0]
+        if end is None or end is True or end == MISSING:
+            return self.pos + len(self.ref) - 1
+        return int(end)
+
+    def __str__(self):
+        return '\t'.join(self.fields)
+
+    def __repr__(self):
+        return 'Record({}:{})'.format(self.fields[0], self.fields[1] if len(self.fields) > 1 else '?')
+
+
+def _split_count(fields):
+    ''' how many tab splits are needed to read the requested columns
+    '''
+    if fields is None or SAMPLES in fields:
+        return -1
+    return max(COLUMNS.index(f) for f in fields) + 1
+
+
+def read_header(lines):
+    ''' consume header lines from an iterator; returns (header, first data line or None)
+    '''
+    header_lines = []
+    for line in lines:
+        if line.startswith('#'):
+            header_lines.append(line)
+            if line.startswith('#CHROM'):
+                break
+        else:
+            return VCFHeader(header_lines), line
+    return VCFHeader(header_lines), None
+
+
+class VCFReader(object):
+    ''' iterate over the records of a VCF/GVCF
+
+    fields = columns to split (names from COLUMNS, plus SAMPLES for the
+    per-sample columns); None reads everything.
+    '''
+
+    def __init__(self, path, fields=None):
+        self.path = path
+        self.maxsplit = _split_count(fields)
+        self._file = open_text(path)
+        self.header, first = read_header(self._file)
+        self._pending = [first] if first is not None else []
+
+    def lines(self):
+        ''' the raw data lines, without building records
+        '''
+        return itertools.chain(self._pending, self._file)
+
+    def __iter__(self):
+        header, maxsplit = self.header, self.maxsplit
+        for line in self.lines():
+            if line.startswith('#') or not line.strip():
+                continue
+            yield Record(header, line.rstrip('\n').split('\t', maxsplit), maxsplit)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_vcf(path, fields=None):
+    ''' generator over the records of path; see VCFReader
+    '''
+    with VCFReader(path, fields) as reader:
+        for record in reader:
+            yield record
@@ -0,0 +1,100 @@
+""" VCF data lines as NumPy column arrays, a batch at a time
+
+notes:
+- batches groups the raw data lines of a VCF (gatk.vcf.VCFReader.lines())
+into lists of a fixed size, so a caller holds one batch of strings at a time.
+- split_lines turns a batch into one array per kept column: CHROM, POS, ALT,
+FORMAT and the chosen sample columns. INFO and the other site columns are
+dropped line by line; a NumPy string array is as wide as its longest value,
+so a single long INFO would otherwise widen every cell of the batch.
+- format_field, int_column and list_column pull one FORMAT key out of the
+sample columns and turn it into integers with -1 where it is absent.
+- used by gatk.pedigree, gatk.genotype_cache and gatk.annotations.
+"""
+import numpy as np
+
+from gatk.vcf import MISSING
+
+
+def batches(lines, size):
+    ''' lists of at most size data lines, header and blank lines skipped
+    '''
+    batch = []
+    for line in lines:
+        if line.startswith('#') or not line.strip():
+            continue
+        batch.append(line)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def split_lines(batch, samples=None):
+    ''' (chrom, pos, alt, format, sample fields) arrays for a batch of data
+    lines; sample fields is (lines, samples) for the chosen sample indices
+    (default: all)
+    '''
+    chrom, pos, alt, formats, fields = [], [], [], [], []
+    for line in batch:
+        words = line.rstrip('\n').split('\t', 9)
+        chrom.append(words[0])
+        pos.append(words[1])
+        alt.append(words[4])
+        formats.append(words[8] if len(words) > 8 else '')
+        values = words[9].split('\t') if len(words) > 9 else []
+        fields.append(values if samples is None else [values[i] for i in samples])
+    return (np.array(chrom), np.array(pos).astype(np.int64), np.array(alt), np.array(formats),
+            np.array(fields, dtype=str).reshape(len(batch), -1))
+
+
+def site_columns(chrom, alt, contig_codes, contigs):
+    ''' (contig, n_alleles) arrays for a split batch; contig numbers
+    continue contig_codes/contigs, which are extended in place
+    '''
+    names, inverse = np.unique(chrom, return_inverse=True)
+    for name in names:
+        if name not in contig_codes:
+            contig_codes[name] = len(contigs)
+            contigs.append(str(name))
+    lookup = np.array([contig_codes[name] for name in names], dtype=np.int32)
+    n_alleles = (np.char.count(alt, ',') + np.where(alt == MISSING, 1, 2)).astype(np.int8)
+    return lookup[inverse.ravel()], n_alleles
+
+
+def format_field(fields, formats, key):
+    ''' one FORMAT value (as strings, '.' when absent) for a (sites, samples)
+    array of sample columns, peeling fields off with np.char.partition
+    '''
+    out = np.full(fields.shape, MISSING, dtype=fields.dtype)
+    for fmt in np.unique(formats):
+        keys = fmt.split(':')
+        if key not in keys:
+            continue
+        rows = formats == fmt
+        rest = fields[rows]
+        for _ in range(keys.index(key)):
+            rest = np.char.partition(rest, ':')[..., 2]
+        out[rows] = np.char.partition(rest, ':')[..., 0]
+    return out
+
+
+def int_column(values, dtype):
+    ''' integers from strings, -1 for '' and '.'
+    '''
+    values = np.where(np.isin(values, ('', '.')), '-1', values)
+    return values.astype(np.int64).astype(dtype)
+
+
+def list_column(values, width, dtype):
+    ''' (sites, samples, width) ints from comma-separated strings, -1 padded
+    '''
+    out = np.full(values.shape + (width,), -1, dtype=dtype)
+    rest = values
+    for k in range(width):
+        head, _, rest = np.moveaxis(np.char.partition(rest, ','), -1, 0)
+        out[..., k] = int_column(head, dtype)
+        if not (rest != '').any():
+            break
+    return out
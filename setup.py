@@ -1,4 +1,4 @@
-from setuptools import setup, find_packages
+from setuptools import setup
 
 setup(name='terranblib',
       version='0.1',
@@ -7,5 +7,13 @@ setup(name='terranblib',
       author='DSP Field Engineering',
       author_email='marymorg@broadinstitute.org',
       license='MIT',
-      packages=find_packages(), #['terranblib','terranblib.gatk'],
+      # every module lives in the gatk package: gatk.localize, gatk.storage,
+      # gatk.cache, gatk.vcf, gatk.tabix, gatk.intervals, gatk.scatter, ...
+      packages=['gatk'],
+      python_requires='>=3.9',
+      install_requires=['numpy',
+                        'pandas',
+                        'matplotlib',
+                        'google-cloud-storage',
+                        'google-crc32c'],
       zip_safe=False)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from gatk.annotations import _info_columns, extract_annotations, variant_types
+from gatk.vcf import read_vcf
+
+
+HEADER = '''##fileformat=VCFv4.2
+##INFO=<ID=QD,Number=1,Type=Float,Description="Variant confidence by depth">
+##INFO=<ID=FS,Number=1,Type=Float,Description="Fisher strand">
+##INFO=<ID=MQ,Number=1,Type=Float,Description="RMS mapping quality">
+##INFO=<ID=MQRankSum,Number=1,Type=Float,Description="MQ rank sum">
+##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">
+##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP membership">
+##INFO=<ID=END,Number=1,Type=Integer,Description="End of the block">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA12878
+'''
+LINES = [
+    '20\t100\t.\tC\tT\t250.5\tPASS\tAF=0.5;DB;FS=1.2;MQ=60.00;MQRankSum=-0.5;QD=12.5\tGT\t0/1',
+    # a flag first, keys missing, a key that another key starts with
+    '20\t200\t.\tCAT\tC\t30\tLowQual\tDB;MQRankSum=0.1\tGT\t0/1',
+    '20\t300\t.\tA\tG,T\t99\tPASS\tAF=0.25,0.25;QD=3.0;MQ=55.1\tGT\t1/2',
+    '20\t400\t.\tAC\tGT\t.\tPASS\t.\tGT\t0/1',
+    '21\t500\t.\tG\tA,<NON_REF>\t40\t.\tQD=.;FS=0.0\tGT\t0/1',
+    '21\t600\t.\tG\t<NON_REF>\t.\t.\tEND=650\tGT\t0/0',
+    '21\t700\t.\tA\tAT,T\t80\tPASS\tXQD=7;FS=2.5;QD=9\tGT\t1/2',
+]
+KEYS = ('QD', 'FS', 'MQ', 'MQRankSum', 'AF')
+
+
+@pytest.fixture
+def vcf_path(tmp_path):
+    path = tmp_path / 'trio.vcf'
+    path.write_text(HEADER + '\n'.join(LINES) + '\n')
+    return str(path)
+
+
+def expected(record, key):
+    value = record.info.get(key)
+    if isinstance(value, list):
+        value = value[0]
+    return np.nan if value is None or value is True else value
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 100])
+def test_annotations_match_record_info(vcf_path, batch_size):
+    table = extract_annotations(vcf_path, annotations=KEYS, batch_size=batch_size)
+    records = list(read_vcf(vcf_path))
+    assert len(table) == len(records)
+    assert list(table['POS']) == [r.pos for r in records]
+    for key in KEYS:
+        assert table[key].dtype == np.float32
+        np.testing.assert_allclose(table[key], [expected(r, key) for r in records], rtol=1e-6)
+    np.testing.assert_allclose(table['QUAL'], [np.nan if r.qual is None else r.qual for r in records])
+    assert list(table.labels('CHROM')) == [r.chrom for r in records]
+    assert list(table.labels('FILTER')) == ['PASS', 'LowQual', 'PASS', 'PASS', '.', '.', 'PASS']
+
+
+def test_info_columns_skips_flags_and_prefixed_keys():
+    columns = _info_columns(['DB;QD=2', 'XQD=7', 'QD=1;DB', '.'], ('QD', 'DB'))
+    np.testing.assert_array_equal(columns['QD'], [2, np.nan, 1, np.nan])
+    assert np.isnan(columns['DB']).all()
+
+
+def test_variant_types():
+    ref = ['C', 'CAT', 'A', 'AC', 'G', 'G', 'A', 'A', 'T']
+    alt = ['T', 'C', 'G,T', 'GT', 'A,<NON_REF>', '<NON_REF>', 'AT,T', '.', 'TA,<NON_REF>']
+    assert list(variant_types(ref, alt)) == ['SNP', 'INDEL', 'SNP', 'MNP', 'SNP', 'SYMBOLIC',
+                                             'MIXED', 'NO_VARIATION', 'INDEL']
+
+
+def test_table_categories(vcf_path):
+    table = extract_annotations(vcf_path, annotations=KEYS, batch_size=2)
+    assert table.categories['CHROM'] == ['20', '21']
+    assert table['CHROM'].dtype == np.int8
+    assert list(table.labels('TYPE')) == ['SNP', 'INDEL', 'SNP', 'MNP', 'SNP', 'SYMBOLIC', 'MIXED']
+    frame = table.to_frame()
+    assert list(frame['TYPE'].cat.categories) == table.categories['TYPE']
+    assert frame['QD'].isna().sum() == 4
+
+
+def test_empty_vcf(tmp_path):
+    path = tmp_path / 'empty.vcf'
+    path.write_text(HEADER)
+    table = extract_annotations(str(path), annotations=KEYS)
+    assert len(table) == 0 and table['QD'].dtype == np.float32
@@ -0,0 +1,185 @@
+import os
+import random
+import struct
+
+import pytest
+
+from gatk.bam_slice import BAI_MAGIC, reg2bin, slice_bam
+from gatk.bgzf import BgzfReader, BgzfWriter
+from gatk.storage import LocalStore
+
+REFERENCES = [('20', 64444167), ('21', 48129895)]
+CIGAR_OPS = 'MIDNSHP=X'
+
+
+def encode_header():
+    text = '@HD\tVN:1.6\tSO:coordinate\n' + ''.join(
+        '@SQ\tSN:{}\tLN:{}\n'.format(name, length) for name, length in REFERENCES)
+    out = [b'BAM\x01', struct.pack('<i', len(text)), text.encode(), struct.pack('<i', len(REFERENCES))]
+    for name, length in REFERENCES:
+        out += [struct.pack('<i', len(name) + 1), name.encode() + b'\x00', struct.pack('<i', length)]
+    return b''.join(out)
+
+
+def reference_length(cigar):
+    return sum(n for n, op in cigar if op in 'MDN=X')
+
+
+def encode_record(name, ref_id, pos, cigar, qual, flag=0):
+    ''' one BAM record, block_size included
+    '''
+    length = len(qual)
+    end = pos + max(reference_length(cigar), 1)
+    read_name = name.encode() + b'\x00'
+    body = [struct.pack('<iiBBHHHIiii', ref_id, pos, len(read_name), 60, reg2bin(pos, end),
+                        len(cigar), flag, length, -1, -1, 0),
+            read_name,
+            b''.join(struct.pack('<I', n << 4 | CIGAR_OPS.index(op)) for n, op in cigar),
+            bytes([0x12] * ((length + 1) // 2)),
+            qual]
+    data = b''.join(body)
+    return struct.pack('<i', len(data)) + data
+
+
+def write_bai(path, records):
+    ''' records are (ref_id, start, end, start voffset, end voffset) in file order;
+    unmapped reads are binned at their placed position like any other
+    '''
+    refs = [({}, []) for _ in REFERENCES]
+    for ref_id, beg, end, vstart, vend in records:
+        bins, linear = refs[ref_id]
+        chunks = bins.setdefault(reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] == vstart:
+            # records written back to back share a chunk, as in samtools' indexes
+            chunks[-1] = (chunks[-1][0], vend)
+        else:
+            chunks.append((vstart, vend))
+        last = (end - 1) >> 14
+        linear.extend([0] * (last + 1 - len(linear)))
+        for window in range(beg >> 14, last + 1):
+            if linear[window] == 0:
+                linear[window] = vstart
+    out = [BAI_MAGIC, struct.pack('<i', len(refs))]
+    for bins, linear in refs:
+        out.append(struct.pack('<i', len(bins)))
+        for bin_id, chunks in bins.items():
+            out.append(struct.pack('<Ii', bin_id, len(chunks)))
+            out.extend(struct.pack('<QQ', *chunk) for chunk in chunks)
+        out.append(struct.pack('<i{}Q'.format(len(linear)), len(linear), *linear))
+    with open(path, 'wb') as f:
+        f.write(b''.join(out))
+
+
+@pytest.fixture(scope='module')
+def bam(tmp_path_factory):
+    ''' (path, {read name: (contig, 0-based start, exclusive end, mapped)}) of a
+    sorted, indexed BAM with plain, spliced, deleting and unmapped reads
+    '''
+    rng = random.Random(11)
+    reads = []
+    for i in range(60000):
+        ref_id = 0 if i % 3 else 1
+        pos = rng.randrange(9900000, 12900000)
+        kind = rng.random()
+        if kind < 0.05:
+            # unmapped, placed at its mate's position
+            reads.append((ref_id, pos, [], 4))
+        elif kind < 0.15:
+            reads.append((ref_id, pos, [(20, 'M'), (2000, 'N'), (20, 'M')], 0))
+        elif kind < 0.25:
+            reads.append((ref_id, pos, [(15, 'M'), (8, 'D'), (10, 'M'), (2, 'I'), (13, 'M')], 0))
+        else:
+            reads.append((ref_id, pos, [(40, 'M')], 0))
+    reads.sort(key=lambda r: (r[0], r[1]))
+    path = str(tmp_path_factory.mktemp('bam') / 'sample.bam')
+    expected, index_records = {}, []
+    with BgzfWriter(path) as writer:
+        writer.write(encode_header())
+        writer.flush()
+        for i, (ref_id, pos, cigar, flag) in enumerate(reads):
+            qual = bytes(rng.randrange(2, 41) for _ in range(40))
+            name = 'read{:05d}'.format(i)
+            end = pos + max(reference_length(cigar), 1)
+            vstart = writer.tell()
+            writer.write(encode_record(name, ref_id, pos, cigar, qual, flag))
+            index_records.append((ref_id, pos, end, vstart, writer.tell()))
+            expected[name] = (REFERENCES[ref_id][0], pos, end)
+    write_bai(path + '.bai', index_records)
+    return path, expected
+
+
+def read_names(path):
+    ''' names of the records in a BAM, in file order
+    '''
+    names = []
+    with BgzfReader(path) as reader:
+        reader.read(4)
+        l_text = struct.unpack('<i', reader.read(4))[0]
+        reader.read(l_text)
+        for _ in range(struct.unpack('<i', reader.read(4))[0]):
+            reader.read(struct.unpack('<i', reader.read(4))[0] + 4)
+        while True:
+            size = reader.read(4)
+            if not size:
+                return names
+            record = reader.read(struct.unpack('<i', size)[0])
+            names.append(record[32:32 + record[8] - 1].decode())
+
+
+def overlapping(expected, regions):
+    names = set()
+    for region in regions:
+        contig, span = region.split(':')
+        start, end = [int(x.replace(',', '')) for x in span.split('-')]
+        names.update(n for n, (c, s, e) in expected.items() if c == contig and s < end and e > start - 1)
+    return names
+
+
+@pytest.mark.parametrize('regions', [['20:10,000,000-10,020,000'],
+                                     ['20:10,000,000-10,020,000', '20:10,010,000-10,030,000',
+                                      '21:10,100,000-10,100,500']])
+def test_slice_holds_exactly_the_overlapping_reads(bam, tmp_path, regions):
+    path, expected = bam
+    output = str(tmp_path / 'slice.bam')
+    result = slice_bam(path, regions, output)
+    names = read_names(output)
+    assert len(names) == len(set(names)) == result.reads
+    assert set(names) == overlapping(expected, regions)
+    # spliced reads starting well before the region are found through the index
+    assert any(expected[n][1] < 10000000 - 1000 for n in names)
+
+
+def test_slice_reads_only_the_indexed_chunks(bam, tmp_path):
+    path, _ = bam
+    result = slice_bam(path, ['20:11,000,000-11,001,000'], str(tmp_path / 'slice.bam'))
+    assert result.reads > 0
+    # the index, the header and a few blocks around the region
+    assert result.bytes_fetched - os.path.getsize(path + '.bai') < result.bytes_total / 4
+
+
+def test_slice_is_indexed(bam, tmp_path):
+    path, expected = bam
+    output = str(tmp_path / 'slice.bam')
+    slice_bam(path, ['20:10,000,000-10,100,000'], output)
+    assert os.path.exists(output + '.bai')
+    inner = ['20:10,040,000-10,041,000']
+    again = str(tmp_path / 'again.bam')
+    slice_bam(output, inner, again)
+    assert set(read_names(again)) == overlapping(expected, inner)
+
+
+def test_slice_from_a_store(bam, tmp_path):
+    path, expected = bam
+    store = LocalStore(str(tmp_path / 'bucket'))
+    store.upload(path, 'gs://bucket/bams/sample.bam')
+    store.upload(path + '.bai', 'gs://bucket/bams/sample.bam.bai')
+    output = str(tmp_path / 'slice.bam')
+    regions = ['21:10,000,000-10,010,000']
+    slice_bam('gs://bucket/bams/sample.bam', regions, output, store=store)
+    assert set(read_names(output)) == overlapping(expected, regions)
+
+
+def test_unknown_contig(bam, tmp_path):
+    path, _ = bam
+    with pytest.raises(ValueError):
+        slice_bam(path, ['22:1-1000'], str(tmp_path / 'slice.bam'))
@@ -0,0 +1,155 @@
+import gzip
+import os
+import random
+import struct
+
+import pytest
+
+from gatk import tabix
+from gatk.bgzf import BGZF_EOF, BgzfReader, BgzfWriter, make_virtual_offset, split_virtual_offset
+
+
+HEADER = ('##fileformat=VCFv4.2\n'
+          '##INFO=<ID=END,Number=1,Type=Integer,Description="End of the block">\n'
+          '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+          '##contig=<ID=20,length=64444167>\n##contig=<ID=21,length=48129895>\n'
+          '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tmother\n')
+
+
+def reg2bin(beg, end):
+    ''' the smallest bin holding [beg, end), as in the SAM specification
+    '''
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+
+def write_tbi(path, names, records):
+    ''' a tabix index for a VCF; records are (contig, 0-based start, 0-based
+    exclusive end, start voffset, end voffset) in file order
+    '''
+    refs = dict((name, ({}, [])) for name in names)
+    for contig, beg, end, vstart, vend in records:
+        bins, linear = refs[contig]
+        bins.setdefault(reg2bin(beg, end), []).append((vstart, vend))
+        last = (end - 1) >> 14
+        linear.extend([0] * (last + 1 - len(linear)))
+        for window in range(beg >> 14, last + 1):
+            if linear[window] == 0:
+                linear[window] = vstart
+    names_blob = b''.join(n.encode() + b'\x00' for n in names)
+    out = [tabix.TBI_MAGIC, struct.pack('<7i', len(names), tabix.FORMAT_VCF, 1, 2, 0, ord('#'), 0),
+           struct.pack('<i', len(names_blob)), names_blob]
+    for name in names:
+        bins, linear = refs[name]
+        out.append(struct.pack('<i', len(bins)))
+        for bin_id, chunks in bins.items():
+            out.append(struct.pack('<Ii', bin_id, len(chunks)))
+            out.extend(struct.pack('<QQ', *chunk) for chunk in chunks)
+        out.append(struct.pack('<i{}Q'.format(len(linear)), len(linear), *linear))
+    with gzip.open(path, 'wb') as f:
+        f.write(b''.join(out))
+
+
+def make_gvcf(directory, n=3000, seed=7):
+    ''' a bgzipped, indexed GVCF of variants and reference blocks on two
+    contigs; returns (path, [(contig, start, end, line)])
+    '''
+    rng = random.Random(seed)
+    path = os.path.join(directory, 'sample.g.vcf.gz')
+    rows, index_records = [], []
+    with BgzfWriter(path) as writer:
+        writer.write(HEADER.encode())
+        for contig in ('20', '21'):
+            pos = 10000000
+            for _ in range(n // 2):
+                if rng.random() < 0.7:
+                    end = pos + rng.randint(0, 400)
+                    line = '{}\t{}\t.\tA\t<NON_REF>\t.\t.\tEND={}\tGT\t0/0'.format(contig, pos, end)
+                else:
+                    ref = rng.choice(['C', 'GT', 'CATG'])
+                    end = pos + len(ref) - 1
+                    line = '{}\t{}\t.\t{}\tA,<NON_REF>\t50\t.\t.\tGT\t0/1'.format(contig, pos, ref)
+                vstart = writer.tell()
+                writer.write((line + '\n').encode())
+                rows.append((contig, pos, end, line))
+                index_records.append((contig, pos - 1, end, vstart, writer.tell()))
+                pos = end + 1 + rng.randint(0, 30)
+    write_tbi(path + '.tbi', ['20', '21'], index_records)
+    return path, rows
+
+
+def test_virtual_offsets():
+    voffset = make_virtual_offset(123456, 789)
+    assert voffset == (123456 << 16) | 789
+    assert split_virtual_offset(voffset) == (123456, 789)
+
+
+def test_round_trip_across_blocks(tmp_path):
+    path = str(tmp_path / 'lines.gz')
+    lines = ['line {} {}\n'.format(i, 'x' * (i % 50)).encode() for i in range(20000)]
+    offsets = []
+    with BgzfWriter(path) as writer:
+        for line in lines:
+            offsets.append(writer.tell())
+            writer.write(line)
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data.endswith(BGZF_EOF)
+    # plain gzip reads the concatenated members
+    assert gzip.decompress(data) == b''.join(lines)
+    assert len(set(split_virtual_offset(v)[0] for v in offsets)) > 1
+    with BgzfReader(path) as reader:
+        for i in (0, 1, 9999, 12345, 19999):
+            reader.seek(offsets[i])
+            assert reader.tell() == offsets[i]
+            assert reader.readline() == lines[i]
+        reader.seek(offsets[100])
+        assert reader.read(len(lines[100]) + len(lines[101])) == lines[100] + lines[101]
+
+
+def test_reg2bins_holds_the_bin_of_every_overlapping_interval():
+    bins = set(tabix.reg2bins(100000, 100100))
+    assert reg2bin(100050, 100060) in bins
+    assert reg2bin(0, 1 << 29) in bins
+    assert reg2bin(200000, 200010) not in bins
+
+
+@pytest.mark.parametrize('region', ['20:10,000,000-10,000,500', '20:10,050,000-10,051,000',
+                                    '21:10,100,000-10,300,000', '20:10,000,777', '21',
+                                    '20:1-9,999,999'])
+def test_query_matches_a_full_scan(tmp_path, region):
+    path, rows = make_gvcf(str(tmp_path))
+    contig, start, end = tabix.parse_region(region)
+    end = end or tabix.MAX_POSITION
+    expected = [line for c, s, e, line in rows if c == contig and s <= end and e >= start]
+    assert list(tabix.query(path, region)) == expected
+
+
+def test_query_vcf_returns_blocks_covering_the_region(tmp_path):
+    path, rows = make_gvcf(str(tmp_path))
+    contig, start, end, _ = next(r for r in rows if r[2] - r[1] > 100)
+    records = list(tabix.query_vcf(path, '{}:{}-{}'.format(contig, start + 50, start + 60)))
+    assert len(records) == 1
+    assert (records[0].pos, records[0].end) == (start, end)
+    assert records[0].sample('mother')['GT'] == '0/0'
+
+
+def test_parsed_index_is_reused_until_the_file_changes(tmp_path):
+    path, _ = make_gvcf(str(tmp_path))
+    index_path = path + '.tbi'
+    first = tabix.load_index(index_path)
+    assert tabix.load_index(index_path) is first
+    stat = os.stat(index_path)
+    os.utime(index_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert tabix.load_index(index_path) is not first
+
+
+def test_missing_index(tmp_path):
+    path = str(tmp_path / 'x.vcf.gz')
+    with BgzfWriter(path) as writer:
+        writer.write(HEADER.encode())
+    with pytest.raises(IOError):
+        list(tabix.query(path, '20:1-100'))
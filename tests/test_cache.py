@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+from gatk.cache import LocalCache, cache_key, content_id, link_file
+from gatk.storage import ObjectInfo
+
+
+def info(url, data, generation='1', md5=None):
+    return ObjectInfo(url, len(data), generation, md5, None, '2024-01-01T00:00:00Z')
+
+
+class Fetcher(object):
+    ''' fetch callback writing fixed bytes and counting its calls
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LocalCache(str(tmp_path / 'cache'), max_bytes=10000)
+
+
+def test_keys():
+    a = info('gs://bucket/ref.fasta', b'ACGT')
+    assert cache_key(a) == cache_key(info('gs://bucket/ref.fasta', b'ACGT'))
+    assert cache_key(a) != cache_key(a._replace(generation='2'))
+    assert cache_key(a) != cache_key(a._replace(url='gs://bucket/other.fasta'))
+    assert content_id(a) is None
+    assert content_id(a._replace(md5='abc')) == 'md5:abc:4'
+    assert content_id(a._replace(crc32c='xyz')) == 'crc32c:xyz:4'
+
+
+def test_add_and_lookup(cache):
+    a = info('gs://bucket/ref.fasta', b'ACGT' * 10)
+    fetch = Fetcher(b'ACGT' * 10)
+    assert cache.lookup(a) is None and not cache.contains(a)
+    path = cache.add(a, fetch)
+    assert open(path, 'rb').read() == b'ACGT' * 10
+    assert cache.lookup(a) == path and cache.contains(a)
+    assert cache.add(a, fetch) == path
+    assert fetch.calls == 1
+    # a new generation of the object is a different entry
+    assert cache.lookup(a._replace(generation='2')) is None
+    assert cache.total_bytes() == 40
+
+
+def test_same_content_is_shared(cache):
+    data = b'>20\nACGT\n' * 50
+    first = info('gs://workshop-a/ref.fasta', data, md5='d41d')
+    second = info('gs://workshop-b/ref.fasta', data, generation='7', md5='d41d')
+    path = cache.add(first, Fetcher(data))
+    assert cache.contains(second)
+    fetch = Fetcher(b'never written')
+    shared = cache.add(second, fetch)
+    assert fetch.calls == 0
+    assert shared != path and open(shared, 'rb').read() == data
+    assert cache.total_bytes() == len(data)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LocalCache(str(tmp_path / 'cache'), max_bytes=250)
+    objects = [info('gs://bucket/{}'.format(i), b'x' * 100) for i in range(3)]
+    cache.add(objects[0], Fetcher(b'x' * 100))
+    cache.add(objects[1], Fetcher(b'y' * 100))
+    cache.lookup(objects[0])
+    cache.add(objects[2], Fetcher(b'z' * 100))
+    assert cache.lookup(objects[1]) is None
+    assert not os.path.exists(cache.object_path(cache_key(objects[1])))
+    assert cache.lookup(objects[0]) and cache.lookup(objects[2])
+    assert cache.total_bytes() == 200
+
+
+def test_index_is_saved_on_flush(cache):
+    a = info('gs://bucket/a', b'a' * 10)
+    cache.add(a, Fetcher(b'a' * 10))
+    assert LocalCache(cache.root).lookup(a) is None
+    cache.flush()
+    assert LocalCache(cache.root).lookup(a) == cache.object_path(cache_key(a))
+
+
+def test_flushes_of_two_caches_are_merged(cache):
+    other = LocalCache(cache.root)
+    a, b = info('gs://bucket/a', b'a'), info('gs://bucket/b', b'b')
+    cache.add(a, Fetcher(b'a'))
+    other.add(b, Fetcher(b'b'))
+    cache.flush()
+    other.flush()
+    reopened = LocalCache(cache.root)
+    assert reopened.lookup(a) and reopened.lookup(b)
+    assert reopened.total_bytes() == 2
+
+
+def test_listings(cache):
+    objects = [info('gs://bucket/a.bam', b'1234'), info('gs://bucket/a.bam.bai', b'12')]
+    assert cache.recall_listing('gs://bucket/*') is None
+    cache.remember_listing('gs://bucket/*', objects)
+    assert cache.recall_listing('gs://bucket/*') == objects
+    assert cache.recall_listing('gs://bucket/*', max_age=-1) is None
+    cache.flush()
+    assert LocalCache(cache.root).recall_listing('gs://bucket/*') == objects
+
+
+def test_clear(cache):
+    a = info('gs://bucket/a', b'a' * 10)
+    path = cache.add(a, Fetcher(b'a' * 10))
+    cache.remember_listing('gs://bucket/*', [a])
+    cache.clear()
+    assert not os.path.exists(path)
+    assert cache.total_bytes() == 0
+    reopened = LocalCache(cache.root)
+    assert reopened.lookup(a) is None and reopened.recall_listing('gs://bucket/*') is None
+
+
+def test_link_file(cache, tmp_path):
+    path = cache.add(info('gs://bucket/a', b'abc'), Fetcher(b'abc'))
+    destination = str(tmp_path / 'notebook' / 'a')
+    os.makedirs(os.path.dirname(destination))
+    with open(destination, 'w') as f:
+        f.write('stale')
+    link_file(path, destination)
+    assert os.path.samefile(path, destination)
+    link_file(path, destination)
+    assert open(destination, 'rb').read() == b'abc'
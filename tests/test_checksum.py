@@ -0,0 +1,81 @@
+import io
+import os
+
+import pytest
+
+from gatk.checksum import ChecksumError, HashingWriter, check_copy, choose_algorithm, file_digests
+from gatk.localize import download_verified, fetch_object
+from gatk.storage import ObjectInfo
+
+CHECK = b'123456789'
+CRC32C = '4waSgw=='
+MD5 = 'JfnnlDI7RTiF9RgfG2JNCw=='
+INFO = ObjectInfo('gs://bucket/check.txt', 9, 1, MD5, CRC32C, None)
+
+
+def test_hashing_writer():
+    out = io.BytesIO()
+    writer = HashingWriter(out, ('md5', 'crc32c'))
+    for piece in (b'1234', b'', b'56789'):
+        writer.write(piece)
+    assert out.getvalue() == CHECK
+    assert writer.bytes_written == 9
+    assert writer.digests() == {'md5': MD5, 'crc32c': CRC32C}
+
+
+def test_file_digests(tmp_path):
+    path = tmp_path / 'check.txt'
+    path.write_bytes(CHECK)
+    assert file_digests(str(path), ('md5', 'crc32c')) == {'md5': MD5, 'crc32c': CRC32C}
+    path.write_bytes(b'')
+    assert file_digests(str(path)) == {'md5': '1B2M2Y8AsgTpgAmY7PhCfg=='}
+
+
+def test_check_copy():
+    assert choose_algorithm(INFO) == 'crc32c'
+    assert check_copy(INFO, 9, {'crc32c': CRC32C}) == ('crc32c', None)
+    assert check_copy(INFO, 9, {'md5': MD5}) == ('md5', None)
+    assert check_copy(INFO, 9, {'md5': 'AAAA'})[1] == 'md5 AAAA != expected ' + MD5
+    assert check_copy(INFO, 8, {'crc32c': CRC32C}) == (None, 'size 8 != expected 9')
+    assert check_copy(INFO._replace(md5=None, crc32c=None), 9, {}) == ('size', None)
+
+
+class CorruptingStore(object):
+    ''' a one-object store whose first `bad` downloads flip a byte of the copy
+    '''
+
+    def __init__(self, data, bad):
+        self.data = data
+        self.bad = bad
+        self.downloads = 0
+
+    def download(self, url, path, checksums=()):
+        self.downloads += 1
+        data = bytearray(self.data)
+        if self.downloads <= self.bad:
+            data[0] ^= 0xff
+        with open(path, 'wb') as f:
+            writer = HashingWriter(f, checksums)
+            writer.write(bytes(data))
+        return writer.digests()
+
+
+def test_corrupt_download_is_retried(tmp_path):
+    store = CorruptingStore(CHECK, bad=1)
+    path = str(tmp_path / 'check.txt')
+    assert download_verified(INFO, path, store) == ('crc32c', 2)
+    assert open(path, 'rb').read() == CHECK
+
+
+def test_persistent_mismatch_fails(tmp_path):
+    store = CorruptingStore(CHECK, bad=10)
+    path = str(tmp_path / 'check.txt')
+    with pytest.raises(ChecksumError):
+        download_verified(INFO, path, store, retries=2)
+    assert store.downloads == 3
+    assert not os.path.exists(path)
+
+    result = fetch_object(INFO, str(tmp_path / 'data' / 'check.txt'), store)
+    assert (result.status, result.attempts, result.verified) == ('failed', 3, None)
+    assert 'crc32c' in result.error
+    assert os.listdir(str(tmp_path / 'data')) == []
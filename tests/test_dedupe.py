@@ -0,0 +1,97 @@
+import errno
+import os
+
+import pytest
+
+from gatk import cache
+from gatk.checksum import file_digests
+from gatk.dedupe import dedupe, find_duplicates, space_report
+
+
+@pytest.fixture
+def no_reflink(monkeypatch):
+    ''' filesystems without reflinks, so shared copies are hard links
+    '''
+    def reflink(source, destination):
+        raise OSError(errno.EOPNOTSUPP, 'no reflinks here')
+    monkeypatch.setattr(cache, 'reflink', reflink)
+
+
+@pytest.fixture
+def tutorial(tmp_path):
+    ''' ref and resources holding two copies of one file, a same-size file
+    with other content, a file of its own size and an empty one
+    '''
+    files = {'ref/ref.fasta': b'ACGT' * 100,
+             'resources/ref.fasta': b'ACGT' * 100,
+             'resources/copy/ref.fasta': b'ACGT' * 100,
+             'resources/other.fasta': b'TTTT' * 100,
+             'resources/trio.ped': b'family',
+             'ref/empty': b'',
+             'resources/empty': b''}
+    for name, data in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return tmp_path
+
+
+def dirs(root):
+    return [str(root / 'ref'), str(root / 'resources')]
+
+
+def test_find_duplicates(tutorial):
+    groups = find_duplicates(dirs(tutorial))
+    # in walk order, so the copy kept is the first one under the first directory
+    assert groups == [[[str(tutorial / 'ref/ref.fasta')],
+                       [str(tutorial / 'resources/ref.fasta')],
+                       [str(tutorial / 'resources/copy/ref.fasta')]]]
+
+
+def test_names_of_one_inode_are_one_copy(tutorial):
+    os.link(str(tutorial / 'ref/ref.fasta'), str(tutorial / 'ref/ref.fa'))
+    groups = find_duplicates(dirs(tutorial))
+    assert groups[0][0] == [str(tutorial / 'ref/ref.fa'), str(tutorial / 'ref/ref.fasta')]
+    assert len(groups[0]) == 3
+
+
+def test_same_size_files_are_compared_by_content(tutorial, monkeypatch):
+    hashed = []
+    monkeypatch.setattr('gatk.dedupe.file_digests',
+                        lambda path, algorithms: hashed.append(path) or file_digests(path, algorithms))
+    find_duplicates(dirs(tutorial))
+    # only the 400 byte files collide on size; the empty ones are never hashed
+    assert sorted(os.path.basename(p) for p in hashed) == ['other.fasta'] + ['ref.fasta'] * 3
+
+
+def test_dedupe_shares_an_inode(tutorial, no_reflink):
+    results = dedupe(dirs(tutorial))
+    source = str(tutorial / 'ref/ref.fasta')
+    assert sorted(r.path for r in results) == [str(tutorial / 'resources/copy/ref.fasta'),
+                                               str(tutorial / 'resources/ref.fasta')]
+    assert all(r.source == source and r.method == 'hardlink' and r.bytes == 400 for r in results)
+    for r in results:
+        assert os.path.samefile(r.path, source)
+    assert not os.path.samefile(str(tutorial / 'resources/other.fasta'), source)
+    assert (tutorial / 'resources/other.fasta').read_bytes() == b'TTTT' * 100
+    assert not os.path.samefile(str(tutorial / 'ref/empty'), str(tutorial / 'resources/empty'))
+
+    report = space_report(dirs(tutorial))
+    assert report['files'] == 7 and report['saved_bytes'] == 800
+    # names of one inode count as one copy, so a second run finds nothing
+    assert find_duplicates(dirs(tutorial)) == [] and dedupe(dirs(tutorial)) == []
+
+
+def test_dry_run_changes_nothing(tutorial, no_reflink):
+    results = dedupe(dirs(tutorial), dry_run=True)
+    assert [r.method for r in results] == ['dry run', 'dry run']
+    assert space_report(dirs(tutorial))['saved_bytes'] == 0
+
+
+def test_dedupe_with_reflinks_or_links(tutorial):
+    ''' whatever the filesystem offers, the copies keep their content
+    '''
+    results = dedupe(dirs(tutorial))
+    assert set(r.method for r in results) <= {'reflink', 'hardlink'}
+    for r in results:
+        assert (tutorial / r.path).read_bytes() == b'ACGT' * 100
@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from gatk import genotype_cache
+from gatk.genotype_cache import load_callset, source_hash
+
+HEADER = '''##fileformat=VCFv4.2
+##contig=<ID=20,length=64444167>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tmother\tfather
+'''
+LINES = [
+    '20\t100\t.\tC\tT\t50\tPASS\t.\tGT:GQ:DP:PL\t0/1:99:30:200,0,300\t0/0:45:20:0,45,500',
+    '20\t200\t.\tA\tG,T\t50\tPASS\t.\tGT:GQ:PL\t1/2:30:500,400,300,200,0,100\t./.:.:.',
+]
+
+
+def write_vcf(path, lines):
+    with open(path, 'w') as f:
+        f.write(HEADER + '\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def vcf(tmp_path):
+    path = str(tmp_path / 'trio.vcf')
+    write_vcf(path, LINES)
+    return path
+
+
+@pytest.fixture
+def conversions(monkeypatch):
+    ''' paths converted, counted through genotype_cache.convert
+    '''
+    calls = []
+    convert = genotype_cache.convert
+
+    def counting(path, directory, batch_size=genotype_cache.DEFAULT_BATCH_SIZE):
+        calls.append(path)
+        return convert(path, directory, batch_size)
+    monkeypatch.setattr(genotype_cache, 'convert', counting)
+    return calls
+
+
+def test_arrays(vcf, tmp_path):
+    callset = load_callset(vcf, cache_dir=str(tmp_path / 'cache'), batch_size=1)
+    assert callset.samples == ['mother', 'father'] and len(callset) == 2
+    assert list(callset.pos) == [100, 200] and list(callset.n_alleles) == [2, 3]
+    assert callset.gq.tolist() == [[99, 30], [45, -1]]
+    assert callset.dp.tolist() == [[30, -1], [20, -1]]
+    assert callset.pl.shape == (2, 2, 6)
+    assert callset.pl[0, 0].tolist() == [200, 0, 300, -1, -1, -1]
+    assert callset.pl[1, 1].tolist() == [-1] * 6
+    assert isinstance(callset.gt, np.memmap)
+
+
+def test_second_load_opens_the_entry(vcf, tmp_path, conversions):
+    cache_dir = str(tmp_path / 'cache')
+    first = load_callset(vcf, cache_dir=cache_dir)
+    second = load_callset(vcf, cache_dir=cache_dir)
+    assert conversions == [vcf]
+    assert second.directory == first.directory
+    assert os.path.basename(first.directory) == source_hash(vcf, cache_dir) + '.v1'
+
+
+def test_changed_source_gets_a_new_entry(vcf, tmp_path, conversions):
+    cache_dir = str(tmp_path / 'cache')
+    before = load_callset(vcf, cache_dir=cache_dir)
+    # same size, different genotype
+    write_vcf(vcf, [LINES[0].replace('0/1:99', '1/1:99'), LINES[1]])
+    after = load_callset(vcf, cache_dir=cache_dir)
+    assert conversions == [vcf, vcf]
+    assert after.directory != before.directory
+    assert after.gt[0, 0] != before.gt[0, 0]
+    with open(os.path.join(cache_dir, 'sources.json')) as f:
+        sources = json.load(f)
+    st = os.stat(vcf)
+    assert sources[os.path.abspath(vcf)] == [st.st_size, st.st_mtime_ns,
+                                             os.path.basename(after.directory)[:-3]]
+
+
+def test_touched_source_is_rehashed_not_reconverted(vcf, tmp_path, conversions, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    first = load_callset(vcf, cache_dir=cache_dir)
+    hashed = []
+    file_digests = genotype_cache.file_digests
+    monkeypatch.setattr(genotype_cache, 'file_digests',
+                        lambda path, algorithms: hashed.append(path) or file_digests(path, algorithms))
+    load_callset(vcf, cache_dir=cache_dir)
+    assert hashed == []
+    st = os.stat(vcf)
+    os.utime(vcf, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert load_callset(vcf, cache_dir=cache_dir).directory == first.directory
+    assert hashed == [vcf]
+    assert conversions == [vcf]
+
+
+def test_refresh_converts_again(vcf, tmp_path, conversions):
+    cache_dir = str(tmp_path / 'cache')
+    load_callset(vcf, cache_dir=cache_dir)
+    load_callset(vcf, cache_dir=cache_dir, refresh=True)
+    assert conversions == [vcf, vcf]
+    assert not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
@@ -0,0 +1,116 @@
+import pytest
+
+from gatk.gvcf_merge import merge_gvcfs
+from gatk.vcf import read_vcf
+
+SEQUENCE = 'ACGTTGCAAGCT' * 10
+HEADER = '''##fileformat=VCFv4.2
+##ALT=<ID=NON_REF,Description="Represents any possible alternative allele">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">
+##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Phred-scaled genotype likelihoods">
+##INFO=<ID=END,Number=1,Type=Integer,Description="End of the reference block">
+##contig=<ID=20,length=120>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}
+'''
+
+
+def block(start, end, gq):
+    return '20\t{}\t.\t{}\t<NON_REF>\t.\t.\tEND={}\tGT:DP:GQ:PL\t0/0:7:{}:0,21,300'.format(
+        start, SEQUENCE[start - 1], end, gq)
+
+
+def variant(pos, ref, alt, sample):
+    return '20\t{}\t.\t{}\t{},<NON_REF>\t50\t.\t.\tGT:AD:DP:GQ:PL\t{}'.format(pos, ref, alt, sample)
+
+
+def write_gvcf(path, sample, lines):
+    with open(str(path), 'w') as f:
+        f.write(HEADER.format(sample))
+        f.write(''.join(line + '\n' for line in lines))
+    return str(path)
+
+
+@pytest.fixture
+def reference(tmp_path):
+    path = str(tmp_path / 'ref.fasta')
+    with open(path, 'w') as f:
+        f.write('>20 test\n' + SEQUENCE[:60] + '\n' + SEQUENCE[60:] + '\n')
+    with open(path + '.fai', 'w') as f:
+        f.write('20\t120\t9\t60\t61\n')
+    return path
+
+
+@pytest.fixture
+def trio(tmp_path):
+    snp = variant(11, SEQUENCE[10], 'T', '0/1:4,6,0:10:40:100,0,200,150,250,300')
+    mother = write_gvcf(tmp_path / 'mother.g.vcf', 'mother', [block(1, 10, 30), snp, block(12, 40, 50)])
+    # the father has no records at 21-25
+    father = write_gvcf(tmp_path / 'father.g.vcf', 'father',
+                        [block(1, 5, 20), block(6, 20, 25), block(26, 40, 35)])
+    return [mother, father]
+
+
+def merged(paths, output, **kwargs):
+    samples = merge_gvcfs(paths, str(output), **kwargs)
+    return samples, list(read_vcf(str(output)))
+
+
+def test_blocks_are_split_at_every_input_boundary(trio, reference, tmp_path):
+    samples, records = merged(trio, tmp_path / 'trio.g.vcf', reference=reference)
+    assert samples == ['mother', 'father']
+    assert [(r.pos, r.end) for r in records] == [(1, 5), (6, 10), (11, 11), (12, 20), (21, 25), (26, 40)]
+    for r in records:
+        assert r.ref == SEQUENCE[r.pos - 1:r.pos - 1 + len(r.ref)]
+    gqs = [(r.sample('mother')['GQ'], r.sample('father')['GQ']) for r in records if 'END' in r.info]
+    assert gqs == [(30, 20), (30, 25), (50, 25), (50, None), (50, 35)]
+    assert records[4].sample('father')['GT'] == './.'
+
+
+def test_reference_samples_at_a_variant_take_their_non_ref_values(trio, reference, tmp_path):
+    _, records = merged(trio, tmp_path / 'trio.g.vcf', reference=reference)
+    site = records[2]
+    assert site.alts == ['T', '<NON_REF>']
+    assert site.sample('mother')['PL'] == [100, 0, 200, 150, 250, 300]
+    father = site.sample('father')
+    assert father['GT'] == '0/0'
+    assert father['PL'] == [0, 21, 300, 21, 300, 300]
+
+
+def test_split_block_without_a_reference(trio, tmp_path):
+    with pytest.raises(ValueError):
+        merge_gvcfs(trio, str(tmp_path / 'trio.g.vcf'))
+
+
+def test_longest_ref_wins(tmp_path):
+    snp = variant(11, 'C', 'T', '0/1:4,6,0:10:40:100,0,200,150,250,300')
+    deletion = variant(11, 'CGT', 'C', '1/1:0,9,0:9:57:300,30,0,300,30,300')
+    paths = [write_gvcf(tmp_path / 'a.g.vcf', 'a', [snp]), write_gvcf(tmp_path / 'b.g.vcf', 'b', [deletion])]
+    _, records = merged(paths, tmp_path / 'ab.g.vcf')
+    assert len(records) == 1
+    site = records[0]
+    assert (site.ref, site.alts) == ('CGT', ['TGT', 'C', '<NON_REF>'])
+    a, b = site.sample('a'), site.sample('b')
+    assert (a['GT'], a['AD']) == ('0/1', [4, 6, 0, 0])
+    assert (b['GT'], b['AD']) == ('2/2', [0, 0, 9, 0])
+    assert len(a['PL']) == len(b['PL']) == 10
+
+
+def test_region(trio, reference, tmp_path):
+    _, records = merged(trio, tmp_path / 'trio.g.vcf.gz', region='20:8-22', reference=reference)
+    assert [(r.pos, r.end) for r in records] == [(8, 10), (11, 11), (12, 20), (21, 22)]
+    assert records[0].ref == SEQUENCE[7]
+
+
+def test_inputs_must_not_share_samples(trio, tmp_path):
+    with pytest.raises(ValueError):
+        merge_gvcfs([trio[0], trio[0]], str(tmp_path / 'twice.g.vcf'))
+
+
+def test_two_records_at_one_position(tmp_path):
+    path = write_gvcf(tmp_path / 'bad.g.vcf', 'a', [block(1, 10, 30), block(1, 5, 30)])
+    other = write_gvcf(tmp_path / 'b.g.vcf', 'b', [block(1, 10, 30)])
+    with pytest.raises(ValueError):
+        merge_gvcfs([path, other], str(tmp_path / 'out.g.vcf'))
@@ -0,0 +1,130 @@
+import random
+
+import pytest
+
+from gatk.intervals import (IntervalList, format_region, parse_region, read_bed, read_intervals,
+                            split_region, write_bed, write_interval_list)
+
+LENGTHS = {'20': 600, '21': 400}
+
+
+@pytest.mark.parametrize('region, parsed', [
+    ('20:10,002,371-10,002,546', ('20', 10002371, 10002546)),
+    ('20:10002458', ('20', 10002458, 10002458)),
+    ('20', ('20', 1, None)),
+    ('20:10,000,000+', ('20', 10000000, None)),
+    ('HLA-A*01:01:01:01:5-6', ('HLA-A*01:01:01:01', 5, 6)),
+    ('chrUn:KI270302v1', ('chrUn:KI270302v1', 1, None)),
+    (' chrX:5-6\n', ('chrX', 5, 6)),
+])
+def test_parse_region(region, parsed):
+    assert parse_region(region) == parsed
+
+
+@pytest.mark.parametrize('region', ['20:0-5', '20:10-5'])
+def test_parse_invalid_region(region):
+    with pytest.raises(ValueError):
+        parse_region(region)
+
+
+def test_format_region():
+    for region in ('20', '20:5+', '20:5-9'):
+        assert format_region(*parse_region(region)) == region
+
+
+def test_split_region():
+    assert split_region('20:1-10', 3) == ['20:1-3', '20:4-6', '20:7-10']
+    assert split_region('20:1-2', 4) == ['20:1-1', '20:2-2']
+    assert split_region('20', 2, contig_length=100) == ['20:1-50', '20:51-100']
+    with pytest.raises(ValueError):
+        split_region('20', 2)
+
+
+def random_regions(rng, contigs, n):
+    out = []
+    for _ in range(n):
+        contig = rng.choice(contigs)
+        start = rng.randrange(1, LENGTHS.get(contig, 300) - 30)
+        out.append('{}:{}-{}'.format(contig, start, start + rng.randrange(30)))
+    return out
+
+
+def bases(intervals):
+    ''' the set of (contig, position) an IntervalList covers
+    '''
+    return set((intervals.contigs[c], p)
+               for c, s, e in zip(intervals.contig.tolist(), intervals.start.tolist(), intervals.end.tolist())
+               for p in range(s, e + 1))
+
+
+def is_merged(intervals):
+    keys = [(intervals.contigs[c], s, e)
+            for c, s, e in zip(intervals.contig.tolist(), intervals.start.tolist(), intervals.end.tolist())]
+    return all(a[0] != b[0] or a[2] + 1 < b[1] for a, b in zip(keys, keys[1:]))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_set_operations_match_sets_of_bases(seed):
+    rng = random.Random(seed)
+    a = IntervalList.from_strings(random_regions(rng, ['20', '21'], 40), LENGTHS)
+    # b has a contig a does not know
+    b = IntervalList.from_strings(random_regions(rng, ['22', '21', '20'], 40))
+    contigs, codes = list(a.contigs), a.contig.copy()
+    for result, expected in ((a.union(b), bases(a) | bases(b)),
+                             (a.intersect(b), bases(a) & bases(b)),
+                             (a.subtract(b), bases(a) - bases(b))):
+        assert bases(result) == expected
+        assert is_merged(result)
+    assert a.union(b).contigs == ['20', '21', '22']
+    assert a.contigs == contigs and (a.contig == codes).all()
+
+
+def test_merge():
+    intervals = IntervalList.from_strings(['20:50-60', '20:1-10', '20:11-20', '20:25-30', '21:1-5'])
+    assert intervals.merge().to_strings() == ['20:1-20', '20:25-30', '20:50-60', '21:1-5']
+    assert intervals.merge(gap=4).to_strings() == ['20:1-30', '20:50-60', '21:1-5']
+
+
+def test_pad_is_clipped_to_the_contig():
+    intervals = IntervalList.from_strings(['20:5-10', '20:590-595', '22:100-200'], LENGTHS)
+    assert intervals.pad(10).to_strings() == ['20:1-20', '20:580-600', '22:90-210']
+
+
+def test_whole_contigs_are_written_bare():
+    intervals = IntervalList.from_strings(['21', '20:1-600', '20:2+'], LENGTHS)
+    assert intervals.to_strings() == ['21', '20', '20:2-600']
+    assert intervals.total_bases() == 400 + 600 + 599
+
+
+def test_split():
+    intervals = IntervalList.from_strings(['20:1-100', '20:201-250', '21:1-150'], LENGTHS)
+    shards = intervals.split(3)
+    assert [s.total_bases() for s in shards] == [100, 100, 100]
+    assert [s.to_strings() for s in shards] == [['20:1-100'], ['20:201-250', '21:1-50'], ['21:51-150']]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_overlaps_match_a_scan(seed):
+    rng = random.Random(seed)
+    intervals = IntervalList.from_strings(random_regions(rng, ['20', '21'], 200), LENGTHS)
+    queries = random_regions(rng, ['21', '20', '22'], 50)
+    parsed = [parse_region(r) for r in intervals.to_strings()]
+    expected = []
+    for query in queries:
+        contig, start, end = parse_region(query)
+        hits = sorted((s, e) for c, s, e in parsed if c == contig and s <= end and e >= start)
+        assert sorted(parse_region(r)[1:] for r in intervals.overlapping(query).to_strings()) == hits
+        expected.append(len(hits))
+    assert intervals.overlap_counts(IntervalList.from_strings(queries)).tolist() == expected
+
+
+def test_bed_and_interval_list_round_trip(tmp_path):
+    intervals = IntervalList.from_strings(['21:1-10', '20:100-200', '20:300-300'], LENGTHS)
+    write_bed(intervals, str(tmp_path / 'targets.bed'))
+    assert (tmp_path / 'targets.bed').read_text().splitlines()[0] == '21\t0\t10'
+    assert read_bed(str(tmp_path / 'targets.bed')).to_strings() == ['21:1-10', '20:100-200', '20:300-300']
+    write_interval_list(intervals, str(tmp_path / 'targets.interval_list'))
+    again = read_intervals(str(tmp_path / 'targets.interval_list'))
+    assert again.lengths == LENGTHS
+    assert again.contigs == ['20', '21']
+    assert again.to_strings() == intervals.to_strings()
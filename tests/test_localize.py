@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+from gatk.cache import LocalCache
+from gatk.localize import fetch_objects, summarize
+from gatk.storage import LocalStore
+
+
+class SlowStore(LocalStore):
+    ''' a LocalStore whose downloads take a while and record how many overlap
+    '''
+
+    def __init__(self, root):
+        LocalStore.__init__(self, root)
+        self.running = 0
+        self.most = 0
+        self._lock = threading.Lock()
+
+    def download(self, url, path, checksums=()):
+        with self._lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        try:
+            time.sleep(0.05)
+            return LocalStore.download(self, url, path, checksums)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def tutorial(tmp_path, n=8):
+    ''' a store holding n objects of different sizes and the transfers localizing them
+    '''
+    store = SlowStore(str(tmp_path / 'bucket'))
+    transfers = []
+    for i in range(n):
+        info = store.write('gs://bucket/ref/file{}.txt'.format(i), [b'x' * (100 + i)])
+        transfers.append((info, str(tmp_path / 'notebook' / 'ref' / 'file{}.txt'.format(i))))
+    return store, transfers
+
+
+def test_copied_then_unchanged(tmp_path):
+    store, transfers = tutorial(tmp_path)
+    results = fetch_objects(transfers, max_workers=3, store=store)
+    assert sorted(r.path for r in results) == sorted(path for _, path in transfers)
+    assert set(r.status for r in results) == {'copied'}
+    assert all(r.verified in ('crc32c', 'md5') and r.attempts == 1 for r in results)
+    for info, path in transfers:
+        assert os.path.getsize(path) == info.size
+    assert summarize(results) == {'copied': (8, sum(100 + i for i in range(8)))}
+
+    again = fetch_objects(transfers, store=store)
+    assert set(r.status for r in again) == {'unchanged'}
+    assert store.most <= 3
+
+
+def test_max_workers_bounds_concurrency(tmp_path):
+    store, transfers = tutorial(tmp_path)
+    fetch_objects(transfers, max_workers=2, store=store)
+    assert store.most == 2
+    store.most = 0
+    for _, path in transfers:
+        os.remove(path)
+    fetch_objects(transfers, max_workers=1, store=store)
+    assert store.most == 1
+
+
+def test_cache_hits(tmp_path):
+    store, transfers = tutorial(tmp_path, n=3)
+    cache = LocalCache(str(tmp_path / 'cache'))
+    first = fetch_objects(transfers, store=store, cache=cache)
+    assert set(r.status for r in first) == {'copied'}
+    elsewhere = [(info, path.replace('notebook', 'other')) for info, path in transfers]
+    second = fetch_objects(elsewhere, store=store, cache=cache)
+    assert set(r.status for r in second) == {'cached'}
+    assert sum(r.bytes for r in second) == sum(info.size for info, _ in transfers)
+    for (_, a), (_, b) in zip(transfers, elsewhere):
+        assert os.path.samefile(a, b)
+
+
+def test_missing_object_fails(tmp_path):
+    store, transfers = tutorial(tmp_path, n=2)
+    store.delete(transfers[0][0].url)
+    results = dict((r.url, r) for r in fetch_objects(transfers, store=store))
+    failed = results[transfers[0][0].url]
+    assert (failed.status, failed.bytes) == ('failed', 0)
+    assert failed.error
+    assert results[transfers[1][0].url].status == 'copied'
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import pytest
+
+from gatk import locking
+from gatk.locking import FileLock, LockTimeout, atomic_path, in_progress, lock_for, lock_path
+
+
+@pytest.fixture(autouse=True)
+def lock_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(locking, 'LOCK_DIR', str(tmp_path / 'locks'))
+    return tmp_path / 'locks'
+
+
+def test_lock_excludes_others(tmp_path):
+    target = str(tmp_path / 'a.bam')
+    with lock_for(target, 'first'):
+        start = time.time()
+        with pytest.raises(LockTimeout):
+            lock_for(target, 'second', timeout=0.3).acquire()
+        assert time.time() - start >= 0.3
+    with lock_for(target, 'second', timeout=0.3):
+        pass
+
+
+def test_holder_is_recorded_while_held(tmp_path):
+    target = str(tmp_path / 'a.bam')
+    assert in_progress(target) is None
+    with lock_for(target, 'downloading a.bam'):
+        holder = in_progress(target)
+        assert holder['pid'] == os.getpid()
+        assert holder['description'] == 'downloading a.bam'
+        assert holder['since'] <= time.time()
+    assert in_progress(target) is None
+
+
+def test_lock_file_removed_on_release(tmp_path, lock_dir):
+    target = str(tmp_path / 'a.bam')
+    with lock_for(target):
+        assert os.path.exists(lock_path(target))
+    assert not os.path.exists(lock_path(target))
+    assert os.listdir(str(lock_dir)) == []
+
+
+def test_waiter_on_removed_file_starts_over(tmp_path):
+    ''' a waiter that opened the lock file before the holder removed it must
+    still exclude a newcomer that creates the file afresh
+    '''
+    target = str(tmp_path / 'a.bam')
+    first = lock_for(target).acquire()
+    waiter = lock_for(target, 'waiter')
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (waiter.acquire(), acquired.set()))
+    thread.start()
+    time.sleep(0.2)
+    first.release()
+    assert acquired.wait(5)
+    with pytest.raises(LockTimeout):
+        lock_for(target, 'newcomer', timeout=0.3).acquire()
+    assert in_progress(target)['description'] == 'waiter'
+    waiter.release()
+    thread.join()
+    assert in_progress(target) is None
+
+
+def test_lock_is_per_path(tmp_path):
+    with lock_for(str(tmp_path / 'a.bam')):
+        with lock_for(str(tmp_path / 'b.bam'), timeout=0.1):
+            pass
+
+
+def test_atomic_path_replaces_on_success(tmp_path):
+    path = str(tmp_path / 'out.txt')
+    with open(path, 'w') as f:
+        f.write('old')
+    with atomic_path(path) as tmp:
+        with open(tmp, 'w') as f:
+            f.write('new')
+        with open(path) as f:
+            assert f.read() == 'old'
+    with open(path) as f:
+        assert f.read() == 'new'
+    assert os.listdir(str(tmp_path)) == ['out.txt']
+
+
+def test_atomic_path_removes_partial_file_on_failure(tmp_path):
+    path = str(tmp_path / 'out.txt')
+    with open(path, 'w') as f:
+        f.write('old')
+    with pytest.raises(RuntimeError):
+        with atomic_path(path) as tmp:
+            with open(tmp, 'w') as f:
+                f.write('half')
+            raise RuntimeError('download failed')
+    with open(path) as f:
+        assert f.read() == 'old'
+    assert os.listdir(str(tmp_path)) == ['out.txt']
+
+
+def test_plain_file_lock(tmp_path):
+    path = str(tmp_path / 'index.json.lock')
+    with FileLock(path, 'cache index'):
+        with pytest.raises(LockTimeout):
+            FileLock(path, timeout=0.1).acquire()
+    assert not os.path.exists(path)
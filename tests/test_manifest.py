@@ -0,0 +1,100 @@
+import os
+import shutil
+
+import pytest
+
+from gatk.cache import LocalCache
+from gatk.manifest import (DiskSpaceError, ManifestEntry, PlanItem, TransferPlan, object_path,
+                           pin_manifest, plan_transfers, read_manifest, write_manifest)
+from gatk.storage import LocalStore, ObjectInfo
+
+
+@pytest.mark.parametrize('pattern, destination, url, expected', [
+    # gsutil cp -r gs://b/3-somatic/bams/** into bams/: paths below the prefix are kept
+    ('gs://b/3-somatic/bams/**', '/home/jupyter-user/bams/', 'gs://b/3-somatic/bams/tumor.bam',
+     '/home/jupyter-user/bams/tumor.bam'),
+    ('gs://b/3-somatic/bams/**', '/home/jupyter-user/bams/', 'gs://b/3-somatic/bams/normal/n.bam',
+     '/home/jupyter-user/bams/normal/n.bam'),
+    # a wildcard in the middle of a name keeps the name whole
+    ('gs://b/2-germline/ref/ref.*', '/home/jupyter-user/ref/', 'gs://b/2-germline/ref/ref.fasta.fai',
+     '/home/jupyter-user/ref/ref.fasta.fai'),
+    ('gs://b/2-germline/*/trio.ped', '/home/jupyter-user/', 'gs://b/2-germline/ped/trio.ped',
+     '/home/jupyter-user/ped/trio.ped'),
+    # single objects go into a directory destination, or become the destination
+    ('gs://b/2-germline/trio.ped', '/home/jupyter-user/2-germline-vd/', 'gs://b/2-germline/trio.ped',
+     '/home/jupyter-user/2-germline-vd/trio.ped'),
+    ('gs://b/2-germline/trio.ped', '/home/jupyter-user/family.ped', 'gs://b/2-germline/trio.ped',
+     '/home/jupyter-user/family.ped'),
+])
+def test_object_path(pattern, destination, url, expected):
+    assert object_path(ManifestEntry(pattern, destination), url) == expected
+
+
+def download(path, size):
+    return PlanItem(ManifestEntry('gs://b/big.bam', path), ObjectInfo('gs://b/big.bam', size, '1', None,
+                                                                      None, None), path, 'download')
+
+
+def test_check_space(tmp_path):
+    free = shutil.disk_usage(str(tmp_path)).free
+    path = str(tmp_path / 'not' / 'yet' / 'big.bam')
+    plan = TransferPlan([download(path, 1000)], min_free_bytes=0)
+    assert plan.space()[0][:2] == (str(tmp_path), 1000)
+    plan.check_space()
+
+    short = TransferPlan([download(path, free // 2), download(path + '2', free // 2 + 2)],
+                         min_free_bytes=0)
+    assert short.space()[0][1] == free + 2
+    with pytest.raises(DiskSpaceError, match=str(tmp_path)):
+        short.check_space()
+    # the headroom counts too
+    with pytest.raises(DiskSpaceError):
+        TransferPlan([download(path, 1000)], min_free_bytes=free).check_space()
+
+
+def test_check_space_counts_the_cache(tmp_path):
+    cache = LocalCache(str(tmp_path / 'cache'))
+    plan = TransferPlan([download('/home/jupyter-user/ref/big.bam', 1000)], cache, min_free_bytes=0)
+    # the bytes land in the cache, not at the destination
+    assert plan.space()[0][0] == os.path.join(cache.root, 'objects')
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    store = LocalStore(str(tmp_path / 'bucket'))
+    for name in ('bams/tumor.bam', 'bams/normal.bam', 'ref/ref.fasta'):
+        store.write('gs://b/3-somatic/' + name, [name.encode()])
+    return store
+
+
+def test_plan_transfers(bucket, tmp_path):
+    home = str(tmp_path / 'home')
+    ref = bucket.list('gs://b/3-somatic/ref/ref.fasta')[0]
+    manifest = [ManifestEntry('gs://b/3-somatic/bams/**', home + '/bams/', group='bams'),
+                ManifestEntry('gs://b/3-somatic/ref/ref.fasta', home + '/ref/', md5='bad', group='ref'),
+                ManifestEntry('gs://b/3-somatic/extra/*', home + '/extra/', optional=True),
+                ManifestEntry('gs://b/3-somatic/gone.vcf', home + '/')]
+    os.makedirs(home + '/bams')
+    with open(home + '/bams/tumor.bam', 'wb') as f:
+        f.write(b'bams/tumor.bam')
+
+    plan = plan_transfers(manifest, store=bucket, min_free_bytes=0)
+    actions = dict((item.path or item.entry.object, item.action) for item in plan.items)
+    assert actions == {home + '/bams/tumor.bam': 'present', home + '/bams/normal.bam': 'download',
+                       home + '/ref/ref.fasta': 'changed', 'gs://b/3-somatic/gone.vcf': 'missing'}
+    assert plan.problems() == ['{}: md5 {} != manifest bad'.format(ref.url, ref.md5),
+                               'gs://b/3-somatic/gone.vcf: no objects matched']
+    assert plan.bytes_to_download() == len(b'bams/normal.bam')
+    assert [path for _, path in plan.transfers()] == [home + '/bams/normal.bam']
+    assert [item.entry.group for item in plan_transfers(manifest, store=bucket, select=['ref']).items] == ['ref']
+
+
+def test_pin_and_round_trip(bucket, tmp_path):
+    pinned = pin_manifest([ManifestEntry('gs://b/3-somatic/bams/**', '/home/jupyter-user/bams/')],
+                          store=bucket)
+    assert sorted(e.destination for e in pinned) == ['/home/jupyter-user/bams/normal.bam',
+                                                     '/home/jupyter-user/bams/tumor.bam']
+    assert all(e.size == len(e.object.split('3-somatic/')[1]) and e.md5 and e.crc32c for e in pinned)
+    path = str(tmp_path / 'manifest.json')
+    write_manifest(path, pinned)
+    assert read_manifest(path) == pinned
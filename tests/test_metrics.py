@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from gatk.metrics import compare_metrics, load_metrics, parse_metrics, read_metrics, typed_column
+
+
+def metrics_text(rows, histogram=True):
+    lines = [
+        '## htsjdk.samtools.metrics.StringHeader',
+        '# CollectVariantCallingMetrics --INPUT trio.vcf.gz --OUTPUT trio_metrics',
+        '## htsjdk.samtools.metrics.StringHeader',
+        '# Started on: Mon Jan 01 00:00:00 UTC 2024',
+        '',
+        '## METRICS CLASS\tpicard.vcf.CollectVariantCallingMetrics$VariantCallingDetailMetrics',
+        'SAMPLE_ALIAS\tHET_HOMVAR_RATIO\tTOTAL_SNPS\tPCT_DBSNP\tNOTE',
+    ]
+    lines.extend('\t'.join(row) for row in rows)
+    if histogram:
+        lines += ['', '## HISTOGRAM\tjava.lang.Integer', 'depth\tcount', '0\t5', '1\t12', '2\t30']
+    return '\n'.join(lines) + '\n'
+
+
+TRIO = [('NA12878', '1.5', '100', '0.9', 'ok'),
+        ('NA12891', '?', '120', '', 'ok'),
+        # Picard leaves trailing empty cells out
+        ('NA12892', '1.25', '90', '0.95')]
+
+
+def test_typed_column():
+    ints = typed_column(['1', '2', '-3'])
+    assert ints.dtype == np.int64 and list(ints) == [1, 2, -3]
+    floats = typed_column(['1', '?', '', '2.5'])
+    assert floats.dtype == np.float64
+    assert floats[0] == 1 and np.isnan(floats[1]) and np.isnan(floats[2]) and floats[3] == 2.5
+    # a gap in an integer column makes it float, not str
+    assert typed_column(['1', '']).dtype == np.float64
+    strings = typed_column(['a', '?', '1'])
+    assert strings.dtype.kind == 'U' and list(strings) == ['a', '?', '1']
+
+
+def test_parse_metrics():
+    m = parse_metrics(metrics_text(TRIO).splitlines(True))
+    assert m.headers == ['CollectVariantCallingMetrics --INPUT trio.vcf.gz --OUTPUT trio_metrics',
+                         'Started on: Mon Jan 01 00:00:00 UTC 2024']
+    assert m.metrics_class.endswith('VariantCallingDetailMetrics')
+    assert m.columns() == ['SAMPLE_ALIAS', 'HET_HOMVAR_RATIO', 'TOTAL_SNPS', 'PCT_DBSNP', 'NOTE']
+    assert len(m) == 3
+    assert list(m.metrics['SAMPLE_ALIAS']) == ['NA12878', 'NA12891', 'NA12892']
+    assert m.metrics['TOTAL_SNPS'].dtype == np.int64
+    ratio = m.metrics['HET_HOMVAR_RATIO']
+    assert ratio.dtype == np.float64 and np.isnan(ratio[1]) and ratio[2] == 1.25
+    assert np.isnan(m.metrics['PCT_DBSNP'][1])
+    assert list(m.metrics['NOTE']) == ['ok', 'ok', '']
+    assert list(m.select('TOTAL_SNPS')) == ['TOTAL_SNPS']
+
+
+def test_histogram_section():
+    m = parse_metrics(metrics_text(TRIO).splitlines(True))
+    assert m.histogram_class == 'java.lang.Integer'
+    assert list(m.histogram['depth']) == [0, 1, 2]
+    assert list(m.histogram['count']) == [5, 12, 30]
+    assert list(m.to_frame(histogram=True).columns) == ['depth', 'count']
+    plain = parse_metrics(metrics_text(TRIO, histogram=False).splitlines(True))
+    assert plain.histogram_class is None and plain.histogram == {}
+
+
+def test_compare_metrics(tmp_path):
+    before = tmp_path / 'ggvcf_metrics'
+    after = tmp_path / 'cgp_metrics'
+    before.write_text(metrics_text(TRIO))
+    after.write_text(metrics_text([('NA12892', '1.0', '95', '0.95', 'ok'),
+                                   ('NA12878', '2.0', '110', '0.9', 'ok'),
+                                   ('NA00000', '1.0', '1', '0.1', 'ok')]))
+    deltas = compare_metrics(read_metrics(str(before)), read_metrics(str(after)))
+    # only keys in both runs, in sorted order
+    assert list(deltas['SAMPLE_ALIAS']) == ['NA12878', 'NA12892']
+    assert list(deltas['TOTAL_SNPS']) == [10, 5]
+    assert list(deltas['TOTAL_SNPS_before']) == [100, 90]
+    assert list(deltas['TOTAL_SNPS_after']) == [110, 95]
+    assert deltas['HET_HOMVAR_RATIO'] == pytest.approx([0.5, -0.25])
+    assert 'NOTE' not in deltas
+
+
+def test_load_metrics(tmp_path):
+    paths = []
+    for name, rows in (('a', TRIO[:1]), ('b', TRIO[1:])):
+        path = tmp_path / name
+        path.write_text(metrics_text(rows))
+        paths.append(str(path))
+    table = load_metrics(paths)
+    assert list(table['SOURCE']) == [paths[0], paths[1], paths[1]]
+    assert list(table['TOTAL_SNPS']) == [100, 120, 90]
+    assert np.isnan(table['HET_HOMVAR_RATIO'][1])
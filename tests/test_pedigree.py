@@ -0,0 +1,136 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from gatk.pedigree import (compare_callsets, decode_genotypes, genotype_code, mendelian_violations,
+                           read_genotypes, read_ped, transmission_counts, trios)
+
+SAMPLES = ['NA12877', 'NA12878', 'NA12882']
+PED = '''# family sample father mother sex phenotype
+trio NA12882 NA12877 NA12878 1 0
+trio NA12877 0 0 1 0
+trio NA12878 0 0 2 0
+'''
+HEADER = '''##fileformat=VCFv4.2
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype Quality">
+##contig=<ID=20,length=64444167>
+##contig=<ID=21,length=48129895>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}
+'''.format('\t'.join(SAMPLES))
+
+
+def write_vcf(path, sites):
+    ''' sites are (contig, pos, alts, [(GT, GQ) per sample]); a GQ of None is left out
+    '''
+    with open(str(path), 'w') as f:
+        f.write(HEADER)
+        for contig, pos, alts, calls in sites:
+            samples = [gt if gq is None else '{}:{}'.format(gt, gq) for gt, gq in calls]
+            f.write('\t'.join([contig, str(pos), '.', 'A', alts, '50', 'PASS', '.', 'GT:GQ'] + samples) + '\n')
+    return str(path)
+
+
+@pytest.fixture
+def ped(tmp_path):
+    path = tmp_path / 'trio.ped'
+    path.write_text(PED)
+    return read_ped(str(path))
+
+
+def random_sites(seed, n=500):
+    rng = random.Random(seed)
+    gts = ['0/0', '0/1', '1/1', '0|1', '1|0', './.', '1/2', '2/2', '0/2']
+    sites = []
+    for i in range(n):
+        calls = [(rng.choice(gts), rng.choice([rng.randrange(100), None])) for _ in SAMPLES]
+        alts = 'C' if all(gt[0] in '01.' and gt[-1] in '01.' for gt, _ in calls) else 'C,G'
+        sites.append(('20' if i < n // 2 else '21', 1000 + i * 10, alts, calls))
+    return sites
+
+
+def test_read_ped(ped):
+    assert [p.sample for p in ped] == ['NA12882', 'NA12877', 'NA12878']
+    assert (ped[0].father, ped[0].mother, ped[0].sex) == ('NA12877', 'NA12878', '1')
+    assert ped[1].father is None and ped[1].mother is None
+    assert trios(ped, SAMPLES).tolist() == [[2, 0, 1]]
+    assert trios(ped, SAMPLES[:2]).shape == (0, 3)
+
+
+@pytest.mark.parametrize('gt, code', [('0/0', 0), ('0/1', 1), ('1|0', 1), ('1/1', 2), ('0/2', 3),
+                                      ('2/1', 4), ('2', 5), ('0', 0), ('./.', -1), ('.', -1),
+                                      ('0/.', -1), ('0/1/1', -1)])
+def test_genotype_code(gt, code):
+    assert genotype_code(gt) == code
+
+
+def test_decode_genotypes_keeps_the_shape():
+    gts = np.array([['0/1', '1/1', './.'], ['0|0', '0/1', '1/2']])
+    assert decode_genotypes(gts).tolist() == [[1, 2, -1], [0, 1, 4]]
+
+
+def test_read_genotypes(tmp_path):
+    sites = random_sites(1)
+    path = write_vcf(tmp_path / 'calls.vcf', sites)
+    genotypes = read_genotypes(path, samples=['NA12882', 'NA12877'], batch_size=64)
+    assert len(genotypes) == len(sites)
+    assert genotypes.contigs == ['20', '21']
+    assert genotypes.pos.tolist() == [pos for _, pos, _, _ in sites]
+    assert genotypes.n_alleles.tolist() == [alts.count(',') + 2 for _, _, alts, _ in sites]
+    for row, column in ((0, 2), (1, 0)):
+        assert genotypes.codes[row].tolist() == [genotype_code(calls[column][0]) for _, _, _, calls in sites]
+        assert genotypes.gq[row].tolist() == [-1 if calls[column][1] is None else calls[column][1]
+                                              for _, _, _, calls in sites]
+
+
+def test_mendelian_violations_match_a_site_by_site_check(tmp_path, ped):
+    sites = random_sites(2)
+    genotypes = read_genotypes(write_vcf(tmp_path / 'calls.vcf', sites))
+    expected = []
+    for _, _, _, calls in sites:
+        father, mother, child = [gt.replace('|', '/').split('/') for gt, _ in calls]
+        if '.' in father + mother + child:
+            expected.append(False)
+        else:
+            expected.append(sorted(child) not in [sorted(pair) for pair in itertools.product(father, mother)])
+    assert mendelian_violations(genotypes, ped).tolist() == [expected]
+
+
+def test_transmission_counts(tmp_path, ped):
+    # (father, mother, child)
+    sites = [('0/1', '0/0', '0/1'),   # father passed his alt
+             ('0/1', '0/0', '0/0'),   # father did not
+             ('0/1', '1/1', '1/1'),   # father passed it, mother homozygous
+             ('0/1', '0/1', '1/1'),   # both passed it
+             ('0/1', '0/1', '0/1'),   # ambiguous, not counted
+             ('0/0', '0/0', '1/1'),   # violation, not counted
+             ('0/1', '0/0', './.')]   # no-call, not counted
+    path = write_vcf(tmp_path / 'calls.vcf', [('20', 100 + i, 'C', [(gt, 30) for gt in site])
+                                             for i, site in enumerate(sites)])
+    table = transmission_counts(read_genotypes(path), ped)
+    assert table['CHILD'].tolist() == ['NA12882']
+    assert table['FATHER_TRANSMITTED'].tolist() == [3]
+    assert table['FATHER_UNTRANSMITTED'].tolist() == [1]
+    assert table['MOTHER_TRANSMITTED'].tolist() == [1]
+    assert table['MOTHER_UNTRANSMITTED'].tolist() == [0]
+
+
+def test_compare_callsets(tmp_path, ped):
+    before = [('20', 100, 'C', [('0/0', 40), ('0/0', 50), ('1/1', 10)]),
+              ('20', 200, 'C', [('0/1', 40), ('0/0', 50), ('0/1', 10)]),
+              ('21', 300, 'C', [('0/1', 40), ('0/1', 50), ('1/1', None)])]
+    after = [('20', 100, 'C', [('0/0', 45), ('0/0', 50), ('0/0', 5)]),
+             ('21', 300, 'C', [('0/1', 30), ('0/1', 60), ('1/1', 20)]),
+             ('21', 400, 'C', [('0/1', 30), ('0/1', 60), ('1/1', 20)])]
+    table = compare_callsets(read_genotypes(write_vcf(tmp_path / 'before.vcf', before)),
+                             read_genotypes(write_vcf(tmp_path / 'after.vcf', after)), ped)
+    assert table['CHROM'].tolist() == ['20', '21']
+    assert table['POS'].tolist() == [100, 300]
+    assert table['CHANGED'].tolist() == [1, 0]
+    assert table['GQ_DELTA_MIN'].tolist() == [-5, -10]
+    assert table['GQ_DELTA_MAX'].tolist() == [5, 10]
+    assert table['VIOLATIONS_BEFORE'].tolist() == [1, 0]
+    assert table['VIOLATIONS_AFTER'].tolist() == [0, 0]
+    assert (table['INDEX_BEFORE'].tolist(), table['INDEX_AFTER'].tolist()) == ([0, 2], [0, 1])
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+
+import pytest
+
+from gatk.pipeline import Pipeline, Step
+
+
+def copy_step(name, source, dest, log, params=None, **kwargs):
+    ''' a Step writing dest from source (a file path or, for a first step, a literal)
+    '''
+    def action():
+        log.append(name)
+        text = open(source).read() if os.path.exists(source) else source
+        with open(dest, 'w') as f:
+            f.write(text + '+' + name)
+    inputs = [source] if os.sep in source else []
+    return Step(name, action, inputs=inputs, outputs=[dest], params=params, **kwargs)
+
+
+@pytest.fixture
+def chain(tmp_path):
+    ''' a -> b -> c, plus d which only reads a's output
+    '''
+    paths = dict((n, str(tmp_path / (n + '.txt'))) for n in 'abcd')
+    log = []
+
+    def build(params_b=1):
+        pipeline = Pipeline(state_path=str(tmp_path / 'state.json'))
+        pipeline.add(copy_step('a', 'start', paths['a'], log, params={'n': 1}))
+        pipeline.add(copy_step('b', paths['a'], paths['b'], log, params={'n': params_b}))
+        pipeline.add(copy_step('c', paths['b'], paths['c'], log, params={'n': 1}))
+        pipeline.add(copy_step('d', paths['a'], paths['d'], log, params={'n': 1}))
+        return pipeline
+    return build, paths, log
+
+
+def age(path, seconds):
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def test_dependencies(chain):
+    build, _, _ = chain
+    assert build().dependencies() == {'a': set(), 'b': {'a'}, 'c': {'b'}, 'd': {'a'}}
+
+
+def test_cycle_is_rejected(tmp_path):
+    pipeline = Pipeline()
+    x, y = str(tmp_path / 'x'), str(tmp_path / 'y')
+    pipeline.add(Step('one', lambda: None, inputs=[x], outputs=[y]))
+    pipeline.add(Step('two', lambda: None, inputs=[y], outputs=[x]))
+    with pytest.raises(ValueError, match='cycle'):
+        pipeline.dependencies()
+    with pytest.raises(ValueError, match='cycle'):
+        pipeline.run(verbose=False)
+
+
+def test_duplicate_name_is_rejected():
+    pipeline = Pipeline()
+    pipeline.add(Step('one', lambda: None))
+    with pytest.raises(ValueError):
+        pipeline.add(Step('one', lambda: None))
+
+
+def test_run_then_up_to_date(chain):
+    build, paths, log = chain
+    assert build().run(verbose=False) == dict.fromkeys('abcd', 'ran')
+    assert log.index('a') < log.index('b') < log.index('c') and log.index('a') < log.index('d')
+    with open(paths['c']) as f:
+        assert f.read() == 'start+a+b+c'
+    del log[:]
+    # a new Pipeline reads the parameters of the last run back from the state file
+    assert build().run(verbose=False) == dict.fromkeys('abcd', 'up to date')
+    assert log == []
+
+
+def test_changed_params_rerun_downstream_only(chain):
+    build, _, log = chain
+    build().run(verbose=False)
+    del log[:]
+    status = build(params_b=2).run(verbose=False)
+    assert status == {'a': 'up to date', 'b': 'ran', 'c': 'ran', 'd': 'up to date'}
+    assert log == ['b', 'c']
+
+
+def test_outdated_reasons(chain):
+    build, paths, _ = chain
+    build().run(verbose=False)
+    pipeline = build()
+    b, c = pipeline.steps[1], pipeline.steps[2]
+    assert pipeline.outdated(b, set()) is None
+    assert pipeline.outdated(b, {'a'}) == 'upstream a reran'
+    assert build(params_b=3).outdated(build(params_b=3).steps[1], set()) == 'parameters changed'
+    age(paths['b'], 100)
+    assert pipeline.outdated(b, set()) == 'inputs newer than outputs'
+    os.remove(paths['c'])
+    assert pipeline.outdated(c, set()) == 'missing outputs'
+    os.remove(paths['b'])
+    assert pipeline.outdated(c, set()) == 'missing outputs'
+    with open(paths['c'], 'w') as f:
+        f.write('x')
+    assert pipeline.outdated(c, set()) == 'missing inputs'
+
+
+def test_remote_inputs_are_not_timestamped(tmp_path):
+    out = str(tmp_path / 'out')
+    with open(out, 'w') as f:
+        f.write('x')
+    step = Step('fetch', lambda: None, inputs=['gs://bucket/in.bam'], outputs=[out])
+    assert Pipeline().outdated(step, set()) is None
+
+
+def test_dry_run(chain):
+    build, paths, log = chain
+    assert build().run(dry_run=True, verbose=False) == dict.fromkeys('abcd', 'would run')
+    assert log == [] and not any(os.path.exists(p) for p in paths.values())
+    build().run(verbose=False)
+    del log[:]
+    age(paths['a'], -100)
+    # a's output is newer than b's, so b and everything after it would rerun
+    assert build().run(dry_run=True, verbose=False) == \
+        {'a': 'up to date', 'b': 'would run', 'c': 'would run', 'd': 'would run'}
+    assert log == []
+
+
+def test_failure_blocks_downstream(chain):
+    build, paths, log = chain
+    pipeline = build()
+
+    def fail():
+        raise RuntimeError('boom')
+    pipeline.steps[1].action = fail
+    assert pipeline.run(verbose=False) == {'a': 'ran', 'b': 'failed', 'c': 'blocked', 'd': 'ran'}
+    assert 'b' not in pipeline.state
+
+
+def test_budget_limits_concurrency():
+    pipeline = Pipeline()
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def work():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.1)
+        with lock:
+            running[0] -= 1
+    for i in range(4):
+        pipeline.add(Step('s{}'.format(i), work, cpus=2))
+    assert set(pipeline.run(max_cpus=4, verbose=False).values()) == {'ran'}
+    assert peak[0] == 2
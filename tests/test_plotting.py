@@ -0,0 +1,67 @@
+import os
+import warnings
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from gatk.plotting import bin_annotations, makeScatterPlot, makeScatterPlotWithMarginalDensity
+
+GATK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gatk')
+
+
+def annotations(n=5000, seed=3):
+    rng = np.random.RandomState(seed)
+    qd = rng.gamma(4, 4, n)
+    fs = rng.exponential(5, n)
+    qd[:50] = np.nan
+    fs[50:60] = np.inf
+    return {'QD': qd, 'FS': fs, 'set': np.where(rng.rand(n) < 0.3, 'filtered', 'kept')}
+
+
+def test_bin_annotations_matches_histogram2d():
+    data = annotations()
+    groups = (data['set'] == 'kept').astype(np.int64)
+    xlim, ylim = (0.0, 30.0), (0.0, 20.0)
+    counts = bin_annotations(data['QD'], data['FS'], groups, 2, xlim, ylim, 25)
+    assert counts.shape == (2, 25, 25)
+    for g in (0, 1):
+        mask = groups == g
+        expected, _, _ = np.histogram2d(data['QD'][mask], data['FS'][mask], bins=25, range=(xlim, ylim))
+        assert (counts[g] == expected).all()
+    inside = (np.isfinite(data['QD']) & np.isfinite(data['FS']) & (data['QD'] <= 30)
+              & (data['FS'] <= 20))
+    assert counts.sum() == inside.sum()
+
+
+def test_constant_annotation_is_binned():
+    x = np.full(100, 2.0)
+    y = np.linspace(0, 1, 100)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        counts = bin_annotations(x, y, np.zeros(100, dtype=np.int64), 1, (2.0, 2.0), (0.0, 1.0), 10)
+    # 2.0 sits in the middle of the widened 1.5-2.5 range
+    assert counts[0].sum(axis=1).tolist() == [0] * 5 + [100] + [0] * 4
+    assert counts[0].sum(axis=0).tolist() == [10] * 10
+
+
+@pytest.mark.parametrize('split', [None, 'set'])
+def test_binned_plots(split):
+    data = annotations()
+    data['constant'] = np.full(len(data['QD']), 7.0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        for fig in (makeScatterPlot(data, 'QD', 'FS', split=split, bins=40),
+                    makeScatterPlotWithMarginalDensity(data, 'QD', 'FS', split=split, bins=40),
+                    makeScatterPlotWithMarginalDensity(data, 'constant', 'FS', split=split, bins=40)):
+            fig.canvas.draw()
+            plt.close(fig)
+
+
+def test_r_cell_matches_the_r_source():
+    with open(os.path.join(GATK, 'Rcode.R')) as f:
+        source = f.read()
+    with open(os.path.join(GATK, 'Rcode.py')) as f:
+        assert f.read() == '%%R\n\n' + source
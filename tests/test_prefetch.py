@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+import pytest
+
+from gatk.prefetch import URGENT, Prefetch
+from gatk.storage import LocalStore
+
+
+class GatedStore(LocalStore):
+    ''' a LocalStore recording the order of downloads; each waits for `gate` to open
+    '''
+
+    def __init__(self, root):
+        LocalStore.__init__(self, root)
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.order = []
+
+    def download(self, url, path, checksums=()):
+        self.order.append(url.rsplit('/', 1)[1])
+        self.started.set()
+        if not self.gate.wait(10):
+            raise IOError('gate never opened')
+        return LocalStore.download(self, url, path, checksums)
+
+
+def tutorial(tmp_path, n=5):
+    store = GatedStore(str(tmp_path / 'bucket'))
+    transfers = [(store.write('gs://bucket/file{}'.format(i), [b'data']),
+                  str(tmp_path / 'notebook' / 'file{}'.format(i))) for i in range(n)]
+    return store, transfers
+
+
+def test_files_arrive_in_the_order_given(tmp_path):
+    store, transfers = tutorial(tmp_path)
+    store.gate.set()
+    results = Prefetch(transfers[::-1], max_workers=1, store=store).wait()
+    assert store.order == ['file4', 'file3', 'file2', 'file1', 'file0']
+    assert [r.status for r in results] == ['copied'] * 5
+
+
+def test_wait_for_jumps_the_queue(tmp_path):
+    store, transfers = tutorial(tmp_path)
+    prefetch = Prefetch(transfers, max_workers=1, store=store)
+    store.started.wait(10)
+    waiter = threading.Thread(target=prefetch.wait_for, args=(transfers[3][1],))
+    waiter.start()
+    while not any(priority == URGENT for priority, _, _ in prefetch._queue):
+        time.sleep(0.01)
+    store.gate.set()
+    waiter.join(10)
+    prefetch.wait()
+    assert store.order == ['file0', 'file3', 'file1', 'file2', 'file4']
+    assert prefetch.wait_for(str(tmp_path / 'notebook')) == str(tmp_path / 'notebook')
+    with pytest.raises(IOError):
+        prefetch.wait_for(str(tmp_path / 'elsewhere'))
+
+
+def test_cancel(tmp_path):
+    store, transfers = tutorial(tmp_path)
+    prefetch = Prefetch(transfers, max_workers=1, store=store)
+    store.started.wait(10)
+    prefetch.cancel()
+    store.gate.set()
+    results = prefetch.wait()
+    assert [os.path.basename(r.path) for r in results] == ['file0']
+    assert not prefetch.done()
+    with pytest.raises(IOError):
+        prefetch.wait_for(transfers[2][1])
+
+
+def test_timeouts(tmp_path):
+    store, transfers = tutorial(tmp_path, n=4)
+    prefetch = Prefetch(transfers, max_workers=4, store=store)
+    with pytest.raises(IOError):
+        prefetch.wait_for(transfers[0][1], timeout=0.1)
+    start = time.time()
+    assert prefetch.wait(timeout=0.3) == []
+    # one deadline for the whole wait, not one timeout per worker
+    assert time.time() - start < 0.6
+    store.gate.set()
+    assert len(prefetch.wait()) == 4
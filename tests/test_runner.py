@@ -0,0 +1,140 @@
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+from gatk import runner
+from gatk.runner import ProgressEvent, ProgressParser, gatk_command, option_flag, run_command, run_gatk
+
+HEADER_LINE = 'INFO  ProgressMeter -        Current Locus  Elapsed Minutes     Regions Processed   Regions/Minute'
+PROGRESS_LINE = 'INFO  ProgressMeter -       20:10000117              0.5                  100            200.0'
+DONE_LINE = 'INFO  ProgressMeter - Traversal complete. Processed 250 total regions in 1.0 minutes.'
+
+# a stand-in for the gatk wrapper. It logs like a GATK tool and holds ~64 MB
+# so wait4 has something to measure. With FAKE_GATK_HANG set it starts a
+# child (the java the real wrapper would start), writes the child's pid
+# there and sleeps; FAKE_GATK_IGNORE_TERM makes both ignore SIGTERM.
+FAKE_GATK = '''#!{python}
+import os, signal, subprocess, sys, time
+ignore = 'FAKE_GATK_IGNORE_TERM' in os.environ
+if ignore:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print({header!r}, flush=True)
+if 'FAKE_GATK_HANG' in os.environ:
+    java = subprocess.Popen([sys.executable, '-c',
+                             'import signal, time\\n'
+                             + ('signal.signal(signal.SIGTERM, signal.SIG_IGN)\\n' if ignore else '')
+                             + 'time.sleep(60)'])
+    with open(os.environ['FAKE_GATK_HANG'], 'w') as f:
+        f.write(str(java.pid))
+    print({progress!r}, flush=True)
+    time.sleep(60)
+held = bytearray(64 * 2**20)
+print({progress!r})
+print('args: ' + ' '.join(sys.argv[1:]))
+print({done!r})
+sys.exit(int(os.environ.get('FAKE_GATK_EXIT', '0')))
+'''
+
+
+@pytest.fixture
+def fake_gatk(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'gatk'
+    script.write_text(FAKE_GATK.format(python=sys.executable, header=HEADER_LINE,
+                                       progress=PROGRESS_LINE, done=DONE_LINE))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setattr(runner, 'run_history', [])
+    return script
+
+
+def alive(pid):
+    ''' True unless pid is gone or a zombie waiting for its parent
+    '''
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+
+def test_option_flag_and_command():
+    assert [option_flag(n) for n in ('R', 'ERC', 'bamout', 'DBSNP', 'genomicsdb_workspace_path')] == \
+        ['-R', '-ERC', '-bamout', '--DBSNP', '--genomicsdb-workspace-path']
+    assert gatk_command('SelectVariants', V=['a.vcf', 'b.vcf'], sites_only=True, L=None,
+                        java_options='-Xmx4g') == \
+        ['gatk', '--java-options', '-Xmx4g', 'SelectVariants', '-V', 'a.vcf', '-V', 'b.vcf',
+         '--sites-only']
+
+
+def test_progress_parser():
+    parser = ProgressParser()
+    assert parser.parse('INFO  HaplotypeCaller - Initializing engine') is None
+    assert parser.parse(HEADER_LINE) is None
+    assert parser.parse(PROGRESS_LINE) == ProgressEvent('20:10000117', 30.0, 100, 200.0 / 60, 'regions')
+    assert parser.parse(DONE_LINE) == ProgressEvent('complete', 60.0, 250, 250 / 60.0, 'regions')
+
+
+def test_run_gatk(fake_gatk, tmp_path, capsys):
+    events = []
+    log = str(tmp_path / 'hc.log')
+    run = run_gatk('HaplotypeCaller', R='ref.fasta', L='20:10,000,000-10,200,000',
+                   on_progress=events.append, log_path=log)
+    assert run.name == 'HaplotypeCaller' and run.exit_status == 0
+    assert [e.locus for e in events] == ['20:10000117', 'complete']
+    assert run.progress == events
+    # usage of the wrapper comes from wait4, not from this process
+    assert run.peak_rss_bytes > 64 * 2**20
+    assert run.cpu_seconds > 0 and run.wall_seconds >= run.cpu_seconds / os.cpu_count()
+    out = capsys.readouterr().out
+    assert 'args: HaplotypeCaller -R ref.fasta -L 20:10,000,000-10,200,000' in out
+    assert 'HaplotypeCaller: exit 0' in out
+    with open(log) as f:
+        assert f.read().splitlines()[-1] == DONE_LINE
+    assert runner.run_history == [run]
+
+
+def test_exit_status(fake_gatk, monkeypatch):
+    monkeypatch.setenv('FAKE_GATK_EXIT', '3')
+    assert run_command(['gatk', 'ValidateVariants'], echo=False).exit_status == 3
+    with pytest.raises(runner.subprocess.CalledProcessError):
+        run_gatk('ValidateVariants', echo=False, check=True)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt(event):
+    raise Interrupted()
+
+
+@pytest.mark.parametrize('ignore_term', [False, True])
+def test_interrupt_stops_process_group(fake_gatk, tmp_path, monkeypatch, ignore_term):
+    ''' the wrapper and the java it started are both gone when the exception
+    reaches the caller, with SIGKILL when SIGTERM is ignored
+    '''
+    pid_file = str(tmp_path / 'java.pid')
+    monkeypatch.setenv('FAKE_GATK_HANG', pid_file)
+    if ignore_term:
+        monkeypatch.setenv('FAKE_GATK_IGNORE_TERM', '1')
+    monkeypatch.setattr(runner, 'TERMINATE_TIMEOUT', 0.5)
+    start = time.time()
+    with pytest.raises(Interrupted):
+        run_command(['gatk', 'HaplotypeCaller'], echo=False, on_progress=interrupt)
+    elapsed = time.time() - start
+    assert elapsed < 10
+    if ignore_term:
+        assert elapsed >= 0.5
+    with open(pid_file) as f:
+        java = int(f.read())
+    # the orphaned java is reaped by init, which may take a moment
+    deadline = time.time() + 5
+    while alive(java) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not alive(java)
+    assert runner.run_history == []
@@ -0,0 +1,98 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+from gatk.intervals import parse_region
+from gatk.scatter import gather_vcfs, scatter_gather, shard_path
+from gatk.vcf import read_vcf
+
+HEADER = '##fileformat=VCFv4.2\n##contig=<ID=20,length=64444167>\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+# a stand-in for the gatk wrapper: logs its arguments, writes a record every
+# 10 bases from 5 before to 5 after -L (as tools do for reads overlapping the
+# edges) and indexes by touching the index file
+FAKE_GATK = '''#!{python}
+import json, os, sys
+args = sys.argv[1:]
+with open(os.environ['FAKE_GATK_LOG'], 'a') as log:
+    log.write(json.dumps(args) + '\\n')
+options = dict((a, b) for a, b in zip(args, args[1:] + ['']) if a.startswith('-'))
+if 'IndexFeatureFile' in args:
+    open(options['-I'] + '.idx', 'w').close()
+    sys.exit(0)
+contig, span = options['-L'].split(':')
+start, end = [int(x) for x in span.split('-')]
+with open(options['-O'], 'w') as out:
+    out.write({header!r})
+    for pos in range(start - 5 - (start - 5) % 10, end + 6, 10):
+        out.write('{{}}\\t{{}}\\t.\\tA\\tC\\t50\\tPASS\\t.\\n'.format(contig, pos))
+if '-bamout' in options:
+    open(options['-bamout'], 'w').close()
+'''
+
+
+@pytest.fixture
+def fake_gatk(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'gatk'
+    script.write_text(FAKE_GATK.format(python=sys.executable, header=HEADER))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    log = tmp_path / 'gatk.log'
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('FAKE_GATK_LOG', str(log))
+
+    def calls():
+        return [json.loads(line) for line in log.read_text().splitlines()]
+    return calls
+
+
+def test_shard_path():
+    assert shard_path('sandbox/mother.bam', 2) == os.path.join('sandbox', 'mother.shard-002.bam')
+    assert shard_path('out.g.vcf.gz', 0) == 'out.shard-000.g.vcf.gz'
+
+
+def test_scatter_gather(tmp_path, fake_gatk):
+    output = str(tmp_path / 'mother.g.vcf')
+    bamout = str(tmp_path / 'mother.bam')
+    runs = scatter_gather('HaplotypeCaller', output, '20:10,000,001-10,000,100', shards=4,
+                          parallelism=2, memory_gb=4, R='ref.fasta', bamout=bamout)
+    assert [run.exit_status for run in runs] == [0] * 4
+
+    calls = fake_gatk()
+    shards = sorted((c for c in calls if 'HaplotypeCaller' in c), key=lambda c: c[c.index('-L') + 1])
+    assert [c[c.index('-L') + 1] for c in shards] == ['20:10000001-10000025', '20:10000026-10000050',
+                                                      '20:10000051-10000075', '20:10000076-10000100']
+    # 4 GB shared by the two shards running at once
+    assert all(c[:2] == ['--java-options', '-Xmx2048m'] for c in shards)
+    assert sorted(c[c.index('-bamout') + 1] for c in shards) == [shard_path(bamout, i) for i in range(4)]
+    assert calls[-1][calls[-1].index('-I') + 1] == output
+    assert os.path.exists(output + '.idx')
+
+    # every record once, though neighbouring shards both wrote those near their edge
+    assert [r.pos for r in read_vcf(output)] == list(range(10000000, 10000101, 10))[1:]
+    assert not os.path.exists(str(tmp_path / '.mother.g.vcf.shards'))
+
+
+def test_gather_keeps_records_starting_in_each_shard(tmp_path):
+    regions = ['20:1-100', '20:101-200']
+    inputs = []
+    for i, region in enumerate(regions):
+        _, start, end = parse_region(region)
+        path = str(tmp_path / 'shard-{}.vcf'.format(i))
+        with open(path, 'w') as f:
+            f.write(HEADER)
+            for pos in (start - 1, start, end, end + 1):
+                f.write('20\t{}\t.\tA\tC\t50\tPASS\t.\n'.format(pos))
+        inputs.append(path)
+    gather_vcfs(inputs, regions, str(tmp_path / 'gathered.vcf.gz'))
+    assert [r.pos for r in read_vcf(str(tmp_path / 'gathered.vcf.gz'))] == [1, 100, 101, 200]
+
+
+@pytest.mark.parametrize('option', ['L', 'O'])
+def test_per_shard_options_are_rejected(tmp_path, option):
+    with pytest.raises(ValueError):
+        scatter_gather('HaplotypeCaller', str(tmp_path / 'out.vcf'), '20:1-100', **{option: 'x'})
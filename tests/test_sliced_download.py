@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import http.server
+import io
+import os
+import re
+import threading
+
+import google_crc32c
+import pytest
+
+from gatk import localize
+from gatk.checksum import HashingWriter, combined_crc32c
+from gatk.localize import download_sliced, download_verified, fetch_object
+from gatk.storage import HTTPStore, LocalStore
+
+# not a multiple of the slice sizes used below
+DATA = os.urandom(100003)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    ''' serves DATA at every path, honouring single Range requests, and counts them
+    '''
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, length, extra=()):
+        crc = base64.b64encode(google_crc32c.value(DATA).to_bytes(4, 'big')).decode()
+        md5 = base64.b64encode(hashlib.md5(DATA).digest()).decode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('x-goog-hash', 'crc32c={},md5={}'.format(crc, md5))
+        self.send_header('Last-Modified', 'Mon, 01 Jan 2024 00:00:00 GMT')
+        for name, value in extra:
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(DATA))
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        if match is None:
+            self._headers(200, len(DATA))
+            self.wfile.write(DATA)
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(DATA) - 1)
+        RangeHandler.ranges.append((start, end))
+        self._headers(206, end - start + 1,
+                      [('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(DATA)))])
+        self.wfile.write(DATA[start:end + 1])
+
+
+def test_combined_crc32c():
+    writers = [HashingWriter(io.BytesIO(), ('crc32c',)) for _ in range(3)]
+    for writer, piece in zip(writers, (b'123', b'', b'456789')):
+        writer.write(piece)
+    # the crc32c check value of '123456789'
+    assert combined_crc32c([(w.hashes['crc32c'].value, w.bytes_written) for w in writers]) == '4waSgw=='
+
+
+@pytest.fixture
+def http_store():
+    RangeHandler.ranges = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield HTTPStore('http://127.0.0.1:{}'.format(server.server_address[1]), timeout=10)
+    server.shutdown()
+    server.server_close()
+
+
+def test_read_range(http_store):
+    assert b''.join(http_store.read_range('gs://bucket/x.bam', 10, 5000)) == DATA[10:5000]
+    assert b''.join(http_store.read_range('gs://bucket/x.bam', 99000, len(DATA))) == DATA[99000:]
+
+
+def test_download_sliced_combines_slice_checksums(http_store, tmp_path):
+    info = http_store.list('gs://bucket/x.bam')[0]
+    assert info.size == len(DATA)
+    path = str(tmp_path / 'x.bam')
+    digests = download_sliced(info, path, http_store, slice_size=16384, max_workers=4,
+                              checksums=('crc32c',))
+    assert open(path, 'rb').read() == DATA
+    assert digests == {'crc32c': info.crc32c}
+    assert sorted(RangeHandler.ranges) == [(s, min(s + 16384, len(DATA)) - 1)
+                                           for s in range(0, len(DATA), 16384)]
+
+
+def test_fetch_object_in_slices(http_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(localize, 'SLICE_THRESHOLD', 50000)
+    monkeypatch.setattr(localize, 'SLICE_SIZE', 30000)
+    monkeypatch.setattr(localize, 'file_digests', None)
+    info = http_store.list('gs://bucket/x.bam')[0]
+    path = str(tmp_path / 'data' / 'x.bam')
+    result = fetch_object(info, path, http_store)
+    assert (result.status, result.verified, result.attempts, result.bytes) == ('copied', 'crc32c', 1,
+                                                                               len(DATA))
+    assert open(path, 'rb').read() == DATA
+    assert len(RangeHandler.ranges) == 4
+
+
+def test_sliced_md5_only_is_read_back(tmp_path):
+    store = LocalStore(str(tmp_path / 'bucket'))
+    info = store.write('gs://bucket/x.bam', [DATA])._replace(crc32c=None)
+    path = str(tmp_path / 'x.bam')
+    assert download_verified(info, path, store, slice_threshold=1000, slice_size=7000) == ('md5', 1)
+    assert open(path, 'rb').read() == DATA
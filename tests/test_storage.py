@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from gatk.storage import ListingCache, ObjectInfo, glob_to_regex, split_url
+
+NAMES = ['tutorial/2-germline/trio.ped',
+         'tutorial/2-germline/ref/ref.fasta',
+         'tutorial/2-germline/ref/ref.fasta.fai',
+         'tutorial/2-germline/ref/old/ref.fasta',
+         'tutorial/2-germline-extra/notes.txt',
+         'tutorial/3-somatic/bams/tumor.bam']
+
+
+class CountingStore(object):
+    ''' an in-memory bucket that counts list calls
+    '''
+
+    def __init__(self, names, bucket='gatk-tutorials'):
+        self.objects = [ObjectInfo('gs://{}/{}'.format(bucket, n), 1, '1', None, None, None)
+                        for n in names]
+        self.calls = []
+
+    def list(self, pattern):
+        self.calls.append(pattern)
+        bucket, name = split_url(pattern)
+        regex = glob_to_regex(name)
+        return [o for o in self.objects
+                if split_url(o.url)[0] == bucket and regex.match(split_url(o.url)[1])]
+
+
+def urls(objects):
+    return sorted(o.url for o in objects)
+
+
+@pytest.fixture
+def store():
+    return CountingStore(NAMES)
+
+
+@pytest.mark.parametrize('pattern', ['gs://gatk-tutorials/tutorial/2-germline/ref/*',
+                                     'gs://gatk-tutorials/tutorial/2-germline/ref/**',
+                                     'gs://gatk-tutorials/tutorial/2-germline/*.ped',
+                                     'gs://gatk-tutorials/tutorial/2-germline/ref/ref.fasta'])
+def test_recursive_listing_answers_narrower_patterns(store, pattern):
+    cache = ListingCache()
+    cache.list('gs://gatk-tutorials/tutorial/2-germline/**', store)
+    assert urls(cache.list(pattern, store)) == urls(CountingStore(NAMES).list(pattern))
+    assert len(store.calls) == 1
+
+
+def test_single_level_pattern_stays_in_its_level(store):
+    cache = ListingCache()
+    cache.list('gs://gatk-tutorials/tutorial/2-germline/**', store)
+    assert urls(cache.list('gs://gatk-tutorials/tutorial/2-germline/ref/*', store)) == \
+        ['gs://gatk-tutorials/tutorial/2-germline/ref/ref.fasta',
+         'gs://gatk-tutorials/tutorial/2-germline/ref/ref.fasta.fai']
+
+
+@pytest.mark.parametrize('pattern', ['gs://gatk-tutorials/tutorial/3-somatic/**',
+                                     # shares the prefix as a string, not as a folder
+                                     'gs://gatk-tutorials/tutorial/2-germline-extra/*',
+                                     'gs://gatk-tutorials/tutorial/*',
+                                     'gs://other-bucket/tutorial/2-germline/ref/*'])
+def test_patterns_outside_the_listing_go_to_the_store(store, pattern):
+    cache = ListingCache()
+    cache.list('gs://gatk-tutorials/tutorial/2-germline/**', store)
+    assert urls(cache.list(pattern, store)) == urls(CountingStore(NAMES).list(pattern))
+    assert store.calls[-1] == pattern
+
+
+def test_listing_expires(store):
+    cache = ListingCache(ttl=0.1)
+    cache.list('gs://gatk-tutorials/tutorial/2-germline/**', store)
+    cache.list('gs://gatk-tutorials/tutorial/2-germline/ref/*', store)
+    assert len(store.calls) == 1
+    time.sleep(0.2)
+    cache.list('gs://gatk-tutorials/tutorial/2-germline/ref/*', store)
+    assert store.calls[-1] == 'gs://gatk-tutorials/tutorial/2-germline/ref/*'
+
+
+def test_listings_are_per_store_and_refreshable(store):
+    cache = ListingCache()
+    pattern = 'gs://gatk-tutorials/tutorial/2-germline/**'
+    cache.list(pattern, store)
+    other = CountingStore(NAMES)
+    cache.list(pattern, other)
+    assert len(other.calls) == 1
+    cache.list(pattern, store, refresh=True)
+    assert len(store.calls) == 2
+    cache.clear()
+    cache.list(pattern, store)
+    assert len(store.calls) == 3
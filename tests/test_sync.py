@@ -0,0 +1,83 @@
+import os
+
+from gatk.sync import MANIFEST_NAME, changed_files, sync_directory
+
+
+class RecordingStore(object):
+    ''' a bucket stand-in remembering what was uploaded and deleted
+    '''
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = []
+        self.deleted = []
+
+    def upload(self, path, url):
+        with open(path, 'rb') as f:
+            self.objects[url] = f.read()
+        self.uploads.append(url)
+
+    def delete(self, url):
+        del self.objects[url]
+        self.deleted.append(url)
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def statuses(results):
+    return dict((r.url.rsplit('/sandbox/', 1)[1], r.status) for r in results)
+
+
+def test_only_changed_files_are_uploaded(tmp_path):
+    sandbox = str(tmp_path / 'sandbox')
+    write(os.path.join(sandbox, 'mother.g.vcf'), 'calls')
+    write(os.path.join(sandbox, 'plots', 'qd.png'), 'png')
+    store = RecordingStore()
+    bucket = 'gs://workspace/sandbox/'
+
+    first = sync_directory(sandbox, bucket, store=store)
+    assert statuses(first) == {'mother.g.vcf': 'uploaded', 'plots/qd.png': 'uploaded'}
+    assert os.path.exists(os.path.join(sandbox, MANIFEST_NAME))
+    assert 'gs://workspace/sandbox/' + MANIFEST_NAME not in store.objects
+
+    # a touched file with the same bytes is not uploaded again
+    os.utime(os.path.join(sandbox, 'mother.g.vcf'), (0, 1))
+    write(os.path.join(sandbox, 'plots', 'qd.png'), 'new png')
+    write(os.path.join(sandbox, 'father.g.vcf'), 'calls')
+    second = sync_directory(sandbox, bucket, store=store)
+    assert statuses(second) == {'mother.g.vcf': 'unchanged', 'plots/qd.png': 'uploaded',
+                                'father.g.vcf': 'uploaded'}
+    assert store.objects['gs://workspace/sandbox/plots/qd.png'] == b'new png'
+    assert len(store.uploads) == 4
+
+
+def test_changed_files(tmp_path):
+    sandbox = str(tmp_path)
+    write(os.path.join(sandbox, 'a.txt'), 'aaa')
+    changed, unchanged = changed_files(sandbox, {})
+    assert [rel for rel, _ in changed] == ['a.txt'] and unchanged == []
+    entries = dict(changed)
+    assert entries['a.txt']['md5'] == 'R7zlx09Yn0hn29V+nKn4CA=='
+    assert changed_files(sandbox, entries) == ([], ['a.txt'])
+
+
+def test_nothing_is_deleted_unless_asked(tmp_path):
+    sandbox = str(tmp_path / 'sandbox')
+    for name in ('a.txt', 'b.txt'):
+        write(os.path.join(sandbox, name), name)
+    store = RecordingStore()
+    bucket = 'gs://workspace/sandbox'
+    store.objects[bucket + '/not-ours.txt'] = b'uploaded by someone else'
+    sync_directory(sandbox, bucket, store=store)
+    os.remove(os.path.join(sandbox, 'a.txt'))
+
+    assert statuses(sync_directory(sandbox, bucket, store=store)) == {'b.txt': 'unchanged'}
+    assert store.deleted == []
+    assert statuses(sync_directory(sandbox, bucket, store=store, delete=True)) == {
+        'b.txt': 'unchanged', 'a.txt': 'deleted'}
+    assert store.deleted == [bucket + '/a.txt']
+    assert bucket + '/not-ours.txt' in store.objects
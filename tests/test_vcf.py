@@ -0,0 +1,96 @@
+import gzip
+
+import pytest
+
+from gatk.vcf import VCFHeader, Record, parse_structured_meta, read_vcf
+
+
+HEADER = '''##fileformat=VCFv4.2
+##FILTER=<ID=LowQual,Description="Low quality">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">
+##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency, per ALT">
+##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP membership">
+##INFO=<ID=END,Number=1,Type=Integer,Description="End of the block">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">
+##contig=<ID=20,length=64444167>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tmother\tfather
+'''
+LINES = [
+    '20\t10000117\trs1\tC\tT\t250.5\tPASS\tDP=30;AF=0.5;DB\tGT:GQ:AD\t0/1:99:10,12\t0/0:45:20,0',
+    '20\t10000211\t.\tCAT\tC,CATAT\t.\tLowQual\t.\tGT:GQ:AD\t1/2:30:0,4,5\t./.:.:.',
+    '20\t10000300\t.\tG\t<NON_REF>\t.\t.\tEND=10000350\tGT:GQ\t0/0:40\t0/0:60',
+]
+
+
+@pytest.fixture
+def vcf_path(tmp_path):
+    path = tmp_path / 'trio.vcf'
+    path.write_text(HEADER + '\n'.join(LINES) + '\n')
+    return str(path)
+
+
+def test_parse_structured_meta_keeps_quoted_commas():
+    meta = parse_structured_meta('<ID=AF,Number=A,Type=Float,Description="a, b">')
+    assert meta == {'ID': 'AF', 'Number': 'A', 'Type': 'Float', 'Description': 'a, b'}
+
+
+def test_header(vcf_path):
+    with open(vcf_path) as f:
+        header = VCFHeader([line for line in f if line.startswith('#')])
+    assert header.samples == ['mother', 'father']
+    assert header.columns == {'mother': 9, 'father': 10}
+    assert set(header.info) == {'DP', 'AF', 'DB', 'END'}
+    assert header.contigs == [{'ID': '20', 'length': '64444167'}]
+    assert header.meta['fileformat'] == ['VCFv4.2']
+
+
+def test_site_columns(vcf_path):
+    first, second, block = list(read_vcf(vcf_path))
+    assert (first.chrom, first.pos, first.id, first.ref) == ('20', 10000117, 'rs1', 'C')
+    assert first.alts == ['T'] and first.qual == 250.5 and first.filters == ['PASS']
+    assert first.info == {'DP': 30, 'AF': [0.5], 'DB': True}
+    assert second.id is None and second.qual is None and second.info == {}
+    assert second.alts == ['C', 'CATAT'] and second.filters == ['LowQual']
+    assert block.info['END'] == 10000350
+
+
+def test_samples(vcf_path):
+    first, second, _ = list(read_vcf(vcf_path))
+    assert first.sample('mother') == {'GT': '0/1', 'GQ': 99, 'AD': [10, 12]}
+    assert first.samples['father']['AD'] == [20, 0]
+    assert second.sample('father') == {'GT': './.', 'GQ': None, 'AD': [None]}
+    assert list(second.samples) == ['mother', 'father']
+    assert second.samples['mother'] == second.sample('mother')
+    with pytest.raises(KeyError):
+        first.sample('child')
+
+
+def test_end(vcf_path):
+    first, second, block = list(read_vcf(vcf_path))
+    assert first.end == 10000117
+    assert second.end == 10000213
+    assert block.end == 10000350
+
+
+def test_end_is_an_int_without_an_info_definition():
+    header = VCFHeader(['##fileformat=VCFv4.2\n', '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'])
+    record = Record(header, ['20', '100', '.', 'A', '<NON_REF>', '.', '.', 'END=180'])
+    assert record.end == 180
+    assert Record(header, ['20', '100', '.', 'AC', 'A', '.', '.', 'END=.']).end == 101
+
+
+def test_projection_leaves_samples_unsplit(vcf_path):
+    records = list(read_vcf(vcf_path, fields=('CHROM', 'POS', 'INFO')))
+    assert [r.pos for r in records] == [10000117, 10000211, 10000300]
+    assert records[0].info['DP'] == 30
+    with pytest.raises(KeyError):
+        records[0].sample('mother')
+
+
+def test_gzipped_input(vcf_path, tmp_path):
+    gz = tmp_path / 'trio.vcf.gz'
+    with open(vcf_path, 'rb') as src, gzip.open(str(gz), 'wb') as dst:
+        dst.write(src.read())
+    assert [str(r) for r in read_vcf(str(gz))] == LINES